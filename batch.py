@@ -0,0 +1,285 @@
+"""
+Migrating many components from HLCPP in one go.
+
+Components are migrated in dependency order, leaves first, so that later
+migrations build against dependencies that have already been migrated and
+built. Each migration is a separate `village run` process; they share the
+build output directory, taking turns to build. Runs in the same checkout would
+lose each other's edits to the visibility list, so successful components are
+removed from it here, one at a time, rather than by the model.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+from pathlib import Path
+
+import summarize
+from tasks.hlcpp_migration import HlcppMigration
+from task_runner import MODELS
+
+VISIBILITY_FILE = "build/cpp/hlcpp_visibility.gni"
+
+
+def visibility_labels(text: str) -> list[str]:
+    # "//foo/*" and "//foo:*" patterns become the directory's default target
+    return [
+        label.removesuffix("/*").removesuffix(":*")
+        for label in re.findall(r'"(//[^"]+)"', text)
+    ]
+
+
+def discover_components() -> list[str]:
+    """The targets still allowed to use HLCPP."""
+    components = []
+    for label in visibility_labels(open(VISIBILITY_FILE).read()):
+        if label not in components:
+            components.append(label)
+    return components
+
+
+def remove_from_visibility(component: str) -> bool:
+    """Remove the lines referencing a migrated component from the visibility
+    list. Returns whether any were removed."""
+    lines = open(VISIBILITY_FILE).readlines()
+    kept = [line for line in lines if component not in visibility_labels(line)]
+    if len(kept) == len(lines):
+        return False
+    with open(VISIBILITY_FILE, "wt") as f:
+        f.writelines(kept)
+    return True
+
+
+def read_components(path: Path) -> list[str]:
+    """Read GN labels, one per line. Blank lines and # comments are ignored."""
+    components = []
+    for line in open(path):
+        line = line.split("#", 1)[0].strip()
+        if line:
+            components.append(line if line.startswith("//") else f"//{line}")
+    return components
+
+
+def component_dir(label: str) -> str:
+    return label[2:].split("(", 1)[0].split(":", 1)[0]
+
+
+async def gn_deps(label: str) -> set[str]:
+    """All of the dependencies of a GN target."""
+    process = await asyncio.create_subprocess_exec(
+        *["fx", "gn", "desc", "out/default", label, "deps", "--all"],
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    stdout, _ = await process.communicate()
+    if process.returncode != 0:
+        print(f"BATCH: couldn't find dependencies of {label}")
+    return {l.strip() for l in stdout.decode().splitlines() if l.startswith("//")}
+
+
+def dependency_graph(
+    components: list[str], deps: dict[str, set[str]]
+) -> dict[str, set[str]]:
+    """For each component, the other components it depends on.
+
+    A component depends on another if it depends on any target in the other's
+    directory (the most specific one, when component directories are nested).
+    """
+    dirs = {component_dir(c): c for c in components}
+    graph: dict[str, set[str]] = {c: set() for c in components}
+    for c in components:
+        for dep in deps.get(c, set()):
+            path = component_dir(dep)
+            while path:
+                if path in dirs:
+                    if dirs[path] != c:
+                        graph[c].add(dirs[path])
+                    break
+                path = os.path.dirname(path)
+    return graph
+
+
+def leaves_first(graph: dict[str, set[str]]) -> list[str]:
+    """Order components so that each comes after what it depends on. Cycles are
+    broken arbitrarily."""
+    order: list[str] = []
+    remaining = {c: set(deps) for c, deps in graph.items()}
+    while remaining:
+        ready = sorted(c for c, deps in remaining.items() if not deps)
+        if not ready:
+            # a cycle: pick the component waiting on the fewest others
+            ready = [min(remaining, key=lambda c: (len(remaining[c]), c))]
+        for c in ready:
+            del remaining[c]
+            for deps in remaining.values():
+                deps.discard(c)
+        order.extend(ready)
+    return order
+
+
+def village_command(
+    task: str, task_args: list[str], output: Path, run_args: list[str]
+) -> list[str]:
+    """The command line to run a task in a separate process."""
+    village = os.path.join(os.path.dirname(os.path.abspath(__file__)), "village.py")
+    return [
+        sys.executable,
+        village,
+        "run",
+        "--output",
+        str(output),
+        *run_args,
+        task,
+        *task_args,
+    ]
+
+
+class Batch:
+    def __init__(self, args: argparse.Namespace, components: list[str]):
+        self.components = components
+        self.workers = args.workers
+        self.output_dir: Path = args.output_dir
+        self.run_args = [
+            "--model",
+            args.model,
+            "--temperature",
+            str(args.temperature),
+            "--build-lock",
+            str((self.output_dir / "build.lock").resolve()),
+            "--stop-build-after-errors",
+            str(args.stop_build_after_errors),
+        ]
+        if args.cascade:
+            self.run_args.append("--cascade")
+        if args.tool_cache:
+            self.run_args.extend(["--tool-cache", str(args.tool_cache)])
+        self.results: dict[str, dict] = {}
+
+    def save_results(self):
+        with open(self.output_dir / "results.json", "wt") as f:
+            json.dump(self.results, f, indent=2)
+
+    async def migrate(self, component: str, semaphore: asyncio.Semaphore):
+        name = component_dir(component).replace("/", "_")
+        recording = self.output_dir / f"{name}.json"
+        log = self.output_dir / f"{name}.log"
+        command = village_command(
+            HlcppMigration.NAME,
+            [
+                "--component-dir",
+                component_dir(component),
+                "--component-target",
+                component,
+                "--leave-visibility",
+            ],
+            recording,
+            self.run_args,
+        )
+        async with semaphore:
+            print(f"BATCH: migrating {component}")
+            with open(log, "wb") as f:
+                process = await asyncio.create_subprocess_exec(
+                    *command, stdout=f, stderr=asyncio.subprocess.STDOUT
+                )
+                returncode = await process.wait()
+
+        result: dict = {"returncode": returncode, "recording": str(recording)}
+        try:
+            s = summarize.summarize(recording)
+            result.update(status=s.status, duration=s.duration, tokens=s.tokens)
+        except Exception as e:
+            result.update(status="ERROR", error=repr(e))
+        if result["status"] == "SUCCESS":
+            # nothing else touches the file while this runs
+            result["visibility_removed"] = remove_from_visibility(component)
+        print(f"BATCH: {component} {result['status']}")
+        self.results[component] = result
+        self.save_results()
+
+    async def run(self):
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        semaphore = asyncio.Semaphore(self.workers)
+
+        async def desc(label):
+            async with semaphore:
+                return label, await gn_deps(label)
+
+        print(f"BATCH: finding dependencies of {len(self.components)} components")
+        deps = dict(await asyncio.gather(*[desc(c) for c in self.components]))
+        graph = dependency_graph(self.components, deps)
+
+        # Each component starts once everything it depends on has finished.
+        finished = {c: asyncio.Event() for c in self.components}
+        order = leaves_first(graph)
+        position = {c: i for i, c in enumerate(order)}
+
+        async def when_ready(component):
+            for dep in graph[component]:
+                # dependencies later in the order were part of a cycle
+                if position[dep] < position[component]:
+                    await finished[dep].wait()
+            try:
+                await self.migrate(component, semaphore)
+            finally:
+                finished[component].set()
+
+        await asyncio.gather(*[when_ready(c) for c in order])
+
+
+def batch_command(args: argparse.Namespace):
+    if args.components:
+        components = read_components(args.components)
+    else:
+        components = discover_components()
+    asyncio.run(Batch(args, components).run())
+
+
+def add_subcommand(subcommands: argparse._SubParsersAction):
+    parser = subcommands.add_parser(
+        "batch",
+        help="Migrate many components from HLCPP, in dependency order.",
+    )
+    parser.add_argument(
+        "--components",
+        type=Path,
+        help="A file listing the GN labels of the components to migrate, one per "
+        + f"line. Defaults to every target in {VISIBILITY_FILE}.",
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=Path,
+        required=True,
+        help="Where to put recordings, logs and results.json.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="How many migrations to run at once.",
+    )
+    parser.add_argument(
+        "--model",
+        type=str,
+        default=MODELS[0],
+        choices=MODELS,
+        help="The LLM model to use.",
+    )
+    parser.add_argument(
+        "--temperature", type=float, default=1, help="The LLM temperature."
+    )
+    parser.add_argument(
+        "--cascade", action="store_true", help="Use the model cascade for each run."
+    )
+    parser.add_argument(
+        "--tool-cache", type=Path, help="A tool result cache shared by the runs."
+    )
+    parser.add_argument(
+        "--stop-build-after-errors",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Stop builds once N distinct errors have been seen.",
+    )
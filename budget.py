@@ -0,0 +1,67 @@
+"""
+Limits on the resources a run may use.
+
+A run normally only ends when the model calls success or fail. A budget ends
+it early, as a failure, once it has used too many tokens, taken too long, run
+too many builds or taken too many turns.
+"""
+
+import time
+
+
+class Budget:
+    BUILD_TOOLS = ("fx_build",)
+
+    def __init__(
+        self,
+        max_tokens: int | None = None,
+        max_minutes: float | None = None,
+        max_builds: int | None = None,
+        max_turns: int | None = None,
+    ):
+        self.max_tokens = max_tokens
+        self.max_minutes = max_minutes
+        self.max_builds = max_builds
+        self.max_turns = max_turns
+        self.start = time.monotonic()
+        self.tokens = 0
+        self.builds = 0
+        self.turns = 0
+
+    def limits(self) -> dict:
+        return {
+            "max_tokens": self.max_tokens,
+            "max_minutes": self.max_minutes,
+            "max_builds": self.max_builds,
+            "max_turns": self.max_turns,
+        }
+
+    def _elapsed(self) -> str | None:
+        if self.max_minutes is None:
+            return None
+        minutes = (time.monotonic() - self.start) / 60
+        if minutes >= self.max_minutes:
+            return f"ran for {minutes:.0f} minutes, the limit is {self.max_minutes}"
+        return None
+
+    def before_turn(self) -> str | None:
+        """Check the budget before a model turn, counting the turn. Returns why
+        the run should stop, or None."""
+        if self.max_tokens is not None and self.tokens >= self.max_tokens:
+            return f"used {self.tokens} tokens, the limit is {self.max_tokens}"
+        if self.max_turns is not None and self.turns >= self.max_turns:
+            return f"took {self.turns} turns, the limit is {self.max_turns}"
+        self.turns += 1
+        return self._elapsed()
+
+    def before_tool(self, name: str) -> str | None:
+        """Check the budget before a tool call, counting builds. Returns why
+        the run should stop, or None."""
+        if name in self.BUILD_TOOLS:
+            if self.max_builds is not None and self.builds >= self.max_builds:
+                return f"ran {self.builds} builds, the limit is {self.max_builds}"
+            self.builds += 1
+        return self._elapsed()
+
+    def add_tokens(self, count: int):
+        self.tokens += count
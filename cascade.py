@@ -0,0 +1,65 @@
+"""
+Choosing which model to use for each turn of a run.
+
+Turns start on a fast model and escalate to a stronger one when the run seems
+to be struggling: builds keep failing, nothing has changed for a while, or the
+model asks for help.
+"""
+
+import events
+
+
+class Cascade:
+    # Consecutive failed builds before escalating.
+    FAILED_BUILDS = 2
+    # Turns without an edit or a successful build before escalating.
+    STALLED_TURNS = 6
+    # How many turns an escalation lasts.
+    ESCALATED_TURNS = 3
+
+    EDIT_TOOLS = ("write_file", "edit_file", "apply_patch")
+
+    def __init__(self, fast: str, strong: str):
+        self.fast = fast
+        self.strong = strong
+        self.failed_builds = 0
+        self.stalled_turns = 0
+        self.escalated_turns = 0
+        self.requested: str | None = None
+
+    def tool_called(self, name: str, response: dict):
+        """Update the escalation signals from a tool call."""
+        if name == "fx_build":
+            result = response.get("result")
+            if isinstance(result, dict) and result.get("success"):
+                self.failed_builds = 0
+                self.stalled_turns = 0
+            else:
+                self.failed_builds += 1
+        elif name in self.EDIT_TOOLS and "error" not in response:
+            self.stalled_turns = 0
+
+    def request_escalation(self, reason: str):
+        self.requested = reason
+
+    def next_model(self) -> str:
+        """The model to use for the next turn."""
+        reason = None
+        if self.requested is not None:
+            reason = f"requested by the model: {self.requested}"
+        elif self.failed_builds >= self.FAILED_BUILDS:
+            reason = f"{self.failed_builds} failed builds in a row"
+        elif self.stalled_turns >= self.STALLED_TURNS:
+            reason = f"no progress in {self.stalled_turns} turns"
+        if reason is not None:
+            events.emit("escalating", f"to {self.strong}: {reason}", model=self.strong)
+            self.escalated_turns = self.ESCALATED_TURNS
+            self.requested = None
+            self.failed_builds = 0
+            self.stalled_turns = 0
+
+        self.stalled_turns += 1
+        if self.escalated_turns > 0:
+            self.escalated_turns -= 1
+            return self.strong
+        return self.fast
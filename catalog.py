@@ -0,0 +1,246 @@
+"""
+A catalog of the recordings in a directory, for browsing large sweeps.
+
+The summary of each recording is kept in a SQLite database in the directory,
+along with the size and modification time it was summarized at. The directory
+is rescanned periodically and only new or changed recordings are read, so
+listing, filtering and sorting thousands of runs doesn't mean parsing
+thousands of json files. Recordings themselves are only read when they're
+opened.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+from aiohttp import web
+
+import summarize
+import ui
+
+DATABASE = ".village-catalog.sqlite"
+# How often to look for new and changed recordings.
+SCAN_SECONDS = 5
+SCAN_BATCH = 100
+# The most runs returned by one query.
+MAX_RUNS = 1000
+
+COLUMNS = {
+    "path": "TEXT PRIMARY KEY",
+    "size": "INTEGER",
+    "mtime_ns": "INTEGER",
+    "task": "TEXT",
+    "status": "TEXT",
+    "duration": "REAL",
+    "tokens": "INTEGER",
+    "steps": "INTEGER",
+    "model": "TEXT",
+    "temperature": "REAL",
+    "tools_used": "TEXT",
+    "files_read": "INTEGER",
+    "files_written": "INTEGER",
+    # why the file couldn't be summarized, if it isn't a recording
+    "error": "TEXT",
+}
+SORTABLE = ("path", "task", "status", "duration", "tokens", "steps", "model")
+FILTERABLE = ("task", "status", "model")
+
+
+class Catalog:
+    def __init__(self, directory: Path):
+        self.directory = directory
+        # scans run in a thread while requests are served
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(directory / DATABASE, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS runs ("
+            + ", ".join(f"{name} {kind}" for name, kind in COLUMNS.items())
+            + ")"
+        )
+        self.db.commit()
+
+    def recordings(self) -> dict[str, os.stat_result]:
+        """Every json file under the directory."""
+        found = {}
+        for dir, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".json"):
+                    path = os.path.join(dir, name)
+                    found[os.path.relpath(path, self.directory)] = os.stat(path)
+        return found
+
+    def scan(self) -> int:
+        """Bring the catalog up to date. Returns how many recordings changed."""
+        found = self.recordings()
+        with self.lock:
+            known = {
+                row["path"]: (row["size"], row["mtime_ns"])
+                for row in self.db.execute("SELECT path, size, mtime_ns FROM runs")
+            }
+        changed = [
+            path
+            for path, stat in found.items()
+            if known.get(path) != (stat.st_size, stat.st_mtime_ns)
+        ]
+        # committed in batches so a big first scan shows up as it goes
+        for i in range(0, len(changed), SCAN_BATCH):
+            rows = [self.summarize(p, found[p]) for p in changed[i : i + SCAN_BATCH]]
+            with self.lock:
+                # updated in place, as replacing the row would change its id
+                self.db.executemany(
+                    f"INSERT INTO runs ({', '.join(COLUMNS)}) "
+                    + f"VALUES ({', '.join('?' * len(COLUMNS))}) "
+                    + "ON CONFLICT(path) DO UPDATE SET "
+                    + ", ".join(f"{c} = excluded.{c}" for c in COLUMNS if c != "path"),
+                    [[row[c] for c in COLUMNS] for row in rows],
+                )
+                self.db.commit()
+        deleted = [(path,) for path in known if path not in found]
+        with self.lock:
+            self.db.executemany("DELETE FROM runs WHERE path = ?", deleted)
+            self.db.commit()
+        return len(changed) + len(deleted)
+
+    def summarize(self, path: str, stat: os.stat_result) -> dict:
+        row: dict = {c: None for c in COLUMNS}
+        row.update(path=path, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+        try:
+            s = summarize.summarize(self.directory / path)
+        except Exception as e:
+            # not a recording, or one that's still being written
+            row["error"] = repr(e)
+            return row
+        row.update(
+            task=s.task,
+            status=s.status,
+            duration=s.duration,
+            tokens=s.tokens,
+            steps=s.steps,
+            model=s.model,
+            temperature=s.temperature,
+            tools_used=json.dumps(s.tools_used),
+            files_read=len(s.files_read),
+            files_written=len(s.files_written),
+        )
+        return row
+
+    def runs(
+        self,
+        filters: dict[str, str],
+        search: str = "",
+        sort: str = "path",
+        descending: bool = False,
+        limit: int = MAX_RUNS,
+    ) -> list[dict]:
+        where = ["error IS NULL"]
+        params: list = []
+        for column, value in filters.items():
+            if column in FILTERABLE and value:
+                where.append(f"{column} = ?")
+                params.append(value)
+        if search:
+            where.append("path LIKE ?")
+            params.append(f"%{search}%")
+        if sort not in SORTABLE:
+            sort = "path"
+        query = (
+            "SELECT rowid AS id, * FROM runs WHERE "
+            + " AND ".join(where)
+            + f" ORDER BY {sort} {'DESC' if descending else 'ASC'} LIMIT ?"
+        )
+        params.append(min(limit, MAX_RUNS))
+        with self.lock:
+            rows = self.db.execute(query, params).fetchall()
+        runs = []
+        for row in rows:
+            run = dict(row)
+            run["tools_used"] = json.loads(run["tools_used"])
+            del run["error"]
+            runs.append(run)
+        return runs
+
+    def choices(self) -> dict[str, list]:
+        """The values each filterable column takes."""
+        with self.lock:
+            return {
+                column: [
+                    row[0]
+                    for row in self.db.execute(
+                        f"SELECT DISTINCT {column} FROM runs "
+                        + f"WHERE error IS NULL ORDER BY {column}"
+                    )
+                ]
+                for column in FILTERABLE
+            }
+
+    def path(self, id: int) -> Path | None:
+        with self.lock:
+            row = self.db.execute(
+                "SELECT path FROM runs WHERE rowid = ?", (id,)
+            ).fetchone()
+        return self.directory / row["path"] if row else None
+
+    def add_routes(self, app: web.Application):
+        app.add_routes(
+            [
+                web.get("/runs", self.runs_handler),
+                web.get("/runs/choices", self.choices_handler),
+                web.get("/runs/{id:\\d+}/state", self.state_handler),
+            ]
+        )
+
+    async def runs_handler(self, request):
+        query = request.query
+        runs = self.runs(
+            {column: query.get(column, "") for column in FILTERABLE},
+            search=query.get("search", ""),
+            sort=query.get("sort", "path"),
+            descending=query.get("descending") == "1",
+            limit=int(query.get("limit", MAX_RUNS)),
+        )
+        return web.json_response(runs)
+
+    async def choices_handler(self, request):
+        return web.json_response(self.choices())
+
+    async def state_handler(self, request):
+        path = self.path(int(request.match_info["id"]))
+        if path is None or not path.exists():
+            raise web.HTTPNotFound()
+        return ui.json_bytes_response(request, path.read_bytes())
+
+    async def watch(self):
+        while True:
+            changed = await asyncio.to_thread(self.scan)
+            if changed:
+                print(f"CATALOG: {changed} recordings added, changed or removed")
+            await asyncio.sleep(SCAN_SECONDS)
+
+
+async def serve(directory: Path):
+    catalog = Catalog(directory)
+    webui = ui.UI(None, index="runs.html")
+    catalog.add_routes(webui.app)
+    await webui.start()
+    try:
+        await catalog.watch()
+    finally:
+        await webui.stop()
+
+
+def serve_command(args: argparse.Namespace):
+    asyncio.run(serve(args.directory))
+
+
+def add_subcommand(subcommands: argparse._SubParsersAction):
+    parser = subcommands.add_parser(
+        "serve", help="Browse all of the recordings in a directory."
+    )
+    parser.add_argument(
+        "directory", type=Path, help="The directory containing the recordings."
+    )
@@ -0,0 +1,90 @@
+"""
+Estimating how big the next request will be, so that it can be made to fit in
+the model's context window before it's sent.
+
+Each history entry's size is estimated from the length of its json encoding.
+The characters per token are calibrated with exact counts of some of the
+larger entries, and the fixed cost of each request (the system prompt and tool
+declarations) is calibrated from the prompt size reported with each response.
+"""
+
+import json
+import math
+
+# The model's context window, less some room for its response.
+CONTEXT_LIMIT = 1_000_000
+# Compact tool results once a request is estimated to be this much of the limit.
+COMPACT_AT = 0.9
+# Tool results smaller than this are never compacted.
+COMPACT_MIN_CHARS = 8000
+# How much of a compacted tool result is kept.
+COMPACTED_CHARS = 2000
+# History entries at least this big have their tokens counted exactly.
+COUNT_MIN_CHARS = 4000
+
+
+def compact_response(response: dict) -> dict:
+    """A shortened version of a function response."""
+    text = json.dumps(response)
+    return {
+        "result": text[:COMPACTED_CHARS],
+        "note": f"This result was {len(text)} characters and has been cut short "
+        + "to save space. Call the tool again if you need all of it.",
+    }
+
+
+class ContextEstimator:
+    def __init__(self, limit: int = CONTEXT_LIMIT):
+        self.limit = limit
+        self.chars_per_token = 4.0
+        # exact token counts of history entries by position, with the size
+        # they were counted at
+        self.counted: dict[int, tuple[int, int]] = {}
+        # the tokens in every request besides the history
+        self.overhead = 0
+        # the latest estimate
+        self.tokens = 0
+
+    def entry_tokens(self, index: int, chars: int) -> int:
+        counted = self.counted.get(index)
+        if counted is not None and counted[0] == chars:
+            return counted[1]
+        return math.ceil(chars / self.chars_per_token)
+
+    def history_tokens(self, sizes: list[int]) -> int:
+        return sum(self.entry_tokens(i, chars) for i, chars in enumerate(sizes))
+
+    def estimate(self, sizes: list[int], message_chars: int) -> int:
+        """Estimate the tokens in a request sending a message after a history
+        whose entries are sizes characters long."""
+        self.tokens = (
+            self.overhead
+            + self.history_tokens(sizes)
+            + math.ceil(message_chars / self.chars_per_token)
+        )
+        return self.tokens
+
+    def over(self) -> bool:
+        return self.tokens >= self.limit * COMPACT_AT
+
+    def observe(self, prompt_tokens: int, sizes: list[int]):
+        """Calibrate against the prompt size of a request whose history entries
+        (including the message it sent) are sizes characters long."""
+        self.overhead = max(0, prompt_tokens - self.history_tokens(sizes))
+        self.tokens = prompt_tokens
+
+    def to_count(self, sizes: list[int]) -> list[int]:
+        """Large entries whose tokens haven't been counted at their size."""
+        return [
+            i
+            for i, chars in enumerate(sizes)
+            if chars >= COUNT_MIN_CHARS and self.counted.get(i, (None,))[0] != chars
+        ]
+
+    def record_count(self, index: int, chars: int, tokens: int):
+        self.counted[index] = (chars, tokens)
+        total_tokens = sum(t for _, t in self.counted.values())
+        if total_tokens:
+            self.chars_per_token = (
+                sum(c for c, _ in self.counted.values()) / total_tokens
+            )
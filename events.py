@@ -0,0 +1,150 @@
+"""
+A structured log of what happens during a run.
+
+Every event is a json object with the time, the run, the turn it happened in,
+its type and a human readable message, plus any other fields. Events are
+queued and written by a background thread in batches so that the model and
+tools never wait on the disk or the terminal. Console output is rendered from
+the same events, with noisy events (build output, diffs, model text) limited
+to a number of lines per second: what fits is shown and the rest is skipped.
+
+Until a log is started events are printed directly, so code that doesn't
+start a log (replays, tests at a prompt) still shows what it's doing.
+"""
+
+import json
+import queue
+import sys
+import threading
+import time
+from pathlib import Path
+
+# Events that can produce a lot of lines and are cut short on the console when
+# they come too fast. They're always written to the log in full.
+NOISY = {"output", "diff", "from_model"}
+# The most events written in one go.
+BATCH = 1000
+
+
+def _render(event: dict) -> str:
+    label = event["type"].upper().replace("_", " ")
+    return f"{label}: " + event["message"].rstrip("\n").replace("\n", f"\n{label}: ")
+
+
+class Console:
+    """Renders events to stdout, limiting noisy events to lines_per_second."""
+
+    def __init__(self, lines_per_second: int):
+        self.lines_per_second = lines_per_second
+        self.allowance = float(lines_per_second)
+        self.last = time.monotonic()
+        self.skipped = 0
+
+    def render(self, events: list[dict]) -> str:
+        now = time.monotonic()
+        self.allowance = min(
+            self.lines_per_second,
+            self.allowance + (now - self.last) * self.lines_per_second,
+        )
+        self.last = now
+        out = []
+        for event in events:
+            text = _render(event)
+            cut = 0
+            if event["type"] in NOISY and self.lines_per_second:
+                lines = text.split("\n")
+                shown = min(len(lines), int(self.allowance))
+                self.allowance -= shown
+                if not shown:
+                    self.skipped += len(lines)
+                    continue
+                text = "\n".join(lines[:shown])
+                cut = len(lines) - shown
+            if self.skipped:
+                out.append(f"CONSOLE: skipped {self.skipped} lines\n")
+                self.skipped = 0
+            out.append(text + "\n")
+            if cut:
+                out.append(f"CONSOLE: skipped {cut} lines\n")
+        return "".join(out)
+
+
+class EventLog:
+    def __init__(self, run: str, path: Path | None, console: Console | None):
+        self.run = run
+        self.turn = 0
+        self.file = open(path, "at") if path else None
+        self.console = console
+        self.queue: queue.Queue[dict | None] = queue.Queue()
+        self.writer = threading.Thread(target=self.write_forever, daemon=True)
+        self.writer.start()
+
+    def emit(self, type: str, message: str, **fields):
+        self.queue.put(
+            {
+                "time": time.time(),
+                "run": self.run,
+                "turn": self.turn,
+                "type": type,
+                "message": message,
+                **fields,
+            }
+        )
+
+    def write_forever(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < BATCH:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            # other threads may still emit after close() queues the sentinel
+            closing = None in batch
+            events = [e for e in batch if e is not None]
+            if self.file is not None:
+                self.file.write(
+                    "".join(json.dumps(e, default=str) + "\n" for e in events)
+                )
+                self.file.flush()
+            if self.console is not None:
+                sys.stdout.write(self.console.render(events))
+                sys.stdout.flush()
+            if closing:
+                return
+
+    def close(self):
+        """Write any queued events and stop."""
+        self.queue.put(None)
+        self.writer.join()
+        if self.file is not None:
+            self.file.close()
+
+
+_log: EventLog | None = None
+
+
+def start(run: str, path: Path | None, console: Console | None):
+    global _log
+    _log = EventLog(run, path, console)
+
+
+def stop():
+    global _log
+    if _log is not None:
+        _log.close()
+        _log = None
+
+
+def set_turn(turn: int):
+    if _log is not None:
+        _log.turn = turn
+
+
+def emit(type: str, message: str, **fields):
+    """Log an event. message is what's shown on the console; fields are only
+    written to the log."""
+    if _log is not None:
+        _log.emit(type, message, **fields)
+    else:
+        print(_render({"type": type, "message": message}))
@@ -0,0 +1,127 @@
+"""
+An in-memory snapshot of the files in the source tree, so that directory
+listings don't need to touch the filesystem.
+"""
+
+import subprocess
+from pathlib import PurePosixPath
+
+# Directories map names to their children, files map to None.
+Directory = dict[str, "Directory | None"]
+
+
+class FileTree:
+    def __init__(self, paths: list[str]):
+        self.root: Directory = {}
+        for path in paths:
+            self.add(path)
+
+    @classmethod
+    def load(cls) -> "FileTree":
+        """Snapshot the files tracked by git in the current directory."""
+        output = subprocess.run(
+            ["git", "ls-files", "-z"], capture_output=True, text=True, check=True
+        ).stdout
+        return cls([p for p in output.split("\0") if p])
+
+    def add(self, path: str):
+        """Add a file to the snapshot."""
+        *dirs, name = path.strip("/").split("/")
+        node = self.root
+        for d in dirs:
+            child = node.get(d)
+            if child is None:
+                child = node[d] = {}
+            node = child
+        node.setdefault(name, None)
+
+    def remove(self, path: str):
+        """Remove a file from the snapshot, along with any directories it
+        leaves empty."""
+        *dirs, name = path.strip("/").split("/")
+        parents = [self.root]
+        for d in dirs:
+            child = parents[-1].get(d)
+            if child is None:
+                return
+            parents.append(child)
+        if name not in parents[-1] or parents[-1][name] is not None:
+            return
+        del parents[-1][name]
+        for d, parent in zip(reversed(dirs), reversed(parents[:-1])):
+            if parent[d]:
+                break
+            del parent[d]
+
+    def find(self, path: str) -> Directory | None:
+        """Look up a directory, returning None if it's not in the tree."""
+        node = self.root
+        for d in [p for p in path.strip("/").split("/") if p]:
+            child = node.get(d)
+            if child is None:
+                return None
+            node = child
+        return node
+
+    def render(self, path: str, depth: int, glob: str, limit: int) -> str:
+        """Render the directory at `path` as an indented tree.
+
+        Directories deeper than `depth` are summarized with the number of files
+        they contain. If `glob` is set only files whose path (relative to
+        `path`) matches it are shown. At most `limit` lines are returned.
+        """
+        node = self.find(path)
+        if node is None:
+            return f"{path} is not a directory in the source tree"
+        lines: list[str] = []
+        self._render(node, "", 0, depth, glob, lines)
+        if len(lines) > limit:
+            lines = lines[:limit] + [f"... {len(lines) - limit} more lines"]
+        return "\n".join(lines)
+
+    def _count(self, node: Directory, rel: str, glob: str) -> int:
+        count = 0
+        for name, child in node.items():
+            if child is None:
+                count += _matches(rel + name, glob)
+            else:
+                count += self._count(child, rel + name + "/", glob)
+        return count
+
+    def _render(
+        self,
+        node: Directory,
+        rel: str,
+        level: int,
+        depth: int,
+        glob: str,
+        lines: list[str],
+    ) -> int:
+        """Append lines for the contents of `node`, returning how many files
+        matched."""
+        indent = "  " * level
+        matched = 0
+        for name, child in sorted(node.items()):
+            if child is None:
+                if _matches(rel + name, glob):
+                    lines.append(indent + name)
+                    matched += 1
+            elif level + 1 >= depth:
+                count = self._count(child, rel + name + "/", glob)
+                if count:
+                    lines.append(f"{indent}{name}/ ({count} files)")
+                    matched += count
+            else:
+                lines.append(f"{indent}{name}/")
+                count = self._render(
+                    child, rel + name + "/", level + 1, depth, glob, lines
+                )
+                if not count:
+                    # nothing in here matched the glob
+                    lines.pop()
+                matched += count
+        return matched
+
+
+def _matches(path: str, glob: str) -> bool:
+    return not glob or PurePosixPath(path).match(glob)
@@ -0,0 +1,142 @@
+"""
+Counters and histograms describing runs in progress, exposed by the web UI in
+the Prometheus text format.
+
+Metrics are updated in place as runs progress so that scraping them is cheap.
+Tools, the warm-up and the background build update them from other threads, so
+each metric has a lock.
+"""
+
+import math
+import threading
+
+REGISTRY: list["_Metric"] = []
+
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 600, 1800)
+# The content type of the text exposition format.
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], **extra) -> str:
+    pairs = list(zip(names, values)) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(str(v))}"' for n, v in pairs) + "}"
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    TYPE = ""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.TYPE}"]
+
+
+class Counter(_Metric):
+    TYPE = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self.values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        with self.lock:
+            values = list(self.values.items())
+        return super().render() + [
+            f"{self.name}{_labels(self.label_names, k)} {_number(v)}" for k, v in values
+        ]
+
+
+class Gauge(Counter):
+    TYPE = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    TYPE = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets) + (math.inf,)
+        # per-bucket (not cumulative) counts for each set of labels
+        self.counts: dict[tuple[str, ...], list[int]] = {}
+        self.sums: dict[tuple[str, ...], float] = {}
+
+    def observe(self, value: float, *labels: str):
+        bucket = next(i for i, b in enumerate(self.buckets) if value <= b)
+        with self.lock:
+            counts = self.counts.setdefault(labels, [0] * len(self.buckets))
+            counts[bucket] += 1
+            self.sums[labels] = self.sums.get(labels, 0.0) + value
+
+    def render(self) -> list[str]:
+        with self.lock:
+            snapshot = [(k, list(c), self.sums[k]) for k, c in self.counts.items()]
+        lines = super().render()
+        for k, counts, total in snapshot:
+            labels = _labels(self.label_names, k)
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                le = _labels(self.label_names, k, le=_number(bound))
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{labels} {_number(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    return "\n".join(line for m in REGISTRY for line in m.render()) + "\n"
+
+
+ACTIVE_RUNS = Gauge("village_active_runs", "Task runs in progress.")
+TURNS = Counter("village_turns_total", "Model turns.", ("model",))
+MODEL_LATENCY = Histogram(
+    "village_model_latency_seconds", "Time spent waiting for the model.", ("model",)
+)
+TOKENS = Counter("village_tokens_total", "Tokens used.", ("model", "kind"))
+BACKOFF_SLEEPS = Counter(
+    "village_backoff_sleeps_total", "Times a model request was retried after a delay."
+)
+BACKOFF_SECONDS = Counter(
+    "village_backoff_seconds_total", "Time spent waiting to retry model requests."
+)
+TOOL_CALLS = Counter("village_tool_calls_total", "Tool calls.", ("tool",))
+TOOL_LATENCY = Histogram(
+    "village_tool_latency_seconds", "Time taken by tool calls.", ("tool",)
+)
+TOOL_CACHE = Counter(
+    "village_tool_cache_total", "Shared tool cache lookups.", ("tool", "result")
+)
+RECORDING_BYTES = Counter(
+    "village_recording_bytes_written_total", "Bytes of recordings written."
+)
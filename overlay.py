@@ -0,0 +1,73 @@
+"""
+Files written by tools, held in memory until they're needed on disk.
+
+Edits come in bursts between builds. Holding them in memory means the
+checkout (and anything watching it) sees one batch of writes per build rather
+than every intermediate version, and changes that haven't been flushed yet can
+be thrown away without touching the disk.
+"""
+
+import os
+
+
+class Overlay:
+    def __init__(self):
+        # the new contents of each changed file, None for deleted files
+        self.files: dict[str, str | None] = {}
+
+    def __contains__(self, path: str) -> bool:
+        return path in self.files
+
+    def exists(self, path: str) -> bool:
+        if path in self.files:
+            return self.files[path] is not None
+        return os.path.exists(path)
+
+    def read(self, path: str) -> str:
+        """The current contents of a file."""
+        if path in self.files:
+            contents = self.files[path]
+            if contents is None:
+                raise FileNotFoundError(f"No such file: '{path}'")
+            return contents
+        return open(path, "r").read()
+
+    def write(self, path: str, contents: str | None):
+        """Change (or delete, if contents is None) a file."""
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            raise FileNotFoundError(f"No such directory: '{directory}'")
+        self.files[path] = contents
+
+    def under(self, directory: str) -> dict[str, str | None]:
+        """The changed files in a directory. An empty directory is the whole
+        tree."""
+        prefix = directory.rstrip("/") + "/" if directory else ""
+        return {p: c for p, c in self.files.items() if p.startswith(prefix)}
+
+    def listdir(self, directory: str, entries: list[str]) -> list[str]:
+        """Update the entries listed on disk for a directory with the files
+        that have been created or deleted in it."""
+        entries = list(entries)
+        for path, contents in self.files.items():
+            if os.path.dirname(path) != directory.rstrip("/"):
+                continue
+            name = os.path.basename(path)
+            if contents is None and name in entries:
+                entries.remove(name)
+            elif contents is not None and name not in entries:
+                entries.append(name)
+        return entries
+
+    def flush(self) -> list[str]:
+        """Write every change to disk. Returns the files that were changed."""
+        for path, contents in self.files.items():
+            if contents is None:
+                if os.path.exists(path):
+                    os.unlink(path)
+            else:
+                with open(path, "wt") as f:
+                    f.write(contents)
+        flushed = list(self.files)
+        self.files.clear()
+        return flushed
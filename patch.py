@@ -0,0 +1,142 @@
+"""
+Applying unified diffs in-process.
+"""
+
+import re
+import typing
+
+_HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+class PatchError(Exception):
+    pass
+
+
+class FilePatch:
+    def __init__(self, old_path: str | None, new_path: str | None):
+        self.old_path = old_path
+        self.new_path = new_path
+        # each hunk is its starting line in the old file and its lines
+        self.hunks: list[tuple[int, list[str]]] = []
+
+
+def _strip_path(path: str) -> str | None:
+    path = path.split("\t", 1)[0].strip()
+    if path == "/dev/null":
+        return None
+    if path.startswith("a/") or path.startswith("b/"):
+        path = path[2:]
+    return path
+
+
+def parse(patch: str) -> list[FilePatch]:
+    """Parse a unified diff into its files and hunks."""
+    files: list[FilePatch] = []
+    # only newlines end lines: splitlines() would also split on characters
+    # like form feeds that can appear in the files being patched
+    lines = [line.removesuffix("\r") for line in patch.split("\n")]
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if line.startswith("--- ") and i + 1 < len(lines):
+            if not lines[i + 1].startswith("+++ "):
+                raise PatchError(f"Expected a +++ line after: {line}")
+            files.append(
+                FilePatch(_strip_path(line[4:]), _strip_path(lines[i + 1][4:]))
+            )
+            i += 2
+            continue
+        match = _HUNK_HEADER.match(line)
+        if match:
+            if not files:
+                raise PatchError(f"Hunk before any file header: {line}")
+            old_count = int(match.group(2) or "1")
+            new_count = int(match.group(4) or "1")
+            hunk: list[str] = []
+            i += 1
+            while (old_count > 0 or new_count > 0) and i < len(lines):
+                line = lines[i]
+                if line.startswith("\\"):
+                    # "\ No newline at end of file"
+                    i += 1
+                    continue
+                # some tools drop the space on empty context lines
+                kind = line[:1] or " "
+                if kind not in " -+":
+                    raise PatchError(f"Unexpected line in hunk: {line}")
+                if kind in " -":
+                    old_count -= 1
+                if kind in " +":
+                    new_count -= 1
+                hunk.append(kind + line[1:])
+                i += 1
+            if old_count > 0 or new_count > 0:
+                raise PatchError(f"Hunk is shorter than its header says: {match[0]}")
+            files[-1].hunks.append((int(match.group(1)), hunk))
+            continue
+        i += 1
+    if not files:
+        raise PatchError("No file headers (--- and +++ lines) found in the patch.")
+    return files
+
+
+def _find(lines: list[str], block: list[str], near: int) -> int:
+    """Find where block occurs in lines, preferring the position closest to
+    near. Returns -1 if it doesn't occur."""
+    best = -1
+    for start in range(len(lines) - len(block) + 1):
+        if lines[start : start + len(block)] == block:
+            if best < 0 or abs(start - near) < abs(best - near):
+                best = start
+    return best
+
+
+def apply(
+    patch: str, read: typing.Callable[[str], str | None]
+) -> dict[str, str | None]:
+    """Apply a unified diff, reading the original files with read.
+
+    Returns the new contents of each file the patch touches, None for files it
+    deletes. Every hunk's context and removed lines must match the original
+    exactly; otherwise a PatchError is raised and nothing is returned.
+    """
+    results: dict[str, str | None] = {}
+    for file in parse(patch):
+        path = file.new_path or file.old_path
+        if path is None:
+            raise PatchError("A file's old and new paths are both /dev/null.")
+        if file.old_path is None:
+            original = ""
+        else:
+            if file.old_path in results:
+                original = results[file.old_path]
+            else:
+                original = read(file.old_path)
+            if original is None:
+                raise PatchError(f"{file.old_path} does not exist.")
+        # keep the file's line endings and any other characters untouched
+        newline = "\r\n" if "\r\n" in original else "\n"
+        lines = original.split(newline)
+        trailing_newline = original.endswith(newline) or not original
+        if trailing_newline:
+            lines.pop()
+        offset = 0
+        for start, hunk in file.hunks:
+            old = [l[1:] for l in hunk if l[0] in " -"]
+            new = [l[1:] for l in hunk if l[0] in " +"]
+            position = _find(lines, old, start - 1 + offset) if old else start + offset
+            if position < 0:
+                raise PatchError(
+                    f"Hunk at line {start} does not match the contents of {path}:\n"
+                    + "\n".join(hunk)
+                )
+            lines[position : position + len(old)] = new
+            offset += len(new) - len(old)
+        if file.old_path is not None and file.old_path != file.new_path:
+            # deleted or renamed
+            results[file.old_path] = None
+        if file.new_path is not None:
+            results[path] = newline.join(lines) + (
+                newline if trailing_newline and lines else ""
+            )
+    return results
@@ -0,0 +1,136 @@
+"""
+A sampling profiler that attributes a run's time to the model, tools and the
+runner itself.
+
+A thread samples the stacks of every other thread at a fixed interval. Each
+sample is attributed to:
+  runner - the main thread is busy outside of a tool call: serializing
+           history, writing recordings, printing, ...
+  tools  - some thread is inside a tool call
+  model  - neither, so the run is waiting on the model
+
+The stacks are also written in the "folded" format used by flamegraph.pl,
+inferno and speedscope.
+"""
+
+import os
+import sys
+import threading
+import time
+import typing
+from collections import Counter
+from pathlib import Path
+
+# The frame that marks a tool call.
+TOOL_FRAME = ("tools.py", "wrapper")
+# Where threads sit when they have nothing to do. These aren't written to the
+# folded stacks.
+IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("thread.py", "_worker"),
+}
+# How many of the runner's hottest functions to report.
+HOT_FUNCTIONS = 10
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return (
+        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    )
+
+
+def _stack(frame) -> list[typing.Any]:
+    """The frames of a stack, outermost first."""
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+
+def _is(frame, names: tuple[str, str]) -> bool:
+    code = frame.f_code
+    return (os.path.basename(code.co_filename), code.co_name) == names
+
+
+class Profiler:
+    INTERVAL = 0.01
+
+    def __init__(self):
+        self.main_thread = threading.main_thread().ident
+        # folded stacks and how many times each was sampled
+        self.stacks: Counter[str] = Counter()
+        self.categories: Counter[str] = Counter()
+        # where the main thread was when busy outside of tools
+        self.hot: Counter[str] = Counter()
+        self.samples = 0
+        self.elapsed = 0.0
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.sample_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+
+    def sample_forever(self):
+        start = time.monotonic()
+        while not self.stopping.wait(self.INTERVAL):
+            self.sample()
+            self.elapsed = time.monotonic() - start
+
+    def sample(self):
+        own = threading.get_ident()
+        threads = {t.ident: t.name for t in threading.enumerate()}
+        in_tool = False
+        runner_busy = False
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = _stack(frame)
+            if any(_is(stack[-1], idle) for idle in IDLE_FRAMES):
+                continue
+            names = [_frame_name(f) for f in stack]
+            thread = threads.get(ident, "thread")
+            self.stacks[";".join([thread, *names])] += 1
+            if any(_is(f, TOOL_FRAME) for f in stack):
+                in_tool = True
+            elif ident == self.main_thread:
+                runner_busy = True
+                self.hot[names[-1]] += 1
+        if runner_busy:
+            category = "runner"
+        elif in_tool:
+            category = "tools"
+        else:
+            category = "model"
+        self.categories[category] += 1
+        self.samples += 1
+
+    def seconds(self, samples: int) -> float:
+        # the real interval is a little longer than INTERVAL
+        return samples * self.elapsed / self.samples if self.samples else 0.0
+
+    def breakdown(self) -> dict:
+        """Seconds spent in each category, and the main thread's hottest
+        functions outside of tools."""
+        return {
+            "seconds": {
+                c: self.seconds(self.categories[c])
+                for c in ("model", "tools", "runner")
+            },
+            "hot": [
+                [name, self.seconds(n)]
+                for name, n in self.hot.most_common(HOT_FUNCTIONS)
+            ],
+        }
+
+    def write_folded(self, path: Path):
+        with open(path, "wt") as f:
+            for stack, count in self.stacks.items():
+                f.write(f"{stack} {count}\n")
@@ -0,0 +1,265 @@
+"""
+Replay a task recording against a workspace without calling the model.
+
+The recorded model responses are fed back through a TaskRunner and every
+recorded tool call is executed again, so tool results and timings can be
+compared with the original run.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+import typing
+from pathlib import Path
+
+from google.genai import types
+
+import tools
+from task_runner import TaskRunner, add_run_arguments
+from tasks.base_task import _BaseTask
+
+
+class ReplayExhausted(Exception):
+    """The recording ran out of model turns before the task completed."""
+
+
+class RecordedTask(_BaseTask):
+    """A task reconstructed from a recording."""
+
+    def __init__(self, recording: dict):
+        self.NAME = recording["task"]
+        self.recorded_prompt = recording["task_prompt"]
+
+    @property
+    def tools(self) -> list[typing.Callable]:
+        # everything the original run could have called
+        return tools.TOOLS + [
+            tools.dispatch(tools.load_tools),
+            tools.dispatch(tools.escalate),
+        ]
+
+    @property
+    def prompt(self) -> str:
+        return self.recorded_prompt
+
+
+def _normalize(o):
+    """Make tool responses comparable with ones loaded from JSON."""
+    return json.loads(json.dumps(o, default=str))
+
+
+class ReplayChat:
+    """Stands in for a chat session, answering with recorded model responses
+    and executing their function calls like automatic function calling does."""
+
+    def __init__(self, recording: dict, tool_functions: list[typing.Callable]):
+        self.recorded = [types.Content.model_validate(h) for h in recording["history"]]
+        # the recorded duration of each tool call, by turn
+        self.recorded_durations = [
+            [t["duration"] for t in turn["tools"]]
+            for turn in recording.get("timings", [])
+        ]
+        self.function_map = {f.__name__: f for f in tool_functions}
+        self.position = 0
+        self.turn = 0
+        # The last model entry whose calls were executed and the position just
+        # after its responses. Automatic function calling adds the entry to the
+        # history again there, and it mustn't be executed twice.
+        self.answered: tuple[types.Content, int] | None = None
+        self.history: list[types.Content] = []
+        self.steps: list[dict] = []
+
+    def _next(self) -> types.Content | None:
+        if self.position >= len(self.recorded):
+            return None
+        content = self.recorded[self.position]
+        self.position += 1
+        return content
+
+    def _next_model(self) -> types.Content | None:
+        while True:
+            # Keep the recorded user inputs up to the next model response.
+            while (
+                self.position < len(self.recorded)
+                and self.recorded[self.position].role != "model"
+            ):
+                self.history.append(self.recorded[self.position])
+                self.position += 1
+            answered = self.answered
+            content = self._next()
+            if (
+                content is not None
+                and answered is not None
+                and self.position - 1 == answered[1]
+                and content == answered[0]
+            ):
+                self.history.append(content)
+                continue
+            return content
+
+    async def send_message(self, message) -> types.GenerateContentResponse:
+        content = self._next_model()
+        if content is None:
+            raise ReplayExhausted()
+        self.history.append(content)
+        turn = self.turn
+        self.turn += 1
+        recorded_durations = (
+            self.recorded_durations[turn] if turn < len(self.recorded_durations) else []
+        )
+
+        calls = [p.function_call for p in content.parts or [] if p.function_call]
+        if not calls:
+            return types.GenerateContentResponse(
+                candidates=[types.Candidate(content=content)]
+            )
+
+        # The recorded function responses follow the model's function calls.
+        recorded_responses = []
+        if (
+            self.position < len(self.recorded)
+            and self.recorded[self.position].role == "user"
+        ):
+            recorded_responses = [
+                p.function_response
+                for p in self.recorded[self.position].parts or []
+                if p.function_response
+            ]
+            if recorded_responses:
+                self.position += 1
+        self.answered = (content, self.position)
+
+        response_parts = []
+        for i, call in enumerate(calls):
+            start = time.monotonic()
+            try:
+                func = self.function_map.get(call.name)
+                if func is None:
+                    # renamed or removed since the recording
+                    raise ValueError(f"Unknown tool {call.name}")
+                response = {"result": func(**(call.args or {}))}
+            except Exception as e:
+                response = {"error": str(e)}
+            duration = time.monotonic() - start
+
+            recorded = recorded_responses[i] if i < len(recorded_responses) else None
+            self.steps.append(
+                {
+                    "name": call.name,
+                    "duration": duration,
+                    "recorded_duration": (
+                        recorded_durations[i] if i < len(recorded_durations) else None
+                    ),
+                    "matches": (
+                        _normalize(response) == _normalize(recorded.response)
+                        if recorded is not None
+                        else None
+                    ),
+                }
+            )
+            response_parts.append(
+                types.Part.from_function_response(name=call.name, response=response)
+            )
+        self.history.append(types.Content(role="user", parts=response_parts))
+
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(content=content)]
+        )
+
+    def get_history(self) -> list[types.Content]:
+        return self.history
+
+
+class ReplayRunner(TaskRunner):
+    """A TaskRunner that takes its model responses from a recording."""
+
+    def __init__(self, recording: dict, output: Path | None):
+        self.recording = recording
+        parser = argparse.ArgumentParser()
+        add_run_arguments(parser)
+        # village run's defaults, for anything the recording doesn't say
+        args = parser.parse_args([])
+        vars(args).update(
+            output=output,
+            temperature=recording["temperature"],
+            model=recording["model"],
+            task=recording["task"],
+            stop_build_after_errors=recording.get("stop_build_after_errors", 0),
+            run_id="replay",
+            console_lines=0,
+        )
+        super().__init__(args)
+        # the recorded responses already reflect any tools that were loaded
+        tools.on_load_tools = None
+
+    def create_task(self, args: argparse.Namespace) -> _BaseTask:
+        return RecordedTask(self.recording)
+
+    def create_chat(self):
+        return ReplayChat(self.recording, self.task.tools)
+
+
+RESULTS = {True: "same", False: "DIFFERENT", None: "not recorded"}
+
+
+def print_report(steps: list[dict]):
+    print(
+        f"{'step':>4}  {'tool':<24} {'recorded':>9} {'replayed':>9} {'delta':>9}  result"
+    )
+    for i, step in enumerate(steps):
+        recorded = step["recorded_duration"]
+        delta = step["duration"] - recorded if recorded is not None else None
+        print(
+            f"{i:>4}  {step['name']:<24} "
+            + (f"{recorded:>8.2f}s " if recorded is not None else f"{'-':>9} ")
+            + f"{step['duration']:>8.2f}s "
+            + (f"{delta:>+8.2f}s " if delta is not None else f"{'-':>9} ")
+            + f" {RESULTS[step['matches']]}"
+        )
+    recorded = [
+        s["recorded_duration"] for s in steps if s["recorded_duration"] is not None
+    ]
+    replayed = sum(s["duration"] for s in steps)
+    different = sum(1 for s in steps if s["matches"] is False)
+    print(f"{len(steps)} tool calls, {different} with different results")
+    if recorded:
+        print(f"tool time: recorded {sum(recorded):.2f}s, replayed {replayed:.2f}s")
+    else:
+        print(f"tool time: replayed {replayed:.2f}s (no recorded timings)")
+
+
+async def replay(recording: dict, output: Path | None) -> list[dict]:
+    runner = ReplayRunner(recording, output)
+    try:
+        await runner.run()
+    except ReplayExhausted:
+        print("REPLAY: recording ended before the task completed")
+    return runner.chat.steps
+
+
+def replay_command(args: argparse.Namespace):
+    recording = json.load(open(args.recording, "rt"))
+    output = args.output.resolve() if args.output else None
+    if args.workspace:
+        os.chdir(args.workspace)
+    steps = asyncio.run(replay(recording, output))
+    print_report(steps)
+
+
+def add_subcommand(subcommands: argparse._SubParsersAction):
+    parser = subcommands.add_parser(
+        "replay",
+        help="Re-execute the tool calls from a task recording without calling the model.",
+    )
+    parser.add_argument("recording", type=Path, help="The recording to replay.")
+    parser.add_argument(
+        "--workspace",
+        type=Path,
+        help="The source tree to run the tools in. Defaults to the current directory. "
+        + "Recorded file writes will be applied to it.",
+    )
+    parser.add_argument(
+        "--output", type=Path, help="Where to put the JSON recording of the replay."
+    )
@@ -8,6 +8,8 @@ import typing
 import statistics
 import pandas as pd
 
+import patch
+
 
 @dataclass
 class Summary:
@@ -22,6 +24,8 @@ class Summary:
     files_read: set[str]
     files_written: set[str]
     tools_used: Counter[str]
+    # where the run's time went, if it was profiled
+    profile: dict | None = None
 
     def print(self):
         print(f"{self.path}:")
@@ -37,6 +41,19 @@ class Summary:
         )
         print(f"  files read:    {', '.join(sorted(self.files_read))}")
         print(f"  files written: {', '.join(sorted(self.files_written))}")
+        if self.profile:
+            self.print_profile()
+
+    def print_profile(self):
+        seconds = self.profile["seconds"]
+        total = sum(seconds.values()) or 1
+        print(f"  {'profile':<48} {'seconds':>9} {'%':>6}")
+        for category, s in seconds.items():
+            print(f"    {category:<46} {s:>9.1f} {100 * s / total:>6.1f}")
+        if self.profile["hot"]:
+            print("  hottest runner functions:")
+            for name, s in self.profile["hot"]:
+                print(f"    {name:<46} {s:>9.1f} {100 * s / total:>6.1f}")
 
     def tool_percentages(self) -> dict[str, float]:
         total = sum(self.tools_used.values())
@@ -74,8 +91,14 @@ def summarize(path: Path) -> Summary:
             files_read.add(args.get("path", ""))
         elif c["name"] == "read_files":
             files_read.update(args.get("paths", []))
-        elif c["name"] == "write_file":
+        elif c["name"] in ("write_file", "edit_file"):
             files_written.add(args.get("path", ""))
+        elif c["name"] == "apply_patch":
+            try:
+                for f in patch.parse(args.get("patch", "")):
+                    files_written.add(f.new_path or f.old_path or "")
+            except patch.PatchError:
+                pass
 
     return Summary(
         path=path,
@@ -89,6 +112,7 @@ def summarize(path: Path) -> Summary:
         files_read=files_read,
         files_written=files_written,
         tools_used=tools_used,
+        profile=r.get("profile"),
     )
 
 
@@ -136,6 +160,16 @@ def summarize_command(args: argparse.Namespace):
                 tool_percentages, key=lambda x: x[1], reverse=True
             )
             print(f"  tools: {', '.join(f'{t} {p:.1f}%' for t, p in tool_percentages)}")
+            profiled = [s.profile["seconds"] for s in group_summaries if s.profile]
+            if profiled:
+                time_sums = defaultdict(float)
+                for seconds in profiled:
+                    for c, t in seconds.items():
+                        time_sums[c] += t
+                total = sum(time_sums.values()) or 1
+                print(
+                    f"  time: {', '.join(f'{c} {100 * t / total:.1f}%' for c, t in time_sums.items())}"
+                )
         return
 
     # just show summaries
@@ -4,6 +4,7 @@ import asyncio
 import os
 import time
 import json
+import textwrap
 from pathlib import Path
 
 from google import genai
@@ -12,22 +13,147 @@ from google.genai.errors import ClientError
 
 
 import tasks
+import events
+import metrics
 import system_prompt
 import tools
+from budget import Budget
+from cascade import Cascade
+from context import ContextEstimator, COMPACT_MIN_CHARS, compact_response
+from overlay import Overlay
+from profiler import Profiler
+from tool_cache import ToolCache
 
 
 MODELS = ("gemini-2.5-pro", "gemini-2.5-flash")
 
 
-def remove_thought(o):
-    """Remove binary thought signatures so we can easily turn this into json."""
-    if isinstance(o, dict):
-        return {
-            k: remove_thought(v) for (k, v) in o.items() if k != "thought_signature"
-        }
-    if isinstance(o, list):
-        return [remove_thought(v) for v in o]
-    return o
+def add_run_arguments(parser: argparse.ArgumentParser):
+    """Adds the options of village run, other than the task to run."""
+    parser.add_argument(
+        "--model",
+        type=str,
+        default=MODELS[0],
+        choices=MODELS,
+        help="The LLM model to use.",
+    )
+    parser.add_argument(
+        "--cascade",
+        action="store_true",
+        help=f"Run turns on {MODELS[-1]} and escalate to {MODELS[0]} when the "
+        + "run is struggling or the model asks. Overrides --model.",
+    )
+    parser.add_argument(
+        "--temperature",
+        type=float,
+        default=1,
+        help="The LLM temperature. Defaults to 1. Range is 0 to 2. "
+        + "Lower values are less random, Higher values are more random.",
+    )
+    parser.add_argument(
+        "--output", type=Path, help="Where to put the JSON recording of the sessions."
+    )
+    parser.add_argument(
+        "--ui", action="store_true", help="Run the web UI while the task runs"
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream model responses, showing text as it arrives and starting "
+        + "tool calls before the whole response has been received.",
+    )
+    parser.add_argument(
+        "--tool-cache",
+        type=Path,
+        help="A database for caching read-only tool results, shared between "
+        + "runs on the same checkout.",
+    )
+    parser.add_argument(
+        "--tool-cache-size",
+        type=int,
+        default=1024,
+        metavar="MB",
+        help="The most the tool cache can hold before old results are evicted.",
+    )
+    parser.add_argument(
+        "--build-lock",
+        type=str,
+        help="A file to lock while building, so that runs in several processes "
+        + "can share a build output directory.",
+    )
+    parser.add_argument(
+        "--overlay",
+        action="store_true",
+        help="Keep changes to files in memory and only write them to the "
+        + "checkout before each build and at the end of the run.",
+    )
+    parser.add_argument(
+        "--stop-build-after-errors",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Stop builds once N distinct errors have been seen and report "
+        + "them straight away. Defaults to 0, which lets builds finish.",
+    )
+    parser.add_argument(
+        "--event-log",
+        type=Path,
+        help="Where to write the run's events as json lines. Defaults to next "
+        + "to the recording.",
+    )
+    parser.add_argument(
+        "--run-id",
+        type=str,
+        help="The run's id in the event log. Defaults to the recording's name.",
+    )
+    parser.add_argument(
+        "--no-console",
+        action="store_true",
+        help="Don't show events on the console, only write them to the log.",
+    )
+    parser.add_argument(
+        "--console-lines",
+        type=int,
+        default=50,
+        metavar="N",
+        help="Show at most N lines per second of build output, diffs and model "
+        + "text on the console. 0 shows everything.",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Sample where the run's time goes. The breakdown is saved in the "
+        + "recording and the stacks next to it in the folded flamegraph format.",
+    )
+    parser.add_argument(
+        "--max-tokens",
+        type=int,
+        metavar="N",
+        help="Fail the run once it has used N tokens in total.",
+    )
+    parser.add_argument(
+        "--max-minutes",
+        type=float,
+        metavar="N",
+        help="Fail the run once it has been running for N minutes.",
+    )
+    parser.add_argument(
+        "--max-builds",
+        type=int,
+        metavar="N",
+        help="Fail the run if it tries to build more than N times.",
+    )
+    parser.add_argument(
+        "--max-turns",
+        type=int,
+        metavar="N",
+        help="Fail the run once it has taken N turns.",
+    )
+
+
+# Binary thought signatures are left out so we can easily turn history into
+# json.
+WITHOUT_THOUGHTS = {"parts": {"__all__": {"thought_signature"}}}
 
 
 def get_api_key() -> str:
@@ -48,34 +174,187 @@ def get_api_key() -> str:
 class TaskRunner:
     def __init__(self, args: argparse.Namespace):
         self.output = args.output
+        event_log = args.event_log
+        if event_log is None and self.output:
+            event_log = Path(self.output).with_suffix(".events.jsonl")
+        events.start(
+            args.run_id or Path(self.output or args.task).stem,
+            event_log,
+            None if args.no_console else events.Console(args.console_lines),
+        )
         self.temperature = args.temperature
         self.model = args.model
-        self.task = tasks.get_task(args.task, args)
-        self.client = genai.Client(api_key=get_api_key())
-        config = types.GenerateContentConfig(
-            tools=self.task.tools,
-            system_instruction=system_prompt.SYSTEM_PROMPT,
-            temperature=self.temperature,
-        )
-
-        config.automatic_function_calling = types.AutomaticFunctionCallingConfig(
-            maximum_remote_calls=1
-        )
-        self.chat = self.client.aio.chats.create(model=self.model, config=config)
+        self.stream = args.stream
+        self.cascade = None
+        if args.cascade:
+            # MODELS is ordered from strongest to fastest
+            self.cascade = Cascade(fast=MODELS[-1], strong=MODELS[0])
+            self.model = self.cascade.fast
+            tools.on_escalate = self.cascade.request_escalation
+        # Tool groups the model has loaded, and whether the chat needs to be
+        # recreated to offer them.
+        self.loaded_groups: list[str] = []
+        self.tools_changed = False
+        # Turns and time spent waiting for each model.
+        self.model_stats: dict[str, dict] = {}
+        self.task = self.create_task(args)
+        self.client: genai.Client | None = None
+        self.chat = self.create_chat()
         tools.on_failure = lambda msg: self.task_failure(msg)
         tools.on_success = lambda msg: self.task_success(msg)
+        tools.on_tool_call = self.tool_called
+        tools.on_load_tools = self.load_tools
+        self.budget = Budget(
+            max_tokens=args.max_tokens,
+            max_minutes=args.max_minutes,
+            max_builds=args.max_builds,
+            max_turns=args.max_turns,
+        )
+        tools.check_budget = self.budget.before_tool
+        self.stop_build_after_errors = args.stop_build_after_errors
+        tools.stop_build_after_errors = self.stop_build_after_errors
+        tools.build_lock = args.build_lock
+        if args.overlay:
+            tools.overlay = Overlay()
+        self.profiler = Profiler() if args.profile else None
+        if args.tool_cache:
+            tools.cache = ToolCache(args.tool_cache, args.tool_cache_size << 20)
         self.completed = False
         self.successful = None
         self.usage_metadata = None
         self.start_time = None
         self.duration = None
+        # Per-turn timings: model latency and the duration of each tool call.
+        self.timings: list[dict] = []
+        self.turn_timing: dict | None = None
+        # The text of a response that's being streamed, and function responses
+        # to send with the next message.
+        self.partial_text: str | None = None
+        self.pending_message: list[types.Part] | None = None
+        # History entries with their dict and json serializations.
+        self.history_cache: list[tuple[types.Content, dict, bytes]] = []
+        # The size of the next request, and token counts in progress.
+        self.context = ContextEstimator()
+        self.counting: set[asyncio.Task] = set()
+
+    def create_task(self, args: argparse.Namespace) -> tasks._BaseTask:
+        return tasks.get_task(args.task, args)
+
+    def create_chat(self):
+        self.client = genai.Client(api_key=get_api_key())
+        task_tools = list(self.task.tools)
+        if self.task.tool_groups:
+            task_tools.append(tools.dispatch(tools.load_tools))
+        if self.cascade is not None:
+            task_tools.append(tools.dispatch(tools.escalate))
+        config = types.GenerateContentConfig(
+            tools=task_tools,
+            system_instruction=system_prompt.SYSTEM_PROMPT,
+            temperature=self.temperature,
+        )
+
+        if self.stream:
+            # stream_message calls the functions itself
+            config.automatic_function_calling = types.AutomaticFunctionCallingConfig(
+                disable=True
+            )
+        else:
+            config.automatic_function_calling = types.AutomaticFunctionCallingConfig(
+                maximum_remote_calls=1
+            )
+        self.config = config
+        self.report_tool_schemas()
+        return self.client.aio.chats.create(model=self.model, config=config)
+
+    def report_tool_schemas(self):
+        """Log roughly how many tokens each tool's declaration adds to every
+        request."""
+        assert self.config.tools is not None
+        total = 0
+        for f in self.config.tools:
+            declaration = types.FunctionDeclaration.from_callable(
+                client=self.client._api_client, callable=f
+            )
+            # about four characters per token
+            tokens = len(declaration.model_dump_json(exclude_none=True)) // 4
+            total += tokens
+            events.emit("tool_schema", f"{f.__name__} ~{tokens} tokens", tokens=tokens)
+        events.emit("tool_schema", f"total ~{total} tokens", tokens=total)
+
+    def recreate_chat(self):
+        """Start a new chat with the current model and config, keeping the
+        history."""
+        self.chat = self.client.aio.chats.create(
+            model=self.model, config=self.config, history=self.chat.get_history()
+        )
+
+    def use_model(self, model: str):
+        """Switch the model used for the following turns, keeping the history."""
+        if model != self.model:
+            self.model = model
+            self.recreate_chat()
+
+    def load_tools(self, group: str):
+        """Offer a group of tools from the next turn on."""
+        if group not in self.task.tool_groups:
+            raise ValueError(f"The {group} tools aren't available for this task.")
+        if group in self.loaded_groups:
+            return
+        self.loaded_groups.append(group)
+        assert self.config.tools is not None
+        self.config.tools = self.config.tools + tools.named(tools.TOOL_GROUPS[group][1])
+        self.tools_changed = True
+
+    def tool_called(self, name: str, args: dict, response: dict, duration: float):
+        if self.turn_timing is not None:
+            self.turn_timing["tools"].append({"name": name, "duration": duration})
+        if self.cascade is not None:
+            self.cascade.tool_called(name, response)
 
     async def send_message(self, prompt: str | None = None) -> None:
+        reason = self.budget.before_turn()
+        if reason is not None:
+            self.task_failure(f"Budget exceeded: {reason}")
+            return
+        if self.tools_changed:
+            self.tools_changed = False
+            self.recreate_chat()
+        if self.cascade is not None:
+            self.use_model(self.cascade.next_model())
         while not self.completed:
             try:
-                response = await self.chat.send_message(prompt or "")
+                self.turn_timing = {
+                    "model": None,
+                    "model_name": self.model,
+                    "tools": [],
+                }
+                self.timings.append(self.turn_timing)
+                events.set_turn(len(self.timings))
+                message = self.pending_message or prompt or ""
+                self.check_context(message)
+                # Automatic function calling adds several entries in one turn,
+                # but only the message follows these in the request's prompt.
+                prompt_entries = len(self.chat.get_history()) + 1
+                if self.stream:
+                    response = await self.stream_message(message)
+                else:
+                    start = time.monotonic()
+                    response = await self.chat.send_message(message)
+                    # Tools are called from inside send_message, so take them
+                    # out to get the time spent waiting on the model.
+                    tool_time = sum(t["duration"] for t in self.turn_timing["tools"])
+                    self.turn_timing["model"] = time.monotonic() - start - tool_time
+                metrics.TURNS.inc(self.model)
+                stats = self.model_stats.setdefault(
+                    self.model, {"turns": 0, "latency": 0.0}
+                )
+                stats["turns"] += 1
+                stats["latency"] += self.turn_timing["model"]
+                metrics.MODEL_LATENCY.observe(self.turn_timing["model"], self.model)
                 if response.usage_metadata:
                     self.usage_metadata = response.usage_metadata.model_dump()
+                    self.count_tokens(response.usage_metadata)
+                    self.calibrate_context(response.usage_metadata, prompt_entries)
 
                 if response.candidates is None or len(response.candidates) != 1:
                     from pdb import set_trace
@@ -85,61 +364,300 @@ class TaskRunner:
                     candidate = response.candidates[0]
                     if candidate.content and candidate.content.parts:
                         for part in candidate.content.parts:
-                            if part.text:
-                                print(
-                                    f"FROM MODEL: {part.text.replace('\n', '\nFROM MODEL: ')}"
-                                )
+                            # streamed text has already been logged
+                            if part.text and not self.stream:
+                                events.emit("from_model", part.text)
                     else:
                         if candidate.finish_reason == types.FinishReason.RECITATION:
                             self.task_failure(
                                 f"Model ended up failing with: {candidate}"
                             )
                         else:
-                            print("WARNING, MODEL RETURNED: {candidate}")
+                            events.emit("warning", f"model returned: {candidate}")
                 break
             except ClientError as err:
+                self.timings.pop()
                 # TODO: implement better back-off
-                print(f"Got {err}, sleeping 30s and retrying...")
+                events.emit("backoff", f"got {err}, sleeping 30s and retrying")
+                metrics.BACKOFF_SLEEPS.inc()
+                metrics.BACKOFF_SECONDS.inc(amount=30)
                 await asyncio.sleep(30)
 
+    async def stream_message(
+        self, message: str | list[types.Part]
+    ) -> types.GenerateContentResponse:
+        """Send a message and stream the response, logging text as it arrives
+        and starting each function call as soon as it has been received.
+
+        The function responses are left in pending_message to be sent with the
+        next message. Returns the whole response once the stream is finished
+        and all of the function calls have returned.
+        """
+        start = time.monotonic()
+        self.partial_text = ""
+        parts: list[types.Part] = []
+        calls: list[asyncio.Task] = []
+        last = None
+        async for chunk in await self.chat.send_message_stream(message):
+            last = chunk
+            if not chunk.candidates or not chunk.candidates[0].content:
+                continue
+            for part in chunk.candidates[0].content.parts or []:
+                parts.append(part)
+                if part.text:
+                    self.partial_text += part.text
+                    events.emit("from_model", part.text)
+                if part.function_call:
+                    # Calls run one after another, in order, but overlap with
+                    # the rest of the response.
+                    previous = calls[-1] if calls else None
+                    calls.append(
+                        asyncio.create_task(
+                            self.call_tool(part.function_call, previous)
+                        )
+                    )
+        self.turn_timing["model"] = time.monotonic() - start
+        self.partial_text = None
+
+        if calls:
+            await asyncio.gather(*calls)
+            self.pending_message = [c.result() for c in calls]
+        else:
+            self.pending_message = None
+
+        candidate = last.candidates[0] if last and last.candidates else None
+        return types.GenerateContentResponse(
+            candidates=[
+                types.Candidate(
+                    content=types.Content(role="model", parts=parts) if parts else None,
+                    finish_reason=candidate.finish_reason if candidate else None,
+                )
+            ],
+            usage_metadata=last.usage_metadata if last else None,
+        )
+
+    async def call_tool(
+        self, call: types.FunctionCall, previous: asyncio.Task | None
+    ) -> types.Part:
+        """Call a tool the way automatic function calling does, after the
+        previous call has finished."""
+        if previous is not None:
+            await previous
+        functions = {f.__name__: f for f in self.config.tools or []}
+        try:
+            result = await asyncio.to_thread(functions[call.name], **(call.args or {}))
+            response = {"result": result}
+        except Exception as e:
+            response = {"error": str(e)}
+        return types.Part.from_function_response(name=call.name, response=response)
+
+    def count_tokens(self, usage: types.GenerateContentResponseUsageMetadata):
+        self.budget.add_tokens(usage.total_token_count or 0)
+        for kind, count in (
+            ("prompt", usage.prompt_token_count),
+            ("output", usage.candidates_token_count),
+            ("thoughts", usage.thoughts_token_count),
+            ("cached", usage.cached_content_token_count),
+        ):
+            if count:
+                metrics.TOKENS.inc(self.model, kind, amount=count)
+
+    def history_sizes(self) -> list[int]:
+        return [len(encoded) for _, encoded in self.serialized_history()]
+
+    def check_context(self, message: str | list[types.Part]):
+        """Estimate the size of the request that will send message and, if it's
+        too close to the context window, cut the oldest large tool results
+        short until it fits."""
+        parts = message if isinstance(message, list) else []
+        message_chars = len(message) if isinstance(message, str) else 0
+        message_chars += sum(len(p.model_dump_json(exclude_none=True)) for p in parts)
+        self.context.estimate(self.history_sizes(), message_chars)
+        if not self.context.over():
+            return
+
+        history = self.chat.get_history()
+        candidates = [
+            (i, part.function_response)
+            for i, content in enumerate(history)
+            for part in content.parts or []
+            if part.function_response
+        ] + [(len(history), p.function_response) for p in parts if p.function_response]
+        for i, response in candidates:
+            size = len(json.dumps(response.response, default=str))
+            if size < COMPACT_MIN_CHARS:
+                continue
+            response.response = compact_response(response.response)
+            compacted = len(json.dumps(response.response))
+            if i == len(history):
+                message_chars -= size - compacted
+            else:
+                # the entry has changed so its encoding has to be redone
+                del self.history_cache[i:]
+            events.emit(
+                "compacted",
+                f"{response.name} result in entry {i} from {size} to {compacted} "
+                + "characters",
+            )
+            self.context.estimate(self.history_sizes(), message_chars)
+            if not self.context.over():
+                break
+        events.emit("context", f"~{self.context.tokens} tokens after compacting")
+
+    def calibrate_context(
+        self,
+        usage: types.GenerateContentResponseUsageMetadata,
+        prompt_entries: int,
+    ):
+        """Calibrate the context estimate from a response to a request whose
+        prompt was the first prompt_entries history entries, and count the
+        exact tokens in a new large entry in the background."""
+        sizes = self.history_sizes()
+        if usage.prompt_token_count:
+            self.context.observe(usage.prompt_token_count, sizes[:prompt_entries])
+        if self.client is None or self.counting:
+            return
+        to_count = self.context.to_count(sizes)
+        if to_count:
+            index = to_count[-1]
+            content = self.chat.get_history()[index]
+            task = asyncio.create_task(self.count_entry(index, content, sizes[index]))
+            self.counting.add(task)
+            task.add_done_callback(self.counting.discard)
+
+    async def count_entry(self, index: int, content: types.Content, chars: int):
+        assert self.client is not None
+        try:
+            result = await self.client.aio.models.count_tokens(
+                model=self.model, contents=[content]
+            )
+        except Exception as e:
+            events.emit("count_tokens_failed", repr(e))
+            return
+        if result.total_tokens:
+            self.context.record_count(index, chars, result.total_tokens)
+
+    def warm_up(self):
+        """Check and prepare for the task. This runs in a thread alongside the
+        first model request so that the first tool calls return quickly."""
+        try:
+            self.task.preflight()
+        except Exception as e:
+            self.task_failure(f"Preflight check failed: {e!r}")
+            return
+        # The rest is only to speed things up later, so failures aren't fatal.
+        try:
+            tools.file_tree()
+            self.task.warm_up()
+        except Exception as e:
+            events.emit("warm_up_failed", repr(e))
+
     async def run(self):
-        self.task.preflight()
         self.start_time = time.time()
-        await self.send_message(self.task.prompt)
-        while not self.completed:
-            self.save_state()
-            await self.send_message()
+        metrics.ACTIVE_RUNS.inc()
+        if self.profiler is not None:
+            self.profiler.start()
+        try:
+            warm_up = asyncio.create_task(asyncio.to_thread(self.warm_up))
+            await self.send_message(self.task.prompt)
+            await warm_up
+            while not self.completed:
+                self.save_state()
+                await self.send_message()
+        finally:
+            metrics.ACTIVE_RUNS.dec()
+            tools.flush_overlay()
+            # The final turn is only in the history once send_message returns.
+            # Stopping the profiler saves the state with the profile.
+            if self.profiler is not None:
+                self.stop_profiler()
+            else:
+                self.save_state()
+            events.stop()
+
+    def stop_profiler(self):
+        assert self.profiler is not None
+        self.profiler.stop()
+        self.save_state()
+        if self.output:
+            folded = Path(self.output).with_suffix(".folded")
+            self.profiler.write_folded(folded)
+            events.emit("profile", str(folded))
+        for category, seconds in self.profiler.breakdown()["seconds"].items():
+            events.emit("profile", f"{category} {seconds:.1f}s")
+
+    def serialized_history(self) -> list[tuple[dict, bytes]]:
+        """Each history entry as a dict and as pre-encoded json.
+
+        Earlier turns never change so each one is only converted once.
+        """
+        history = self.chat.get_history()
+        cache = self.history_cache
+        unchanged = 0
+        while (
+            unchanged < min(len(cache), len(history))
+            and cache[unchanged][0] is history[unchanged]
+        ):
+            unchanged += 1
+        del cache[unchanged:]
+        for h in history[unchanged:]:
+            d = h.model_dump(exclude=WITHOUT_THOUGHTS)
+            # indented to match its position in a recording
+            encoded = textwrap.indent(json.dumps(d, indent=2), "    ").encode()
+            cache.append((h, d, encoded))
+        return [(d, encoded) for _, d, encoded in cache]
 
     def get_history(self):
-        return [remove_thought(h.model_dump()) for h in self.chat.get_history()]
+        return [d for d, _ in self.serialized_history()]
 
     def save_state(self):
         if self.output:
-            with open(self.output, "wt") as h:
-                json.dump(self.get_state(), h, indent=2)
+            state = self.get_state_json()
+            with open(self.output, "wb") as h:
+                h.write(state)
+            metrics.RECORDING_BYTES.inc(amount=len(state))
 
     def get_state(self):
+        return {"history": self.get_history(), **self.state_fields()}
+
+    def get_state_json(self) -> bytes:
+        """The same as json.dumps(self.get_state(), indent=2) but reusing the
+        already encoded history."""
+        history = b",\n".join(encoded for _, encoded in self.serialized_history())
+        fields = json.dumps(self.state_fields(), indent=2).encode()
+        if not history:
+            return b'{\n  "history": [],\n' + fields[2:]
+        return b'{\n  "history": [\n' + history + b"\n  ],\n" + fields[2:]
+
+    def state_fields(self):
         return {
-            "history": self.get_history(),
-            "model": self.model,
+            "model": "cascade" if self.cascade is not None else self.model,
+            "models": self.model_stats,
             "task": self.task.NAME,
             "task_prompt": self.task.prompt,
             "temperature": self.temperature,
+            "stop_build_after_errors": self.stop_build_after_errors,
+            "budget": self.budget.limits(),
             "usage": self.usage_metadata,
             "completed": self.completed,
             "successful": self.successful,
             "duration": self.duration or time.time() - (self.start_time or 0),
+            "timings": self.timings,
+            "streaming": self.partial_text,
+            "profile": self.profiler.breakdown() if self.profiler else None,
+            "tool_groups": self.loaded_groups,
+            "context": {"tokens": self.context.tokens, "limit": self.context.limit},
         }
 
     def task_success(self, message: str):
-        print(f"TASK SUCCESS: {message}")
+        events.emit("task_success", message)
         self.duration = time.time() - (self.start_time or 0)
         self.completed = True
         self.successful = True
         self.save_state()
 
     def task_failure(self, message):
-        print(f"TASK FAILURE: {message}")
+        events.emit("task_failure", message)
         self.duration = time.time() - (self.start_time or 0)
         self.completed = True
         self.successful = False
@@ -19,10 +19,22 @@ class _BaseTask:
     def preflight(self):
         pass
 
+    def warm_up(self):
+        """Get ready for the task. This runs in a thread while the first model
+        request is in flight."""
+        pass
+
     @property
     def tools(self) -> list[typing.Callable]:
+        """The tools offered from the start."""
         return tools.TOOLS
 
+    @property
+    def tool_groups(self) -> list[str]:
+        """Groups from tools.TOOL_GROUPS that the model can load when it needs
+        them."""
+        return []
+
     @property
     def prompt(self) -> str:
         raise NotImplementedError("prompt must be implemented by subclasses")
@@ -9,6 +9,10 @@ class HlcppMigration(_BaseTask):
 
     NAME = "hlcpp-migration"
 
+    # Documentation the prompt points the model at.
+    COMPARISON_DOC = "docs/development/languages/fidl/guides/c-family-comparison.md"
+    BINDINGS_DOC = "docs/reference/fidl/bindings/cpp-bindings.md"
+
     @staticmethod
     def register_arguments(parser: argparse.ArgumentParser):
         parser.add_argument(
@@ -22,30 +26,66 @@ class HlcppMigration(_BaseTask):
             type=str,
             help="The GN target of the component to migrate.",
         )
+        parser.add_argument(
+            "--leave-visibility",
+            action="store_true",
+            help="Don't have the model remove the component from the HLCPP "
+            + "visibility list, for when whoever started the run will.",
+        )
 
     def __init__(self, args):
         self.component_dir = args.component_dir
         self.component_target = args.component_target or f"//{args.component_dir}"
+        self.leave_visibility = args.leave_visibility
 
     def preflight(self):
         assert tools.check_gn_label(self.component_target)
 
+    def warm_up(self):
+        tools.start_background_build(self.component_target)
+        tools.prefetch([self.COMPARISON_DOC, self.BINDINGS_DOC])
+
     @property
     def tools(self) -> list:
-        # all of the tools
-        return tools.TOOLS
+        return tools.named(
+            [
+                "fx_build",
+                "check_gn_label",
+                "read_file",
+                "read_files",
+                "write_file",
+                "edit_file",
+                "list_tree",
+                "search_lines",
+                "success",
+                "fail",
+            ]
+        )
+
+    @property
+    def tool_groups(self) -> list[str]:
+        return ["directories", "patches"]
 
     @property
     def prompt(self) -> str:
+        visibility = (
+            ""
+            if self.leave_visibility
+            else f"""
+After migration from HLCPP to natural bindings is complete, remove lines
+referencing {self.component_target} from "build/cpp/hlcpp_visibility.gni". Do
+not modify any other lines.
+"""
+        )
         return f"""
 Migrate the component in the directory "{self.component_dir}" from the HLCPP
 FIDL bindings to the new Natural C++ bindings.
 
 Documentation covering the differences between the HLCPP and new C++ bindings
-are in: docs/development/languages/fidl/guides/c-family-comparison.md
+are in: {self.COMPARISON_DOC}
 
 Documentation specifically about the new C++ bindings are in:
-docs/reference/fidl/bindings/cpp-bindings.md
+{self.BINDINGS_DOC}
 
 If the component already uses the wire or natural bindings in some places leave
 that code alone and only modify the parts of the component that use HLCPP.
@@ -62,9 +102,5 @@ Never try to add realm builder support. The label
 
 Before referencing new targets or labels in BUILD.gn files you MUST ALWAYS use
 the {tools.check_gn_label.__name__} tool to validate that the label exists.
-
-After migration from HLCPP to natural bindings is complete, remove lines
-referencing {self.component_target} from "build/cpp/hlcpp_visibility.gni". Do
-not modify any other lines.
-
+{visibility}
 """
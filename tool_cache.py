@@ -0,0 +1,158 @@
+"""
+A cache of read-only tool results shared between runs (and processes) on the
+same checkout.
+
+Results are keyed by the tool, its arguments and the state of the source tree:
+the git tree of HEAD plus the state of any dirty files the result could depend
+on. Other runs may be editing the same checkout, so tools that depend on dirty
+files find them again (only where they look) before each lookup. The cache is
+a SQLite database so several runs can use it at once. The least recently used
+results are evicted once it gets too big.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import subprocess
+import threading
+import time
+import typing
+from pathlib import Path
+
+import events
+import metrics
+
+
+class ToolCache:
+    def __init__(self, path: Path, max_bytes: int):
+        self.max_bytes = max_bytes
+        # tools may be called from more than one thread
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS results "
+            + "(key TEXT PRIMARY KEY, value TEXT, size INTEGER, accessed REAL)"
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)"
+        )
+        self.db.commit()
+        # files written by this run, which may not be on disk yet
+        self.written: set[str] = set()
+        self.tree = self._tree()
+
+    def _tree(self) -> str:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD^{tree}"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+
+    def _dirty(self, pathspecs: list[str]) -> set[str]:
+        """Find the current git tree and the tracked files matching pathspecs
+        that differ from it, whether written by this run or anything else."""
+        self.tree = self._tree()
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "-z", "--untracked-files=no", "--"]
+            + pathspecs,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        dirty = set()
+        entries = iter(status.split("\0"))
+        for entry in entries:
+            if not entry:
+                continue
+            dirty.add(entry[3:])
+            if entry[0] in "RC":
+                # renames and copies are followed by the original path
+                dirty.add(next(entries))
+        return dirty
+
+    def mark_dirty(self, path: str):
+        self.written.add(path)
+
+    def dirty_under(self, directory: str) -> list[str]:
+        """Dirty files in a directory. An empty directory is the whole tree."""
+        prefix = directory.rstrip("/") + "/" if directory else ""
+        dirty = self._dirty([prefix or "."])
+        dirty.update(p for p in self.written if p.startswith(prefix))
+        return sorted(dirty)
+
+    def dirty_with_suffix(self, suffixes: list[str]) -> list[str]:
+        """Dirty files anywhere in the tree whose names end with a suffix."""
+        dirty = self._dirty(["*" + suffix for suffix in suffixes])
+        dirty.update(p for p in self.written if p.endswith(tuple(suffixes)))
+        return sorted(dirty)
+
+    def key(self, tool: str, args: dict, paths: list[str]) -> str:
+        """The key for a tool call whose result depends on the files in paths
+        (beyond what's in the git tree)."""
+        states = []
+        for path in sorted(paths):
+            try:
+                stat = os.stat(path)
+                states.append((path, stat.st_size, stat.st_mtime_ns))
+            except FileNotFoundError:
+                states.append((path, None, None))
+        material = json.dumps([tool, args, self.tree, states], sort_keys=True)
+        return hashlib.sha256(material.encode()).hexdigest()
+
+    def call(
+        self,
+        tool: str,
+        args: dict,
+        paths: list[str],
+        func: typing.Callable[[], typing.Any],
+    ) -> typing.Any:
+        """Return the cached result of a tool call, calling func to produce it
+        if it isn't in the cache."""
+        key = self.key(tool, args, paths)
+        with self.lock:
+            row = self.db.execute(
+                "SELECT value FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                self.db.execute(
+                    "UPDATE results SET accessed = ? WHERE key = ?", (time.time(), key)
+                )
+                self.db.commit()
+        if row is not None:
+            events.emit("cache_hit", f"{tool} {args}")
+            metrics.TOOL_CACHE.inc(tool, "hit")
+            return json.loads(row[0])
+
+        metrics.TOOL_CACHE.inc(tool, "miss")
+        result = func()
+        value = json.dumps(result)
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                (key, value, len(value), time.time()),
+            )
+            self.evict()
+            self.db.commit()
+        return result
+
+    def evict(self):
+        """Drop the least recently used results until the cache fits."""
+        (total,) = self.db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM results"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        rows = self.db.execute(
+            "SELECT key, size FROM results ORDER BY accessed"
+        ).fetchall()
+        evict = []
+        for key, size in rows:
+            if excess <= 0:
+                break
+            evict.append((key,))
+            excess -= size
+        self.db.executemany("DELETE FROM results WHERE key = ?", evict)
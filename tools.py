@@ -2,15 +2,43 @@
 Tools that we offer to the assistant.
 """
 
+import atexit
+import contextlib
+import difflib
+import fcntl
+import functools
+import inspect
 import os
+import re
+import signal
 import subprocess
 import sys
+import threading
+import time
 import typing
+from pathlib import PurePosixPath
+
+import events
+import metrics
+import patch as patching
+from file_tree import FileTree
+from overlay import Overlay
+from tool_cache import ToolCache
 
 TOOLS = []
 
 on_success: None | typing.Callable[[str], None] = None
 on_failure: None | typing.Callable[[str], None] = None
+on_escalate: None | typing.Callable[[str], None] = None
+# Called after every tool call the model makes with the tool name, its
+# arguments, the response (as {"result": ...} or {"error": ...}) and how long it
+# took in seconds.
+on_tool_call: None | typing.Callable[[str, dict, dict, float], None] = None
+# Called with the name of a tool group when the model loads it.
+on_load_tools: None | typing.Callable[[str], None] = None
+# Called before every tool call the model makes with the tool name. Returns why
+# the run should stop instead of calling the tool, or None.
+check_budget: None | typing.Callable[[str], str | None] = None
 
 
 class WrappedTool:
@@ -27,24 +55,128 @@ class WrappedTool:
         return self.func(*args, **kwargs)
 
 
+def dispatch(func):
+    """Wrap a tool so that each call made by the model is timed and reported."""
+
+    @functools.wraps(func)
+    def wrapper(**kwargs):
+        name = func.__name__
+        if check_budget is not None:
+            reason = check_budget(name)
+            if reason is not None:
+                if on_failure is not None:
+                    on_failure(f"Budget exceeded: {reason}")
+                raise RuntimeError(f"Budget exceeded, the run is over: {reason}")
+        metrics.TOOL_CALLS.inc(name)
+        start = time.monotonic()
+        try:
+            result = func(**kwargs)
+        except Exception as e:
+            duration = time.monotonic() - start
+            metrics.TOOL_LATENCY.observe(duration, name)
+            if on_tool_call is not None:
+                on_tool_call(name, kwargs, {"error": str(e)}, duration)
+            raise
+        duration = time.monotonic() - start
+        metrics.TOOL_LATENCY.observe(duration, name)
+        if on_tool_call is not None:
+            on_tool_call(name, kwargs, {"result": result}, duration)
+        return result
+
+    return wrapper
+
+
 def tool(func):
     """A decorator that adds the decorated function to the global TOOLS list."""
-    TOOLS.append(func)
+    TOOLS.append(dispatch(func))
     return WrappedTool(func)
 
 
+# A cache of read-only tool results shared between runs, if enabled.
+cache: ToolCache | None = None
+# Changes to files that haven't been written to disk yet, if enabled.
+overlay: Overlay | None = None
+
+
+def cached(depends_on: typing.Callable[..., list[str]]):
+    """A decorator that caches a read-only tool's results in the shared cache.
+
+    depends_on is called with the tool's arguments and returns the files whose
+    current state the result depends on, beyond what's committed in git.
+    """
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if cache is None:
+                return func(*args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = dict(bound.arguments)
+            depends_on_paths = depends_on(**arguments)
+            if overlay is not None and any(p in overlay for p in depends_on_paths):
+                # the cache only knows about files on disk
+                return func(**arguments)
+            return cache.call(
+                func.__name__,
+                arguments,
+                depends_on_paths,
+                lambda: func(**arguments),
+            )
+
+        return wrapper
+
+    return decorator
+
+
+def _gn_files() -> list[str]:
+    # Label checks depend on the build graph: dirty GN files and when it was
+    # last generated.
+    assert cache is not None
+    return cache.dirty_with_suffix([".gn", ".gni"]) + ["out/default/build.ninja"]
+
+
 def check_path(path: str):
     """Check that a path isn't weird"""
     assert ".." not in path
     assert not path.startswith("/")
 
 
-def run_command_lines(command: list[str], quiet=False) -> dict:
-    print(f"RUN: {' '.join(command)}")
-
+def _command_env() -> dict[str, str]:
     # fewer stats
     env = dict(os.environ)
-    del env["FX_BUILD_RBE_STATS"]
+    env.pop("FX_BUILD_RBE_STATS", None)
+    return env
+
+
+# The process groups of commands that are running, so that they aren't left
+# running (builds in particular, in a shared output directory) if village exits
+# while they run.
+_running: set[int] = set()
+
+
+def kill_running():
+    for group in list(_running):
+        with contextlib.suppress(ProcessLookupError):
+            os.killpg(group, signal.SIGTERM)
+
+
+atexit.register(kill_running)
+
+
+def run_command_lines(
+    command: list[str],
+    quiet=False,
+    stop: None | typing.Callable[[str], bool] = None,
+) -> dict:
+    """Run a command, collecting its output lines.
+
+    If `stop` is passed it's called with each line of output as it arrives and
+    the command is killed as soon as it returns True.
+    """
+    events.emit("run", " ".join(command), command=command)
 
     process = subprocess.Popen(
         command,
@@ -52,22 +184,43 @@ def run_command_lines(command: list[str], quiet=False) -> dict:
         stderr=subprocess.STDOUT,
         text=True,
         bufsize=1,
-        env=env,
+        env=_command_env(),
+        # so that stopping kills the whole process group, not just the wrapper
+        start_new_session=True,
     )
+    _running.add(process.pid)
     captured_output = []
-    if process.stdout:
-        for line in iter(process.stdout.readline, ""):
-            # Print to the console in real-time
-            if not quiet:
-                sys.stdout.write("OUTPUT: " + line)
-            # Store for the final returned string
-            captured_output.append(line)
-
-    process.wait()
+    stopped = False
+    try:
+        if process.stdout:
+            for line in iter(process.stdout.readline, ""):
+                # Log in real-time
+                if not quiet:
+                    events.emit("output", line)
+                # Store for the final returned string
+                captured_output.append(line)
+                if stop is not None and stop(line):
+                    events.emit("stopping", "too many errors")
+                    os.killpg(process.pid, signal.SIGTERM)
+                    stopped = True
+                    break
+        process.wait()
+    finally:
+        if process.returncode is None:
+            # interrupted, so don't leave the command running on its own
+            with contextlib.suppress(ProcessLookupError):
+                os.killpg(process.pid, signal.SIGTERM)
+            process.wait()
+        _running.discard(process.pid)
+
     if process.returncode != 0:
-        print(f"RETURNED: {process.returncode}")
+        events.emit("returned", str(process.returncode), returncode=process.returncode)
 
-    return {"success": process.returncode == 0, "output": captured_output}
+    return {
+        "success": process.returncode == 0 and not stopped,
+        "output": captured_output,
+        "stopped": stopped,
+    }
 
 
 def run_command(command: list[str], quiet=False) -> dict:
@@ -75,6 +228,107 @@ def run_command(command: list[str], quiet=False) -> dict:
     return {"success": result["success"], "output": "".join(result["output"])}
 
 
+# A file that's locked while building, so that runs in other processes can
+# share the output directory.
+build_lock: str | None = None
+# Held while building in this process. The background build may not have
+# started by the time the model first builds, so waiting for it isn't enough.
+_building = threading.Lock()
+
+
+@contextlib.contextmanager
+def building():
+    """Hold the build locks."""
+    with _building:
+        if build_lock is None:
+            yield
+            return
+        with open(build_lock, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+_background_build: threading.Thread | None = None
+
+
+def start_background_build(target: str):
+    """Start building a target in the background, so that ninja's state is warm
+    and anything out of date is rebuilt before the model's first build."""
+    global _background_build
+
+    def build():
+        with building():
+            events.emit("background_build", target, target=target)
+            process = subprocess.Popen(
+                ["fx", "build", "-q", target],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                env=_command_env(),
+                start_new_session=True,
+            )
+            _running.add(process.pid)
+            process.wait()
+            _running.discard(process.pid)
+
+    _background_build = threading.Thread(target=build, daemon=True)
+    _background_build.start()
+
+
+def wait_for_background_build():
+    """Wait for a build started by start_background_build, since two builds
+    can't share an output directory. If it hasn't taken the build lock yet the
+    lock keeps the builds apart instead."""
+    global _background_build
+    if _background_build is not None:
+        events.emit("waiting", "for the background build")
+        _background_build.join()
+        _background_build = None
+
+
+def prefetch(paths: list[str]):
+    """Read files so they're in the page cache before the model asks for them."""
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                while f.read(1 << 20):
+                    pass
+        except OSError as e:
+            events.emit("prefetch_failed", f"{path}: {e}", path=path)
+
+
+# Stop fx_build once this many distinct errors have been seen. 0 means always
+# let the build run to completion.
+stop_build_after_errors = 0
+
+_ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
+_BUILD_ERROR = re.compile(
+    # compilers and linkers: "path:line:col: error: ...", "ld.lld: error: ..."
+    r"^\S+?: (fatal )?error: "
+    # rustc: "error[E0425]: ..."
+    r"|^error(\[E\d+\])?: "
+    # GN: "ERROR at //foo/BUILD.gn:1:2: ...", "ERROR Unresolved dependencies."
+    r"|^ERROR( at |\b)"
+)
+
+
+class BuildErrors:
+    """Collects the distinct errors reported in build output."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.errors: list[str] = []
+
+    def __call__(self, line: str) -> bool:
+        """Scan a line of output, returning True if the build should stop."""
+        line = _ANSI_ESCAPE.sub("", line).strip()
+        if _BUILD_ERROR.match(line) and line not in self.errors:
+            self.errors.append(line)
+        return bool(self.limit) and len(self.errors) >= self.limit
+
+
 @tool
 def fx_build(target: str) -> dict:
     """Build the Fuchsia source tree.
@@ -85,10 +339,15 @@ def fx_build(target: str) -> dict:
 
     Returns:
         A dictionary with a "success" member indicating if the build succeeded
-        and an "output" member holding the output from the build tools.
+        and an "output" member holding the output from the build tools. If the
+        build was stopped early because of errors there will also be an
+        "errors" member listing the distinct errors that were found and a
+        "note" member explaining that.
     """
 
-    print(f"BUILD: {target}")
+    events.emit("build", target, target=target)
+    flush_overlay()
+    wait_for_background_build()
     command = [
         "fx",
         "build",
@@ -96,7 +355,19 @@ def fx_build(target: str) -> dict:
     ]
     if target:
         command.append(target)
-    return run_command(command)
+    errors = BuildErrors(stop_build_after_errors)
+    with building():
+        result = run_command_lines(command, stop=errors)
+    build: dict = {"success": result["success"]}
+    if result["stopped"]:
+        # otherwise the errors are all in the output already
+        build["errors"] = errors.errors
+        build["note"] = (
+            f"The build was stopped early after {len(errors.errors)} errors. "
+            + "Fix these and build again to see if there are more."
+        )
+    build["output"] = "".join(result["output"])
+    return build
 
 
 @tool
@@ -107,6 +378,7 @@ def fx_test(test_name: str) -> str:
 
 
 @tool
+@cached(lambda label: _gn_files())
 def check_gn_label(label: str) -> bool:
     """Quickly checks if a GN label is probably valid.
     This is a heuristic check but helpful to avoid mistakes when updating BUILD.gn files.
@@ -120,7 +392,7 @@ def check_gn_label(label: str) -> bool:
 
     # TODO: see if calling `gn desc` works better
 
-    print(f"CHECK GN LABEL: {label}")
+    events.emit("check_gn_label", label)
     if not label.startswith("//"):
         return False
     path = label[2:]
@@ -130,11 +402,12 @@ def check_gn_label(label: str) -> bool:
     exists = run_command_lines(
         ["ninja", "-C", "out/default", "-t", "query", path], quiet=True
     )["success"]
-    print(f"CHECK GN LABEL {label}: {exists}")
+    events.emit("check_gn_label", f"{label}: {exists}", label=label, exists=exists)
     return exists
 
 
 @tool
+@cached(lambda path: [path])
 def read_file(path: str) -> str:
     """Read the contents of a file in the Fuchsia source tree.
 
@@ -146,14 +419,15 @@ def read_file(path: str) -> str:
     Returns:
         the contents of the file if it exists.
     """
-    print(f"READ FILE: {path}")
+    events.emit("read_file", path, path=path)
 
     check_path(path)
 
-    return open(path, "r").read()
+    return _read(path)
 
 
 @tool
+@cached(lambda paths: paths)
 def read_files(paths: list[str]) -> dict[str, str]:
     """Read the contents of multiple files in the Fuchsia source tree.
 
@@ -167,22 +441,75 @@ def read_files(paths: list[str]) -> dict[str, str]:
         a list dictionary whose keys are the file paths and whose values are
         contents of each file, if they exist.
     """
-    print(f"READ FILES: {' '.join(paths)}")
+    events.emit("read_files", " ".join(paths), paths=paths)
 
     files = {}
     for path in paths:
         check_path(path)
         try:
-            files[path] = open(path, "r").read()
+            files[path] = _read(path)
         except Exception as e:
-            print(f"READ FILE {path} failed: {e}")
+            events.emit("read_file_failed", f"{path}: {e}", path=path)
 
     return files
 
 
+def _read(path: str) -> str:
+    if overlay is not None:
+        return overlay.read(path)
+    return open(path, "r").read()
+
+
+def _read_if_exists(path: str) -> str | None:
+    check_path(path)
+    if not (overlay.exists(path) if overlay is not None else os.path.exists(path)):
+        return None
+    return _read(path)
+
+
+def _write(path: str, contents: str | None):
+    """Write (or delete, if contents is None) a file, logging a diff of the
+    change."""
+    check_path(path)
+    original = _read_if_exists(path)
+    diff = "".join(
+        difflib.unified_diff(
+            (original or "").splitlines(keepends=True),
+            (contents or "").splitlines(keepends=True),
+            f"a/{path}",
+            f"b/{path}",
+        )
+    )
+    events.emit("diff", diff, path=path)
+    if cache is not None:
+        cache.mark_dirty(path)
+    if overlay is not None:
+        overlay.write(path, contents)
+    elif contents is None:
+        os.unlink(path)
+    else:
+        with open(path, "wt") as f:
+            f.write(contents)
+    if _file_tree is not None:
+        if contents is None:
+            _file_tree.remove(path)
+        else:
+            _file_tree.add(path)
+
+
+def flush_overlay():
+    """Write the changes held in the overlay to disk, for the build or at the
+    end of a run."""
+    if overlay is None or not overlay.files:
+        return
+    flushed = overlay.flush()
+    events.emit("flush", f"{len(flushed)} files", paths=flushed)
+
+
 @tool
 def write_file(path: str, contents: str) -> None:
     """Overwrite the contents of a file in the Fuchsia source tree.
+    To change part of an existing file, prefer edit_file or apply_patch.
 
 
     Args:
@@ -190,23 +517,82 @@ def write_file(path: str, contents: str) -> None:
         contents: the contents to write to the file.
 
     """
-    print(f"WRITE FILE: {path} ({len(contents)} bytes)")
+    events.emit("write_file", f"{path} ({len(contents)} bytes)", path=path)
+    _write(path, contents)
 
-    check_path(path)
 
-    diff = False
-    orig = path + ".orig"
-    if os.path.exists(path):
-        assert not os.path.exists(orig)
-        os.rename(path, orig)
-        diff = True
+@tool
+def edit_file(
+    path: str, old_string: str, new_string: str, replace_all: bool = False
+) -> str:
+    """Replace text in a file in the Fuchsia source tree.
+    This is much quicker than rewriting the whole file with write_file.
+
 
-    with open(path, "wt") as f:
-        f.write(contents)
+    Args:
+        path: the path to the file, relative to the root of the Fuchsia tree.
+        old_string: the exact text to replace, including whitespace and
+        indentation. Include enough surrounding lines to make it unique in the file.
+        new_string: the text to replace it with.
+        replace_all: replace every occurrence of old_string instead of requiring
+        it to occur exactly once.
 
-    if diff:
-        subprocess.call(["diff", "-u", orig, path])
-        os.unlink(orig)
+    Returns:
+        a description of the change that was made.
+    """
+    events.emit(
+        "edit_file",
+        f"{path} ({len(old_string)} -> {len(new_string)} bytes)",
+        path=path,
+    )
+    contents = _read_if_exists(path)
+    if contents is None:
+        raise ValueError(
+            f"{path} does not exist. Use {write_file.__name__} to create it."
+        )
+    if not old_string:
+        raise ValueError("old_string must not be empty.")
+    count = contents.count(old_string)
+    if count == 0:
+        raise ValueError(f"old_string was not found in {path}. Nothing was changed.")
+    if count > 1 and not replace_all:
+        raise ValueError(
+            f"old_string occurs {count} times in {path}. Include more context to "
+            + "make it unique or set replace_all. Nothing was changed."
+        )
+    _write(path, contents.replace(old_string, new_string))
+    return f"Replaced {count} occurrence{'s' if count != 1 else ''} in {path}."
+
+
+@tool
+def apply_patch(patch: str) -> str:
+    """Apply a patch in unified diff format (like the output of `diff -u` or
+    `git diff`) to files in the Fuchsia source tree.
+    Only the changed lines and a few lines of context are needed, so this is
+    much quicker than rewriting whole files with write_file. Paths in the
+    patch are relative to the root of the Fuchsia tree and may have "a/" and
+    "b/" prefixes. Use /dev/null as the old path to create a file or as the new
+    path to delete one.
+
+
+    Args:
+        patch: the unified diff to apply. It may change several files.
+
+    Returns:
+        a description of the files that were changed. If any hunk doesn't match
+        the files exactly none of the patch is applied.
+    """
+    events.emit("apply_patch", f"{len(patch)} bytes")
+    try:
+        changes = patching.apply(patch, _read_if_exists)
+    except patching.PatchError as e:
+        raise ValueError(f"{e}\nNothing was changed.")
+    for path, contents in changes.items():
+        _write(path, contents)
+    return "Patched " + ", ".join(
+        f"{path} (deleted)" if contents is None else path
+        for path, contents in changes.items()
+    )
 
 
 @tool
@@ -220,10 +606,13 @@ def list_directory(path: str) -> list[str]:
     Returns:
         a list of files and subdirectories. The subdirectories will end in a forward-slash (/).
     """
-    print(f"LIST DIRECTORY: {path}")
+    events.emit("list_directory", path)
     check_path(path)
+    entries = os.listdir(path)
+    if overlay is not None:
+        entries = overlay.listdir(path, entries)
     contents = []
-    for entry in os.listdir(path):
+    for entry in entries:
         if os.path.isdir(os.path.join(path, entry)):
             contents.append(entry + "/")
         else:
@@ -231,6 +620,41 @@ def list_directory(path: str) -> list[str]:
     return contents
 
 
+# The most lines list_tree returns.
+MAX_TREE_LINES = 500
+
+_file_tree: FileTree | None = None
+
+
+def file_tree() -> FileTree:
+    """The snapshot of files in the source tree, loaded on first use."""
+    global _file_tree
+    if _file_tree is None:
+        _file_tree = FileTree.load()
+    return _file_tree
+
+
+@tool
+def list_tree(path: str, depth: int = 2, glob: str = "") -> str:
+    """Recursively list the files under a directory in the Fuchsia source tree.
+    This is much faster than listing one directory at a time. It only lists files under source control and files
+    that have been written.
+
+
+    Args:
+        path: the path to the directory, relative to the root of the Fuchsia tree. Empty for the root of the tree.
+        depth: how many levels of directories to list. Directories below that are shown with the number of files
+        they contain.
+        glob: optional glob to only list matching files, for example "*.cc" or "BUILD.gn".
+
+    Returns:
+        an indented tree of files and subdirectories. The subdirectories will end in a forward-slash (/).
+    """
+    events.emit("list_tree", f"{path} depth {depth} {glob}")
+    check_path(path)
+    return file_tree().render(path, max(depth, 1), glob, MAX_TREE_LINES)
+
+
 def git_grep(path: str, pattern: str, regex: bool) -> list[str]:
     check_path(path)
     command = ["git"]
@@ -242,19 +666,72 @@ def git_grep(path: str, pattern: str, regex: bool) -> list[str]:
     command.append(pattern)
 
     grep = run_command_lines(command)
+    absolute_paths = []
     if grep["success"]:
-        relative_paths = grep["output"]
-        absolute_paths = []
-        for relative_path in relative_paths:
+        for relative_path in grep["output"]:
             absolute_paths.append(os.path.join(path, relative_path.strip()))
-        print(f"GIT GREP RETURNS: {repr(absolute_paths)}")
-        return absolute_paths
     else:
-        print("GIT GREP FAILED")
-        return []
+        events.emit("git_grep_failed", path)
+    if overlay is not None:
+        # git only sees what's on disk, so changed files are searched here
+        changed = overlay.under(path)
+        matcher = _overlay_pattern([pattern], regex)
+        absolute_paths = [p for p in absolute_paths if p not in changed] + [
+            p
+            for p, contents in sorted(changed.items())
+            if contents is not None and matcher.search(contents)
+        ]
+    events.emit("git_grep_returns", repr(absolute_paths))
+    return absolute_paths
+
+
+def _basic_regex(pattern: str) -> str:
+    """Translate a basic POSIX regex, where grouping, alternation and repetition
+    need a backslash, into python's syntax."""
+    translated = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\" and i + 1 < len(pattern):
+            n = pattern[i + 1]
+            translated.append(n if n in "(){}|+?" else c + n)
+            i += 2
+            continue
+        translated.append("\\" + c if c in "(){}|+?" else c)
+        i += 1
+    return "".join(translated)
+
+
+def _overlay_pattern(patterns: list[str], regex: bool) -> re.Pattern:
+    """A python regex matching lines that git grep would match."""
+    if regex:
+        alternatives = [f"(?:{_basic_regex(p)})" for p in patterns]
+    else:
+        alternatives = [re.escape(p) for p in patterns]
+    return re.compile("|".join(alternatives), re.MULTILINE)
+
+
+def _grep_lines(contents: str, matcher: re.Pattern, context: int) -> list[str]:
+    """The lines of a file matching matcher, formatted like git grep -n."""
+    lines = contents.splitlines()
+    formatted: list[str] = []
+    # the last line that's been included
+    last = -1
+    for i, line in enumerate(lines):
+        if not matcher.search(line):
+            continue
+        start = max(i - context, last + 1)
+        if context and formatted and start > last + 1:
+            formatted.append("--")
+        for j in range(start, min(i + context + 1, len(lines))):
+            separator = ":" if matcher.search(lines[j]) else "-"
+            formatted.append(f"{j + 1}{separator}{lines[j]}")
+            last = j
+    return formatted
 
 
 @tool
+@cached(lambda path, substring: cache.dirty_under(path))
 def search_directory(path: str, substring: str) -> list[str]:
     """Recursively for a substring in a directory in the Fuchsia source tree.
     This only searches files under source control, not those that are generated as part of the build.
@@ -267,12 +744,13 @@ def search_directory(path: str, substring: str) -> list[str]:
     Returns:
         a list of files that contain the string. The paths are relative to the Fuchsia source root.
     """
-    print(f"SEARCH DIRECTORY: {path} for {repr(substring)}")
+    events.emit("search_directory", f"{path} for {repr(substring)}")
     check_path(path)
     return git_grep(path, substring, False)
 
 
 @tool
+@cached(lambda path, pattern: cache.dirty_under(path))
 def regex_search_directory(path: str, pattern: str) -> list[str]:
     """Recursively for a regular expression in a directory in the Fuchsia source tree. Empty if you want to search the whole tree.
     This only searches files under source control, not those that are generated as part of the build.
@@ -285,11 +763,182 @@ def regex_search_directory(path: str, pattern: str) -> list[str]:
     Returns:
         a list of files that contain the string. The paths are relative to the Fuchsia source root.
     """
-    print(f"REGEX SEARCH DIRECTORY: {path} for {repr(pattern)}")
+    events.emit("regex_search_directory", f"{path} for {repr(pattern)}")
     check_path(path)
     return git_grep(path, pattern, True)
 
 
+# Limits on how many matching lines search_lines returns.
+MAX_MATCHES_PER_FILE = 10
+MAX_MATCHES = 100
+MAX_CONTEXT = 10
+
+
+def git_grep_lines(
+    path: str,
+    patterns: list[str],
+    regex: bool,
+    globs: list[str],
+    context: int,
+) -> dict:
+    check_path(path)
+    command = ["git", "-c", "core.quotePath=false"]
+    if path:
+        command.extend(["-C", path])
+    command.extend(["grep", "-n", "--heading", "--break", "--color=never"])
+    if context:
+        command.append(f"--context={context}")
+    if not regex:
+        command.append("--fixed-strings")
+    for pattern in patterns:
+        command.extend(["-e", pattern])
+    if globs:
+        command.append("--")
+        for glob in globs:
+            # Globs without a directory match at any depth.
+            if "/" not in glob:
+                glob = "**/" + glob
+            command.append(f":(glob){glob}")
+
+    grep = run_command_lines(command, quiet=True)
+    output = grep["output"]
+    if not grep["success"]:
+        events.emit("git_grep_failed", path)
+        output = []
+    if overlay is not None:
+        output = _overlay_grep_lines(path, output, patterns, regex, globs, context)
+
+    # With --heading and --break each file's name is on its own line, followed
+    # by "N:line" for matches, "N-line" for context and "--" between hunks.
+    # Files are separated by blank lines.
+    files: dict[str, list[str]] = {}
+    total = 0
+    truncated = False
+    current = None
+    for line in output:
+        line = line.rstrip("\n")
+        if not line:
+            current = None
+            continue
+        if current is None:
+            current = os.path.join(path, line)
+            files[current] = []
+            matches = 0
+            # Context lines still allowed after the last match we kept.
+            remaining_context = None
+            continue
+        number, separator, _ = line.partition(":")
+        is_match = bool(separator) and number.isdigit()
+        full = matches >= MAX_MATCHES_PER_FILE or total >= MAX_MATCHES
+        if full:
+            if is_match:
+                truncated = True
+                remaining_context = 0
+            elif line == "--":
+                remaining_context = 0
+            if not remaining_context:
+                continue
+            remaining_context -= 1
+        elif is_match:
+            matches += 1
+            total += 1
+            remaining_context = context
+        files[current].append(line)
+
+    result = {file: "\n".join(lines) for file, lines in files.items() if lines}
+    events.emit("git_grep_returns", f"{total} lines in {len(result)} files")
+    return {"files": result, "truncated": truncated}
+
+
+def _overlay_grep_lines(
+    path: str,
+    output: list[str],
+    patterns: list[str],
+    regex: bool,
+    globs: list[str],
+    context: int,
+) -> list[str]:
+    """Replace the files changed in the overlay in git grep --heading --break
+    output with the matches in their new contents."""
+    assert overlay is not None
+    changed = overlay.under(path)
+    merged = []
+    current = None
+    for line in output:
+        if not line.rstrip("\n"):
+            if current not in changed:
+                merged.append(line)
+            current = None
+            continue
+        if current is None:
+            current = os.path.join(path, line.rstrip("\n"))
+        if current not in changed:
+            merged.append(line)
+    matcher = _overlay_pattern(patterns, regex)
+    for file, contents in sorted(changed.items()):
+        relative = os.path.relpath(file, path) if path else file
+        if contents is None or (
+            globs and not any(PurePosixPath(relative).match(g) for g in globs)
+        ):
+            continue
+        lines = _grep_lines(contents, matcher, context)
+        if lines:
+            merged.extend(["", relative, *lines])
+    return merged
+
+
+@tool
+@cached(lambda path, **_: cache.dirty_under(path))
+def search_lines(
+    path: str,
+    patterns: list[str],
+    # automatic function calling can't parse list[str] | None
+    globs: typing.Optional[list[str]] = None,
+    context: int = 2,
+    regex: bool = False,
+) -> dict:
+    """Recursively search for lines matching any of several patterns in a directory in the Fuchsia source tree.
+    This returns the matching lines themselves, with surrounding context, so there's no need to read each file to see the matches.
+    This only searches files under source control, not those that are generated as part of the build.
+
+
+    Args:
+        path: the path of a directory, relative to the root of the Fuchsia tree. Empty if you want to search the whole tree.
+        patterns: the substrings (or regular expressions if regex is true) to search for. Lines matching any of them are returned.
+        globs: optional path globs limiting which files are searched, for example "*.cc" or "src/lib/**/BUILD.gn".
+        context: the number of lines of context to include before and after each match.
+        regex: if true the patterns are regular expressions in basic POSIX regex syntax, otherwise they are plain substrings.
+
+    Returns:
+        a dictionary with a "files" member mapping each file that matched (relative to the Fuchsia source root) to its
+        matching lines, formatted like grep: "123:text" for matching lines, "124-text" for context lines and "--" between
+        groups of lines. The "truncated" member is true if some matches were left out because there were too many.
+    """
+    globs = globs or []
+    events.emit("search_lines", f"{path} for {repr(patterns)} in {repr(globs)}")
+    check_path(path)
+    context = max(0, min(context, MAX_CONTEXT))
+    return git_grep_lines(path, patterns, regex, globs, context)
+
+
+def escalate(reason: str) -> str:
+    """Ask for a more capable (but slower) model to take over for the next few
+    turns. Use this when you're stuck, for example when you can't work out how
+    to fix a build error after several attempts.
+
+
+    Args:
+        reason: what you're stuck on.
+
+    Returns:
+        a confirmation that the request was made.
+    """
+    events.emit("escalate", reason)
+    if on_escalate is not None:
+        on_escalate(reason)
+    return "A more capable model will take the next turns."
+
+
 @tool
 def success(message: str):
     """Report to the user that the task has been completed successfully.
@@ -298,7 +947,7 @@ def success(message: str):
     Args:
         message: a message to present to the user describing the work that has been done.
     """
-    print(f"SUCCESS: {message}")
+    events.emit("success", message)
     if on_success is not None:
         on_success(message)
     else:
@@ -314,8 +963,57 @@ def fail(message: str):
      including information that was missing or invalid, things that were too
      confusing, etc.
     """
-    print(f"FAIL: {message}")
+    events.emit("fail", message)
     if on_failure is not None:
         on_failure(message)
     else:
         sys.exit(1)
+
+
+# Groups of tools that tasks can leave out of requests until the model loads
+# them with load_tools: a description and the names of the tools.
+TOOL_GROUPS = {
+    "directories": (
+        "listing single directories and finding files that contain a string "
+        + "or regular expression.",
+        ["list_directory", "search_directory", "regex_search_directory"],
+    ),
+    "patches": (
+        "applying unified diffs that change several files at once.",
+        ["apply_patch"],
+    ),
+}
+
+
+def named(names: list[str]) -> list[typing.Callable]:
+    """The tools in TOOLS with these names."""
+    by_name = {t.__name__: t for t in TOOLS}
+    return [by_name[name] for name in names]
+
+
+def load_tools(group: str) -> list[str]:
+    """Load a group of extra tools. They can be used from the next turn on.
+
+    The groups are:
+    {groups}
+
+    Args:
+        group: the name of the group to load.
+
+    Returns:
+        the names of the tools that were loaded.
+    """
+    events.emit("load_tools", group)
+    if group not in TOOL_GROUPS:
+        raise ValueError(
+            f"Unknown tool group {group!r}, the groups are: {', '.join(TOOL_GROUPS)}"
+        )
+    if on_load_tools is not None:
+        on_load_tools(group)
+    return TOOL_GROUPS[group][1]
+
+
+assert load_tools.__doc__ is not None
+load_tools.__doc__ = load_tools.__doc__.format(
+    groups="\n    ".join(f"{name}: {d}" for name, (d, _) in TOOL_GROUPS.items())
+)
@@ -2,23 +2,63 @@
 A web ui for examining village task runs
 """
 
+import gzip
+import hashlib
+import json
+import mimetypes
 import os
 import typing
 from aiohttp import web
 
+import metrics
+
+STATIC_DIR = os.path.join(os.path.dirname(__file__), "ui")
+
+
+def _etag(body: bytes) -> str:
+    return '"' + hashlib.sha1(body).hexdigest() + '"'
+
+
+def _not_modified(request: web.Request, etag: str) -> bool:
+    return etag in request.headers.get("If-None-Match", "")
+
+
+def _accepts_gzip(request: web.Request) -> bool:
+    return "gzip" in request.headers.get("Accept-Encoding", "")
+
+
+def json_bytes_response(request: web.Request, body: bytes) -> web.Response:
+    """Respond with already encoded json, compressed and with an etag."""
+    etag = _etag(body)
+    if _not_modified(request, etag):
+        return web.Response(status=304, headers={"ETag": etag})
+    response = web.Response(
+        body=body, content_type="application/json", headers={"ETag": etag}
+    )
+    response.enable_compression()
+    return response
+
 
 class UI:
-    def __init__(self, get_state: typing.Callable[[], dict]):
+    def __init__(
+        self,
+        get_state: typing.Callable[[], dict | bytes] | None,
+        index: str = "index.html",
+    ):
         self.get_state = get_state
+        self.index = index
 
         self.app = web.Application()
         self.app.add_routes(
             [
                 web.get("/", self.ui_redirect),
                 web.get("/state", self.state_handler),
-                web.static("/ui/", os.path.join(os.path.dirname(__file__), "ui")),
+                web.get("/metrics", self.metrics_handler),
+                web.get("/ui/{name}", self.static_handler),
             ]
         )
+        # static files, with their etags and compressed contents
+        self.static: dict[str, tuple[float, str, bytes, bytes]] = {}
 
     async def start(self):
         port = 8080
@@ -34,9 +74,41 @@ class UI:
     def run_forever(self):
         web.run_app(self.app, port=8080)
 
+    async def static_handler(self, request):
+        name = request.match_info["name"]
+        path = os.path.join(STATIC_DIR, name)
+        if "/" in name or name.startswith(".") or not os.path.isfile(path):
+            raise web.HTTPNotFound()
+        mtime = os.path.getmtime(path)
+        cached = self.static.get(name)
+        if cached is None or cached[0] != mtime:
+            body = open(path, "rb").read()
+            cached = (mtime, _etag(body), body, gzip.compress(body))
+            self.static[name] = cached
+        _, etag, body, compressed = cached
+        # revalidate every time so edits show up, but only send changes
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if _not_modified(request, etag):
+            return web.Response(status=304, headers=headers)
+        if _accepts_gzip(request):
+            headers["Content-Encoding"] = "gzip"
+            body = compressed
+        content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        return web.Response(body=body, headers=headers, content_type=content_type)
+
     async def state_handler(self, request):
+        if self.get_state is None:
+            raise web.HTTPNotFound()
         state = self.get_state()
-        return web.json_response(state)
+        if not isinstance(state, bytes):
+            state = json.dumps(state).encode()
+        return json_bytes_response(request, state)
+
+    async def metrics_handler(self, request):
+        return web.Response(
+            body=metrics.render().encode(),
+            headers={"Content-Type": metrics.CONTENT_TYPE},
+        )
 
     async def ui_redirect(self, request):
-        return web.HTTPFound("/ui/index.html")
+        return web.HTTPFound(f"/ui/{self.index}")
@@ -0,0 +1,2105 @@
+// CommonMark parser and HTML renderer, served with the UI so that it works
+// without a CDN.
+//
+// This is a stand-in for the upstream build, which couldn't be fetched when it
+// was added: the reference algorithm translated back to JavaScript from
+// commonmark.py 0.9.2 (itself a port of commonmark.js). It is loaded the same
+// way as the upstream UMD build, defining a global commonmark with Node,
+// Parser and HtmlRenderer, so it can be replaced with that build unchanged:
+//
+//   curl -o ui/commonmark.js https://unpkg.com/commonmark@0.31.2/dist/commonmark.js
+//
+// Copyright (c) 2014, Bibek Kafle and Roland Shoemaker
+// Based on stmd.js: Copyright (c) 2014, John MacFarlane
+// All rights reserved.
+//
+// Redistribution and use in source and binary forms, with or without
+// modification, are permitted provided that the following conditions are met:
+//
+//     * Redistributions of source code must retain the above copyright
+//       notice, this list of conditions and the following disclaimer.
+//
+//     * Redistributions in binary form must reproduce the above
+//       copyright notice, this list of conditions and the following
+//       disclaimer in the documentation and/or other materials provided
+//       with the distribution.
+//
+//     * Neither the names of Bibek Kafle, Roland Shoemaker nor the names of
+//       other contributors may be used to endorse or promote products derived
+//       from this software without specific prior written permission.
+//
+// THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+// "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+// LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+// A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+// OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+// SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+// LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+// DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+// THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+// (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+// OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+(function (global, factory) {
+    typeof exports === 'object' && typeof module !== 'undefined'
+        ? factory(exports)
+        : factory((global.commonmark = {}));
+})(this, function (exports) {
+    'use strict';
+
+    // Common
+
+    const ENTITY = '&(?:#x[a-f0-9]{1,6}|#[0-9]{1,7}|[a-z][a-z0-9]{1,31});';
+
+    const TAGNAME = '[A-Za-z][A-Za-z0-9-]*';
+    const ATTRIBUTENAME = '[a-zA-Z_:][a-zA-Z0-9:._-]*';
+    const UNQUOTEDVALUE = "[^\"'=<>`\\x00-\\x20]+";
+    const SINGLEQUOTEDVALUE = "'[^']*'";
+    const DOUBLEQUOTEDVALUE = '"[^"]*"';
+    const ATTRIBUTEVALUE = '(?:' + UNQUOTEDVALUE + '|' + SINGLEQUOTEDVALUE + '|' + DOUBLEQUOTEDVALUE + ')';
+    const ATTRIBUTEVALUESPEC = '(?:' + '\\s*=' + '\\s*' + ATTRIBUTEVALUE + ')';
+    const ATTRIBUTE = '(?:' + '\\s+' + ATTRIBUTENAME + ATTRIBUTEVALUESPEC + '?)';
+    const OPENTAG = '<' + TAGNAME + ATTRIBUTE + '*' + '\\s*/?>';
+    const CLOSETAG = '</' + TAGNAME + '\\s*[>]';
+    const HTMLCOMMENT = '<!---->|<!--(?:-?[^>-])(?:-?[^-])*-->';
+    const PROCESSINGINSTRUCTION = '[<][?][\\s\\S]*?[?][>]';
+    const DECLARATION = '<![A-Z]+' + '\\s+[^>]*>';
+    const CDATA = '<!\\[CDATA\\[[\\s\\S]*?\\]\\]>';
+    const HTMLTAG = '(?:' + OPENTAG + '|' + CLOSETAG + '|' + HTMLCOMMENT + '|' +
+        PROCESSINGINSTRUCTION + '|' + DECLARATION + '|' + CDATA + ')';
+    const reHtmlTag = new RegExp('^' + HTMLTAG, 'i');
+    const reBackslashOrAmp = /[\\&]/;
+    const ESCAPABLE = '[!"#$%&\'()*+,./:;<=>?@[\\\\\\]^_`{|}~-]';
+    const reEntityOrEscapedChar = new RegExp('\\\\' + ESCAPABLE + '|' + ENTITY, 'gi');
+    const reXmlSpecial = /[&<>"]/g;
+
+    // Named entities are decoded by the browser. Outside of one (in tests) only
+    // the most common are known.
+    const NAMED_ENTITIES = { amp: '&', lt: '<', gt: '>', quot: '"', apos: "'", nbsp: '\u00a0', copy: '\u00a9' };
+    let entityDecoder = null;
+
+    function decodeEntity(entity) {
+        if (entity[1] === '#') {
+            const hex = entity[2] === 'x' || entity[2] === 'X';
+            const code = parseInt(entity.slice(hex ? 3 : 2, -1), hex ? 16 : 10);
+            if (code === 0 || code > 0x10ffff || (code >= 0xd800 && code <= 0xdfff)) {
+                return '\ufffd';
+            }
+            return String.fromCodePoint(code);
+        }
+        if (typeof document === 'undefined') {
+            return NAMED_ENTITIES[entity.slice(1, -1)] ?? entity;
+        }
+        entityDecoder ??= document.createElement('textarea');
+        entityDecoder.innerHTML = entity;
+        return entityDecoder.value;
+    }
+
+    function unescapeString(s) {
+        if (!reBackslashOrAmp.test(s)) {
+            return s;
+        }
+        return s.replace(reEntityOrEscapedChar, (m) => (m[0] === '\\' ? m[1] : decodeEntity(m)));
+    }
+
+    const reUriSafe = /[A-Za-z0-9_.\-~;/@:+?=&()%#*,]/;
+    const utf8 = new TextEncoder();
+
+    function normalizeURI(uri) {
+        let out = '';
+        for (const ch of uri) {
+            if (reUriSafe.test(ch)) {
+                out += ch;
+            } else {
+                for (const byte of utf8.encode(ch)) {
+                    out += '%' + byte.toString(16).toUpperCase().padStart(2, '0');
+                }
+            }
+        }
+        return out;
+    }
+
+    const UNSAFE_MAP = { '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;' };
+
+    function escapeXml(s) {
+        if (s === null || s === undefined) {
+            return '';
+        }
+        return s.replace(reXmlSpecial, (c) => UNSAFE_MAP[c]);
+    }
+
+    function normalizeReference(label) {
+        // collapse internal whitespace, trim and case fold
+        return label.slice(1, -1).trim().replace(/[ \t\r\n]+/g, ' ').toLowerCase().toUpperCase();
+    }
+
+    // Nodes
+
+    const CONTAINERS = new Set([
+        'document', 'block_quote', 'list', 'item', 'paragraph', 'heading', 'emph',
+        'strong', 'link', 'image', 'custom_inline', 'custom_block',
+    ]);
+
+    class NodeWalker {
+        constructor(root) {
+            this.current = root;
+            this.root = root;
+            this.entering = true;
+        }
+
+        next() {
+            const cur = this.current;
+            const entering = this.entering;
+            if (cur === null) {
+                return null;
+            }
+            const container = CONTAINERS.has(cur.type);
+            if (entering && container) {
+                if (cur.firstChild) {
+                    this.current = cur.firstChild;
+                    this.entering = true;
+                } else {
+                    // stay on node but exit
+                    this.entering = false;
+                }
+            } else if (cur === this.root) {
+                this.current = null;
+            } else if (cur.next === null) {
+                this.current = cur.parent;
+                this.entering = false;
+            } else {
+                this.current = cur.next;
+                this.entering = true;
+            }
+            return { entering, node: cur };
+        }
+
+        resumeAt(node, entering) {
+            this.current = node;
+            this.entering = entering === true;
+        }
+    }
+
+    class Node {
+        constructor(type, sourcepos) {
+            this.type = type;
+            this.parent = null;
+            this.firstChild = null;
+            this.lastChild = null;
+            this.prev = null;
+            this.next = null;
+            this.sourcepos = sourcepos;
+            this.lastLineBlank = false;
+            this.lastLineChecked = false;
+            this.open = true;
+            this.stringContent = '';
+            this.literal = null;
+            this.listData = {};
+            this.info = null;
+            this.destination = null;
+            this.title = null;
+            this.isFenced = false;
+            this.fenceChar = null;
+            this.fenceLength = 0;
+            this.fenceOffset = null;
+            this.level = null;
+            this.onEnter = null;
+            this.onExit = null;
+            this.htmlBlockType = null;
+        }
+
+        isContainer() {
+            return CONTAINERS.has(this.type);
+        }
+
+        appendChild(child) {
+            child.unlink();
+            child.parent = this;
+            if (this.lastChild) {
+                this.lastChild.next = child;
+                child.prev = this.lastChild;
+                this.lastChild = child;
+            } else {
+                this.firstChild = child;
+                this.lastChild = child;
+            }
+        }
+
+        prependChild(child) {
+            child.unlink();
+            child.parent = this;
+            if (this.firstChild) {
+                this.firstChild.prev = child;
+                child.next = this.firstChild;
+                this.firstChild = child;
+            } else {
+                this.firstChild = child;
+                this.lastChild = child;
+            }
+        }
+
+        unlink() {
+            if (this.prev) {
+                this.prev.next = this.next;
+            } else if (this.parent) {
+                this.parent.firstChild = this.next;
+            }
+            if (this.next) {
+                this.next.prev = this.prev;
+            } else if (this.parent) {
+                this.parent.lastChild = this.prev;
+            }
+            this.parent = null;
+            this.next = null;
+            this.prev = null;
+        }
+
+        insertAfter(sibling) {
+            sibling.unlink();
+            sibling.next = this.next;
+            if (sibling.next) {
+                sibling.next.prev = sibling;
+            }
+            sibling.prev = this;
+            this.next = sibling;
+            sibling.parent = this.parent;
+            if (!sibling.next) {
+                sibling.parent.lastChild = sibling;
+            }
+        }
+
+        insertBefore(sibling) {
+            sibling.unlink();
+            sibling.prev = this.prev;
+            if (sibling.prev) {
+                sibling.prev.next = sibling;
+            }
+            sibling.next = this;
+            this.prev = sibling;
+            sibling.parent = this.parent;
+            if (!sibling.prev) {
+                sibling.parent.firstChild = sibling;
+            }
+        }
+
+        walker() {
+            return new NodeWalker(this);
+        }
+    }
+
+    // Inlines
+
+    const ESCAPED_CHAR = '\\\\' + ESCAPABLE;
+
+    const rePunctuation = new RegExp(
+        '[!"#$%&\'()*+,\\-./:;<=>?@\\[\\]\\\\^_`{|}~\\xA1\\xA7\\xAB\\xB6\\xB7\\xBB' +
+        '\\xBF\\u037E\\u0387\\u055A-\\u055F\\u0589\\u058A\\u05BE\\u05C0\\u05C3' +
+        '\\u05C6\\u05F3\\u05F4\\u0609\\u060A\\u060C\\u060D\\u061B\\u061E\\u061F' +
+        '\\u066A-\\u066D\\u06D4\\u0700-\\u070D\\u07F7-\\u07F9\\u0830-\\u083E' +
+        '\\u085E\\u0964\\u0965\\u0970\\u0AF0\\u0DF4\\u0E4F\\u0E5A\\u0E5B\\u0F04-\\u0F12' +
+        '\\u0F14\\u0F3A-\\u0F3D\\u0F85\\u0FD0-\\u0FD4\\u0FD9\\u0FDA\\u104A-\\u104F\\u10FB' +
+        '\\u1360-\\u1368\\u1400\\u166D\\u166E\\u169B\\u169C\\u16EB-\\u16ED\\u1735\\u1736' +
+        '\\u17D4-\\u17D6\\u17D8-\\u17DA\\u1800-\\u180A\\u1944\\u1945\\u1A1E\\u1A1F\\u1AA0-' +
+        '\\u1AA6\\u1AA8-\\u1AAD\\u1B5A-\\u1B60\\u1BFC-\\u1BFF\\u1C3B-\\u1C3F\\u1C7E\\u1C7F' +
+        '\\u1CC0-\\u1CC7\\u1CD3\\u2010-\\u2027\\u2030-\\u2043\\u2045-\\u2051\\u2053-\\u205E' +
+        '\\u207D\\u207E\\u208D\\u208E\\u2308-\\u230B\\u2329\\u232A\\u2768-\\u2775\\u27C5' +
+        '\\u27C6\\u27E6-\\u27EF\\u2983-\\u2998\\u29D8-\\u29DB\\u29FC\\u29FD\\u2CF9-\\u2CFC' +
+        '\\u2CFE\\u2CFF\\u2D70\\u2E00-\\u2E2E\\u2E30-\\u2E42\\u3001-\\u3003\\u3008-\\u3011' +
+        '\\u3014-\\u301F\\u3030\\u303D\\u30A0\\u30FB\\uA4FE\\uA4FF\\uA60D-\\uA60F\\uA673' +
+        '\\uA67E\\uA6F2-\\uA6F7\\uA874-\\uA877\\uA8CE\\uA8CF\\uA8F8-\\uA8FA\\uA8FC\\uA92E' +
+        '\\uA92F\\uA95F\\uA9C1-\\uA9CD\\uA9DE\\uA9DF\\uAA5C-\\uAA5F\\uAADE\\uAADF\\uAAF0' +
+        '\\uAAF1\\uABEB\\uFD3E\\uFD3F\\uFE10-\\uFE19\\uFE30-\\uFE52\\uFE54-\\uFE61\\uFE63' +
+        '\\uFE68\\uFE6A\\uFE6B\\uFF01-\\uFF03\\uFF05-\\uFF0A\\uFF0C-\\uFF0F\\uFF1A\\uFF1B' +
+        '\\uFF1F\\uFF20\\uFF3B-\\uFF3D\\uFF3F\\uFF5B\\uFF5D\\uFF5F-\\uFF65]|\\uD800[\\uDD00-' +
+        '\\uDD02\\uDF9F\\uDFD0]|\\uD801\\uDD6F|\\uD802[\\uDC57\\uDD1F\\uDD3F\\uDE50-\\uDE58' +
+        '\\uDE7F\\uDEF0-\\uDEF6\\uDF39-\\uDF3F\\uDF99-\\uDF9C]|\\uD804[\\uDC47-\\uDC4D' +
+        '\\uDCBB\\uDCBC\\uDCBE-\\uDCC1\\uDD40-\\uDD43\\uDD74\\uDD75\\uDDC5-\\uDDC9\\uDDCD' +
+        '\\uDDDB\\uDDDD-\\uDDDF\\uDE38-\\uDE3D\\uDEA9]|\\uD805[\\uDCC6\\uDDC1-\\uDDD7' +
+        '\\uDE41-\\uDE43\\uDF3C-\\uDF3E]|\\uD809[\\uDC70-\\uDC74]|\\uD81A[\\uDE6E\\uDE6F' +
+        '\\uDEF5\\uDF37-\\uDF3B\\uDF44]|\\uD82F\\uDC9F|\\uD836[\\uDE87-\\uDE8B]'
+    );
+
+    const reLinkTitle = new RegExp(
+        '^(?:"(' + ESCAPED_CHAR + '|[^"\\x00])*"' +
+        '|' +
+        "'(" + ESCAPED_CHAR + "|[^'\\x00])*'" +
+        '|' +
+        '\\((' + ESCAPED_CHAR + '|[^()\\x00])*\\))'
+    );
+    const reLinkDestinationBraces = /^(?:<(?:[^<>\n\\\x00]|\\.)*>)/;
+    const reEscapable = new RegExp('^' + ESCAPABLE);
+    const reEntityHere = new RegExp('^' + ENTITY, 'i');
+    const reTicks = /`+/;
+    const reTicksHere = /^`+/;
+    const reEllipses = /\.\.\./g;
+    const reDash = /--+/g;
+    const reEmailAutolink = /^<([a-zA-Z0-9.!#$%&'*+\/=?^_`{|}~-]+@[a-zA-Z0-9](?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?(?:\.[a-zA-Z0-9](?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?)*)>/;
+    const reAutolink = /^<[A-Za-z][A-Za-z0-9.+-]{1,31}:[^<>\x00-\x20]*>/i;
+    const reSpnl = /^ *(?:\n *)?/;
+    const reWhitespaceChar = /^[ \t\n\x0b\x0c\x0d]/;
+    const reUnicodeWhitespaceChar = /^\s/;
+    const reFinalSpace = / *$/;
+    const reInitialSpace = /^ */;
+    const reSpaceAtEndOfLine = /^ *(?:\n|$)/;
+    const reLinkLabel = /^\[(?:[^\\\[\]]|\\.){0,1000}\]/;
+    // Matches a string of non-special characters.
+    const reMain = /^[^\n`\[\]\\!<&*_'"]+/;
+
+    function text(s) {
+        const node = new Node('text', null);
+        node.literal = s;
+        return node;
+    }
+
+    function smartDashes(chars) {
+        let enCount = 0;
+        let emCount = 0;
+        if (chars.length % 3 === 0) {
+            // If divisible by 3, use all em dashes
+            emCount = chars.length / 3;
+        } else if (chars.length % 2 === 0) {
+            // If divisible by 2, use all en dashes
+            enCount = chars.length / 2;
+        } else if (chars.length % 3 === 2) {
+            // If 2 extra dashes, use en dash for last 2; em dashes for rest
+            enCount = 1;
+            emCount = (chars.length - 2) / 3;
+        } else {
+            // Use en dashes for last 4 hyphens; em dashes for rest
+            enCount = 2;
+            emCount = (chars.length - 4) / 3;
+        }
+        return '\u2014'.repeat(emCount) + '\u2013'.repeat(enCount);
+    }
+
+    class InlineParser {
+        constructor(options = {}) {
+            this.subject = '';
+            this.delimiters = null;
+            this.brackets = null;
+            this.pos = 0;
+            this.refmap = {};
+            this.options = options;
+        }
+
+        // If re matches at the current position in the subject, advance the
+        // position and return the match; otherwise return null.
+        match(re) {
+            const m = re.exec(this.subject.slice(this.pos));
+            if (m === null) {
+                return null;
+            }
+            this.pos += m.index + m[0].length;
+            return m[0];
+        }
+
+        // The character at the current position, or null at the end.
+        peek() {
+            return this.pos < this.subject.length ? this.subject[this.pos] : null;
+        }
+
+        // Parse zero or more space characters, including at most one newline.
+        spnl() {
+            this.match(reSpnl);
+            return true;
+        }
+
+        // Parse backticks as a code span, or a literal run of backticks.
+        parseBackticks(block) {
+            const ticks = this.match(reTicksHere);
+            if (ticks === null) {
+                return false;
+            }
+            const afterOpenTicks = this.pos;
+            let matched = this.match(reTicks);
+            while (matched !== null) {
+                if (matched === ticks) {
+                    const node = new Node('code', null);
+                    const contents = this.subject.slice(afterOpenTicks, this.pos - ticks.length).replace(/\n/g, ' ');
+                    if (contents.replace(/^ +/, '') && contents[0] === ' ' && contents[contents.length - 1] === ' ') {
+                        node.literal = contents.slice(1, -1);
+                    } else {
+                        node.literal = contents;
+                    }
+                    block.appendChild(node);
+                    return true;
+                }
+                matched = this.match(reTicks);
+            }
+            // no closing backtick sequence
+            this.pos = afterOpenTicks;
+            block.appendChild(text(ticks));
+            return true;
+        }
+
+        // Parse a backslash: an escaped character, a hard line break or a literal
+        // backslash.
+        parseBackslash(block) {
+            const subj = this.subject;
+            this.pos += 1;
+            const subjchar = this.pos < subj.length ? subj[this.pos] : null;
+            if (this.peek() === '\n') {
+                this.pos += 1;
+                block.appendChild(new Node('linebreak', null));
+            } else if (subjchar && reEscapable.test(subjchar)) {
+                block.appendChild(text(subjchar));
+                this.pos += 1;
+            } else {
+                block.appendChild(text('\\'));
+            }
+            return true;
+        }
+
+        // Parse an autolink (a URL or email address in pointy brackets).
+        parseAutolink(block) {
+            let m = this.match(reEmailAutolink);
+            if (m) {
+                const dest = m.slice(1, -1);
+                const node = new Node('link', null);
+                node.destination = normalizeURI('mailto:' + dest);
+                node.title = '';
+                node.appendChild(text(dest));
+                block.appendChild(node);
+                return true;
+            }
+            m = this.match(reAutolink);
+            if (m) {
+                const dest = m.slice(1, -1);
+                const node = new Node('link', null);
+                node.destination = normalizeURI(dest);
+                node.title = '';
+                node.appendChild(text(dest));
+                block.appendChild(node);
+                return true;
+            }
+            return false;
+        }
+
+        // Parse a raw HTML tag.
+        parseHtmlTag(block) {
+            const m = this.match(reHtmlTag);
+            if (m === null) {
+                return false;
+            }
+            const node = new Node('html_inline', null);
+            node.literal = m;
+            block.appendChild(node);
+            return true;
+        }
+
+        // Scan a run of delimiter characters, returning how many there are and
+        // whether they can open and/or close emphasis.
+        scanDelims(c) {
+            let numdelims = 0;
+            const startpos = this.pos;
+            if (c === "'" || c === '"') {
+                numdelims += 1;
+                this.pos += 1;
+            } else {
+                while (this.peek() === c) {
+                    numdelims += 1;
+                    this.pos += 1;
+                }
+            }
+            if (numdelims === 0) {
+                return null;
+            }
+
+            const cBefore = startpos === 0 ? '\n' : this.subject[startpos - 1];
+            const cAfter = this.peek() ?? '\n';
+
+            const afterIsWhitespace = reUnicodeWhitespaceChar.test(cAfter) || cAfter === '\xa0';
+            const afterIsPunctuation = rePunctuation.test(cAfter);
+            const beforeIsWhitespace = reUnicodeWhitespaceChar.test(cBefore) || cBefore === '\xa0';
+            const beforeIsPunctuation = rePunctuation.test(cBefore);
+
+            const leftFlanking = !afterIsWhitespace &&
+                (!afterIsPunctuation || beforeIsWhitespace || beforeIsPunctuation);
+            const rightFlanking = !beforeIsWhitespace &&
+                (!beforeIsPunctuation || afterIsWhitespace || afterIsPunctuation);
+            let canOpen;
+            let canClose;
+            if (c === '_') {
+                canOpen = leftFlanking && (!rightFlanking || beforeIsPunctuation);
+                canClose = rightFlanking && (!leftFlanking || afterIsPunctuation);
+            } else if (c === "'" || c === '"') {
+                canOpen = leftFlanking && !rightFlanking;
+                canClose = rightFlanking;
+            } else {
+                canOpen = leftFlanking;
+                canClose = rightFlanking;
+            }
+            this.pos = startpos;
+            return { numdelims, canOpen, canClose };
+        }
+
+        // Handle a delimiter for emphasis or a quote.
+        handleDelim(cc, block) {
+            const res = this.scanDelims(cc);
+            if (!res) {
+                return false;
+            }
+            const numdelims = res.numdelims;
+            const startpos = this.pos;
+            this.pos += numdelims;
+            let contents;
+            if (cc === "'") {
+                contents = '\u2019';
+            } else if (cc === '"') {
+                contents = '\u201C';
+            } else {
+                contents = this.subject.slice(startpos, this.pos);
+            }
+            const node = text(contents);
+            block.appendChild(node);
+
+            // add an entry to the stack for this opener
+            this.delimiters = {
+                cc,
+                numdelims,
+                origdelims: numdelims,
+                node,
+                previous: this.delimiters,
+                next: null,
+                canOpen: res.canOpen,
+                canClose: res.canClose,
+            };
+            if (this.delimiters.previous !== null) {
+                this.delimiters.previous.next = this.delimiters;
+            }
+            return true;
+        }
+
+        removeDelimiter(delim) {
+            if (delim.previous !== null) {
+                delim.previous.next = delim.next;
+            }
+            if (delim.next === null) {
+                // top of stack
+                this.delimiters = delim.previous;
+            } else {
+                delim.next.previous = delim.previous;
+            }
+        }
+
+        static removeDelimitersBetween(bottom, top) {
+            if (bottom.next !== top) {
+                bottom.next = top;
+                top.previous = bottom;
+            }
+        }
+
+        processEmphasis(stackBottom) {
+            const openersBottom = { '_': stackBottom, '*': stackBottom, "'": stackBottom, '"': stackBottom };
+            let oddMatch = false;
+            let useDelims = 0;
+
+            // find the first closer above stackBottom
+            let closer = this.delimiters;
+            while (closer !== null && closer.previous !== stackBottom) {
+                closer = closer.previous;
+            }
+
+            // move forward, looking for closers, and handling each
+            while (closer !== null) {
+                if (!closer.canClose) {
+                    closer = closer.next;
+                    continue;
+                }
+                // found an emphasis closer, now look back for the first matching
+                // opener
+                let opener = closer.previous;
+                let openerFound = false;
+                const closercc = closer.cc;
+                while (opener !== null && opener !== stackBottom && opener !== openersBottom[closercc]) {
+                    oddMatch = (closer.canOpen || opener.canClose) &&
+                        closer.origdelims % 3 !== 0 &&
+                        (opener.origdelims + closer.origdelims) % 3 === 0;
+                    if (opener.cc === closercc && opener.canOpen && !oddMatch) {
+                        openerFound = true;
+                        break;
+                    }
+                    opener = opener.previous;
+                }
+                const oldCloser = closer;
+
+                if (closercc === '*' || closercc === '_') {
+                    if (!openerFound) {
+                        closer = closer.next;
+                    } else {
+                        // the number of delimiters used from the closer
+                        useDelims = closer.numdelims >= 2 && opener.numdelims >= 2 ? 2 : 1;
+
+                        const openerInl = opener.node;
+                        const closerInl = closer.node;
+
+                        // remove used delimiters from the stack and inlines
+                        opener.numdelims -= useDelims;
+                        closer.numdelims -= useDelims;
+                        openerInl.literal = openerInl.literal.slice(0, openerInl.literal.length - useDelims);
+                        closerInl.literal = closerInl.literal.slice(0, closerInl.literal.length - useDelims);
+
+                        // build contents for the new emphasis element
+                        const emph = new Node(useDelims === 1 ? 'emph' : 'strong', null);
+                        let tmp = openerInl.next;
+                        while (tmp && tmp !== closerInl) {
+                            const next = tmp.next;
+                            tmp.unlink();
+                            emph.appendChild(tmp);
+                            tmp = next;
+                        }
+                        openerInl.insertAfter(emph);
+
+                        // remove delimiters between the opener and closer
+                        InlineParser.removeDelimitersBetween(opener, closer);
+
+                        // if the opener has no delimiters left, remove it and
+                        // its inline
+                        if (opener.numdelims === 0) {
+                            openerInl.unlink();
+                            this.removeDelimiter(opener);
+                        }
+                        if (closer.numdelims === 0) {
+                            closerInl.unlink();
+                            const tempstack = closer.next;
+                            this.removeDelimiter(closer);
+                            closer = tempstack;
+                        }
+                    }
+                } else if (closercc === "'") {
+                    closer.node.literal = '\u2019';
+                    if (openerFound) {
+                        opener.node.literal = '\u2018';
+                    }
+                    closer = closer.next;
+                } else if (closercc === '"') {
+                    closer.node.literal = '\u201D';
+                    if (openerFound) {
+                        opener.node.literal = '\u201C';
+                    }
+                    closer = closer.next;
+                }
+
+                if (!openerFound && !oddMatch) {
+                    // Set a lower bound for future searches for openers. Not
+                    // with oddMatch, because a ** that doesn't match an earlier *
+                    // might turn into an opener, and the * might be matched by
+                    // something else.
+                    openersBottom[closercc] = oldCloser.previous;
+                    if (!oldCloser.canOpen) {
+                        // a closer that can't be an opener can be removed once
+                        // there's no matching opener
+                        this.removeDelimiter(oldCloser);
+                    }
+                }
+            }
+
+            // remove all delimiters
+            while (this.delimiters !== null && this.delimiters !== stackBottom) {
+                this.removeDelimiter(this.delimiters);
+            }
+        }
+
+        // Parse a link title (without its quotes), or return null.
+        parseLinkTitle() {
+            const title = this.match(reLinkTitle);
+            if (title === null) {
+                return null;
+            }
+            return unescapeString(title.slice(1, -1));
+        }
+
+        // Parse a link destination, or return null.
+        parseLinkDestination() {
+            const res = this.match(reLinkDestinationBraces);
+            if (res !== null) {
+                // chop off the surrounding <..>
+                return normalizeURI(unescapeString(res.slice(1, -1)));
+            }
+            if (this.peek() === '<') {
+                return null;
+            }
+            const savepos = this.pos;
+            let openparens = 0;
+            let c;
+            while (true) {
+                c = this.peek();
+                if (c === null) {
+                    break;
+                }
+                if (c === '\\' && reEscapable.test(this.subject.slice(this.pos + 1, this.pos + 2))) {
+                    this.pos += 1;
+                    if (this.peek() !== null) {
+                        this.pos += 1;
+                    }
+                } else if (c === '(') {
+                    this.pos += 1;
+                    openparens += 1;
+                } else if (c === ')') {
+                    if (openparens < 1) {
+                        break;
+                    }
+                    this.pos += 1;
+                    openparens -= 1;
+                } else if (reWhitespaceChar.test(c)) {
+                    break;
+                } else {
+                    this.pos += 1;
+                }
+            }
+            if (this.pos === savepos && c !== ')') {
+                return null;
+            }
+            return normalizeURI(unescapeString(this.subject.slice(savepos, this.pos)));
+        }
+
+        // Parse a link label, returning the number of characters parsed.
+        parseLinkLabel() {
+            const m = this.match(reLinkLabel);
+            // the regex allows [..\]; that's disallowed here rather than with
+            // lookahead in the regex
+            if (m === null || m.length > 1001) {
+                return 0;
+            }
+            return m.length;
+        }
+
+        // Add an open bracket to the delimiter stack and a text node to the
+        // block.
+        parseOpenBracket(block) {
+            const startpos = this.pos;
+            this.pos += 1;
+            const node = text('[');
+            block.appendChild(node);
+            this.addBracket(node, startpos, false);
+            return true;
+        }
+
+        // If the next character is [, add ![ to the delimiter stack, otherwise
+        // add a ! text node.
+        parseBang(block) {
+            const startpos = this.pos;
+            this.pos += 1;
+            if (this.peek() === '[') {
+                this.pos += 1;
+                const node = text('![');
+                block.appendChild(node);
+                this.addBracket(node, startpos + 1, true);
+            } else {
+                block.appendChild(text('!'));
+            }
+            return true;
+        }
+
+        // Match a close bracket against an opener on the stack, adding a link,
+        // an image or a literal ].
+        parseCloseBracket(block) {
+            let title = null;
+            let dest = null;
+            let matched = false;
+            this.pos += 1;
+            const startpos = this.pos;
+
+            // the last [ or ![
+            let opener = this.brackets;
+            if (opener === null) {
+                // no matched opener, just return a literal
+                block.appendChild(text(']'));
+                return true;
+            }
+            if (!opener.active) {
+                // no matched opener, just return a literal
+                block.appendChild(text(']'));
+                // take the opener off the brackets stack
+                this.removeBracket();
+                return true;
+            }
+
+            // this is a potential opener
+            const isImage = opener.image;
+            const savepos = this.pos;
+
+            // inline link?
+            if (this.peek() === '(') {
+                this.pos += 1;
+                this.spnl();
+                dest = this.parseLinkDestination();
+                if (dest !== null && this.spnl()) {
+                    // make sure there's a space before the title
+                    if (reWhitespaceChar.test(this.subject[this.pos - 1])) {
+                        title = this.parseLinkTitle();
+                    }
+                    if (this.spnl() && this.peek() === ')') {
+                        this.pos += 1;
+                        matched = true;
+                    }
+                } else {
+                    this.pos = savepos;
+                }
+            }
+
+            if (!matched) {
+                // is there a link label?
+                const beforelabel = this.pos;
+                const n = this.parseLinkLabel();
+                let reflabel = null;
+                if (n > 2) {
+                    reflabel = this.subject.slice(beforelabel, beforelabel + n);
+                } else if (!opener.bracketAfter) {
+                    // An empty or missing second label means the first label is
+                    // the reference. The reference can't contain a bracket, so if
+                    // there's one it isn't checked.
+                    reflabel = this.subject.slice(opener.index, startpos);
+                }
+                if (n === 0) {
+                    // for a shortcut reference link, rewind before the spaces
+                    // that were skipped
+                    this.pos = savepos;
+                }
+                if (reflabel) {
+                    const link = this.refmap[normalizeReference(reflabel)];
+                    if (link) {
+                        dest = link.destination;
+                        title = link.title;
+                        matched = true;
+                    }
+                }
+            }
+
+            if (!matched) {
+                // remove this opener from the stack
+                this.removeBracket();
+                this.pos = startpos;
+                block.appendChild(text(']'));
+                return true;
+            }
+
+            const node = new Node(isImage ? 'image' : 'link', null);
+            node.destination = dest;
+            node.title = title || '';
+            let tmp = opener.node.next;
+            while (tmp) {
+                const next = tmp.next;
+                tmp.unlink();
+                node.appendChild(tmp);
+                tmp = next;
+            }
+            block.appendChild(node);
+            this.processEmphasis(opener.previousDelimiter);
+            this.removeBracket();
+            opener.node.unlink();
+
+            // Later delimiters were removed by processEmphasis. For a link,
+            // earlier link openers are deactivated too (no links in links).
+            if (!isImage) {
+                opener = this.brackets;
+                while (opener !== null) {
+                    if (!opener.image) {
+                        opener.active = false;
+                    }
+                    opener = opener.previous;
+                }
+            }
+            return true;
+        }
+
+        addBracket(node, index, image) {
+            if (this.brackets !== null) {
+                this.brackets.bracketAfter = true;
+            }
+            this.brackets = {
+                node,
+                previous: this.brackets,
+                previousDelimiter: this.delimiters,
+                index,
+                image,
+                active: true,
+                bracketAfter: false,
+            };
+        }
+
+        removeBracket() {
+            this.brackets = this.brackets.previous;
+        }
+
+        // Parse an entity.
+        parseEntity(block) {
+            const m = this.match(reEntityHere);
+            if (!m) {
+                return false;
+            }
+            block.appendChild(text(decodeEntity(m)));
+            return true;
+        }
+
+        // Parse a run of ordinary characters.
+        parseString(block) {
+            const m = this.match(reMain);
+            if (!m) {
+                return false;
+            }
+            if (this.options.smart) {
+                block.appendChild(text(m.replace(reEllipses, '\u2026').replace(reDash, (d) => smartDashes(d))));
+            } else {
+                block.appendChild(text(m));
+            }
+            return true;
+        }
+
+        // Parse a newline: a hard line break after two spaces, otherwise a soft
+        // one.
+        parseNewline(block) {
+            // at a \n
+            this.pos += 1;
+            const lastc = block.lastChild;
+            if (lastc && lastc.type === 'text' && lastc.literal[lastc.literal.length - 1] === ' ') {
+                const linebreak = lastc.literal.length >= 2 && lastc.literal[lastc.literal.length - 2] === ' ';
+                lastc.literal = lastc.literal.replace(reFinalSpace, '');
+                block.appendChild(new Node(linebreak ? 'linebreak' : 'softbreak', null));
+            } else {
+                block.appendChild(new Node('softbreak', null));
+            }
+            // gobble leading spaces in the next line
+            this.match(reInitialSpace);
+            return true;
+        }
+
+        // Parse a link reference definition into refmap, returning how many
+        // characters it took.
+        parseReference(s, refmap) {
+            this.subject = s;
+            this.pos = 0;
+            const startpos = this.pos;
+
+            // label
+            const matchChars = this.parseLinkLabel();
+            if (matchChars === 0 || matchChars === 2) {
+                return 0;
+            }
+            const rawlabel = this.subject.slice(0, matchChars);
+
+            // colon
+            if (this.peek() === ':') {
+                this.pos += 1;
+            } else {
+                this.pos = startpos;
+                return 0;
+            }
+
+            // link url
+            this.spnl();
+            const dest = this.parseLinkDestination();
+            if (dest === null) {
+                this.pos = startpos;
+                return 0;
+            }
+
+            const beforetitle = this.pos;
+            this.spnl();
+            let title = null;
+            if (this.pos !== beforetitle) {
+                title = this.parseLinkTitle();
+            }
+            if (title === null) {
+                title = '';
+                // rewind before spaces
+                this.pos = beforetitle;
+            }
+
+            // make sure we're at the end of the line
+            let atLineEnd = true;
+            if (this.match(reSpaceAtEndOfLine) === null) {
+                if (title === '') {
+                    atLineEnd = false;
+                } else {
+                    // The title isn't at the end of the line, but this could
+                    // still be a reference without it.
+                    title = '';
+                    this.pos = beforetitle;
+                    atLineEnd = this.match(reSpaceAtEndOfLine) !== null;
+                }
+            }
+            if (!atLineEnd) {
+                this.pos = startpos;
+                return 0;
+            }
+
+            const normlabel = normalizeReference(rawlabel);
+            if (normlabel === '') {
+                // the label must contain non-whitespace characters
+                this.pos = startpos;
+                return 0;
+            }
+            if (!refmap[normlabel]) {
+                refmap[normlabel] = { destination: dest, title };
+            }
+            return this.pos - startpos;
+        }
+
+        // Parse the next inline element, adding it to the block. Returns false at
+        // the end of the subject.
+        parseInline(block) {
+            let res = false;
+            const c = this.peek();
+            if (c === null) {
+                return false;
+            }
+            if (c === '\n') {
+                res = this.parseNewline(block);
+            } else if (c === '\\') {
+                res = this.parseBackslash(block);
+            } else if (c === '`') {
+                res = this.parseBackticks(block);
+            } else if (c === '*' || c === '_') {
+                res = this.handleDelim(c, block);
+            } else if (c === "'" || c === '"') {
+                res = this.options.smart && this.handleDelim(c, block);
+            } else if (c === '[') {
+                res = this.parseOpenBracket(block);
+            } else if (c === '!') {
+                res = this.parseBang(block);
+            } else if (c === ']') {
+                res = this.parseCloseBracket(block);
+            } else if (c === '<') {
+                res = this.parseAutolink(block) || this.parseHtmlTag(block);
+            } else if (c === '&') {
+                res = this.parseEntity(block);
+            } else {
+                res = this.parseString(block);
+            }
+            if (!res) {
+                this.pos += 1;
+                block.appendChild(text(c));
+            }
+            return true;
+        }
+
+        // Parse a block's string content into inline children.
+        parse(block) {
+            this.subject = block.stringContent.trim();
+            this.pos = 0;
+            this.delimiters = null;
+            this.brackets = null;
+            while (this.parseInline(block)) {
+                // keep going
+            }
+            this.processEmphasis(null);
+        }
+    }
+
+    // Blocks
+
+    const CODE_INDENT = 4;
+    const reHtmlBlockOpen = [
+        /./, // dummy for 0
+        /^<(?:script|pre|style)(?:\s|>|$)/i,
+        /^<!--/,
+        /^<[?]/,
+        /^<![A-Z]/,
+        /^<!\[CDATA\[/,
+        /^<[/]?(?:address|article|aside|base|basefont|blockquote|body|caption|center|col|colgroup|dd|details|dialog|dir|div|dl|dt|fieldset|figcaption|figure|footer|form|frame|frameset|h1|head|header|hr|html|iframe|legend|li|link|main|menu|menuitem|nav|noframes|ol|optgroup|option|p|param|section|source|title|summary|table|tbody|td|tfoot|th|thead|title|tr|track|ul)(?:\s|[/]?[>]|$)/i,
+        new RegExp('^(?:' + OPENTAG + '|' + CLOSETAG + ')\\s*$', 'i'),
+    ];
+    const reHtmlBlockClose = [
+        /./, // dummy for 0
+        /<\/(?:script|pre|style)>/i,
+        /-->/,
+        /\?>/,
+        />/,
+        /\]\]>/,
+    ];
+    const reThematicBreak = /^(?:(?:\*[ \t]*){3,}|(?:_[ \t]*){3,}|(?:-[ \t]*){3,})[ \t]*$/;
+    const reMaybeSpecial = /^[#`~*+_=<>0-9-]/;
+    const reNonSpace = /[^ \t\f\v\r\n]/;
+    const reBulletListMarker = /^[*+-]/;
+    const reOrderedListMarker = /^(\d{1,9})([.)])/;
+    const reATXHeadingMarker = /^#{1,6}(?:[ \t]+|$)/;
+    const reCodeFence = /^`{3,}(?!.*`)|^~{3,}/;
+    const reClosingCodeFence = /^(?:`{3,}|~{3,})(?= *$)/;
+    const reSetextHeadingLine = /^(?:=+|-+)[ \t]*$/;
+    const reLineEnding = /\r\n|\n|\r/;
+
+    // Whether a string contains only space characters.
+    const isBlank = (s) => !reNonSpace.test(s);
+    const isSpaceOrTab = (c) => c === ' ' || c === '\t';
+    const peek = (ln, pos) => (pos < ln.length ? ln[pos] : null);
+
+    // Whether a block ends with a blank line, descending into lists and
+    // sublists if needed.
+    function endsWithBlankLine(block) {
+        while (block) {
+            if (block.lastLineBlank) {
+                return true;
+            }
+            if (!block.lastLineChecked && (block.type === 'list' || block.type === 'item')) {
+                block.lastLineChecked = true;
+                block = block.lastChild;
+            } else {
+                block.lastLineChecked = true;
+                break;
+            }
+        }
+        return false;
+    }
+
+    // Parse a list marker, returning data about it (type, start, delimiter,
+    // bullet character, padding) or null.
+    function parseListMarker(parser, container) {
+        const rest = parser.currentLine.slice(parser.nextNonspace);
+        const data = {
+            type: null,
+            tight: true, // lists are tight by default
+            bulletChar: null,
+            start: null,
+            delimiter: null,
+            padding: null,
+            markerOffset: parser.indent,
+        };
+        if (parser.indent >= 4) {
+            return null;
+        }
+        let m = reBulletListMarker.exec(rest);
+        const m2 = reOrderedListMarker.exec(rest);
+        if (m) {
+            data.type = 'bullet';
+            data.bulletChar = m[0][0];
+        } else if (m2 && (container.type !== 'paragraph' || m2[1] === '1')) {
+            m = m2;
+            data.type = 'ordered';
+            data.start = parseInt(m[1], 10);
+            data.delimiter = m[2];
+        } else {
+            return null;
+        }
+
+        // make sure there are spaces after
+        let nextc = peek(parser.currentLine, parser.nextNonspace + m[0].length);
+        if (!(nextc === null || nextc === '\t' || nextc === ' ')) {
+            return null;
+        }
+
+        // if it interrupts a paragraph, make sure the first line isn't blank
+        if (container.type === 'paragraph' &&
+            !reNonSpace.test(parser.currentLine.slice(parser.nextNonspace + m[0].length))) {
+            return null;
+        }
+
+        // a match: advance the offset and calculate the padding
+        parser.advanceNextNonspace(); // to the start of the marker
+        parser.advanceOffset(m[0].length, true); // to the end of the marker
+        const spacesStartCol = parser.column;
+        const spacesStartOffset = parser.offset;
+        do {
+            parser.advanceOffset(1, true);
+            nextc = peek(parser.currentLine, parser.offset);
+        } while (parser.column - spacesStartCol < 5 && isSpaceOrTab(nextc));
+        const blankItem = peek(parser.currentLine, parser.offset) === null;
+        const spacesAfterMarker = parser.column - spacesStartCol;
+        if (spacesAfterMarker >= 5 || spacesAfterMarker < 1 || blankItem) {
+            data.padding = m[0].length + 1;
+            parser.column = spacesStartCol;
+            parser.offset = spacesStartOffset;
+            if (isSpaceOrTab(peek(parser.currentLine, parser.offset))) {
+                parser.advanceOffset(1, true);
+            }
+        } else {
+            data.padding = m[0].length + spacesAfterMarker;
+        }
+        return data;
+    }
+
+    // Whether two list items are the same type, with the same delimiter and
+    // bullet character, so they belong in the same list.
+    function listsMatch(listData, itemData) {
+        return listData.type === itemData.type &&
+            listData.delimiter === itemData.delimiter &&
+            listData.bulletChar === itemData.bulletChar;
+    }
+
+    // For each block type: whether it accepts lines, how to continue it (0
+    // matched, 1 not matched, 2 the line is finished), how to finalize it and
+    // what it can contain.
+    const blocks = {
+        document: {
+            acceptsLines: false,
+            continue: () => 0,
+            finalize: () => {},
+            canContain: (t) => t !== 'item',
+        },
+        list: {
+            acceptsLines: false,
+            continue: () => 0,
+            finalize(parser, block) {
+                let item = block.firstChild;
+                while (item) {
+                    // a non-final list item ending with a blank line
+                    if (endsWithBlankLine(item) && item.next) {
+                        block.listData.tight = false;
+                        break;
+                    }
+                    // look for spaces between the item's children
+                    let subitem = item.firstChild;
+                    while (subitem) {
+                        if (endsWithBlankLine(subitem) && (item.next || subitem.next)) {
+                            block.listData.tight = false;
+                            break;
+                        }
+                        subitem = subitem.next;
+                    }
+                    item = item.next;
+                }
+            },
+            canContain: (t) => t === 'item',
+        },
+        block_quote: {
+            acceptsLines: false,
+            continue(parser) {
+                const ln = parser.currentLine;
+                if (!parser.indented && peek(ln, parser.nextNonspace) === '>') {
+                    parser.advanceNextNonspace();
+                    parser.advanceOffset(1, false);
+                    if (isSpaceOrTab(peek(ln, parser.offset))) {
+                        parser.advanceOffset(1, true);
+                    }
+                } else {
+                    return 1;
+                }
+                return 0;
+            },
+            finalize: () => {},
+            canContain: (t) => t !== 'item',
+        },
+        item: {
+            acceptsLines: false,
+            continue(parser, container) {
+                if (parser.blank) {
+                    if (container.firstChild === null) {
+                        // a blank line after an empty list item
+                        return 1;
+                    }
+                    parser.advanceNextNonspace();
+                } else if (parser.indent >= container.listData.markerOffset + container.listData.padding) {
+                    parser.advanceOffset(container.listData.markerOffset + container.listData.padding, true);
+                } else {
+                    return 1;
+                }
+                return 0;
+            },
+            finalize: () => {},
+            canContain: (t) => t !== 'item',
+        },
+        heading: {
+            acceptsLines: false,
+            // a heading can never contain more than one line
+            continue: () => 1,
+            finalize: () => {},
+            canContain: () => false,
+        },
+        thematic_break: {
+            acceptsLines: false,
+            // a thematic break can never contain more than one line
+            continue: () => 1,
+            finalize: () => {},
+            canContain: () => false,
+        },
+        code_block: {
+            acceptsLines: true,
+            continue(parser, container) {
+                const ln = parser.currentLine;
+                const indent = parser.indent;
+                if (container.isFenced) {
+                    const match = indent <= 3 &&
+                        ln.length >= parser.nextNonspace + 1 &&
+                        ln[parser.nextNonspace] === container.fenceChar &&
+                        reClosingCodeFence.exec(ln.slice(parser.nextNonspace));
+                    if (match && match[0].length >= container.fenceLength) {
+                        // a closing fence, which is the end of the line
+                        parser.finalize(container, parser.lineNumber);
+                        return 2;
+                    }
+                    // skip the optional spaces of the fence offset
+                    let i = container.fenceOffset;
+                    while (i > 0 && isSpaceOrTab(peek(ln, parser.offset))) {
+                        parser.advanceOffset(1, true);
+                        i--;
+                    }
+                } else if (indent >= CODE_INDENT) {
+                    parser.advanceOffset(CODE_INDENT, true);
+                } else if (parser.blank) {
+                    parser.advanceNextNonspace();
+                } else {
+                    return 1;
+                }
+                return 0;
+            },
+            finalize(parser, block) {
+                if (block.isFenced) {
+                    // the first line is the info string
+                    const content = block.stringContent;
+                    const newlinePos = content.indexOf('\n');
+                    block.info = unescapeString(content.slice(0, newlinePos).trim());
+                    block.literal = content.slice(newlinePos + 1);
+                } else {
+                    block.literal = block.stringContent.replace(/(\n *)+$/, '\n');
+                }
+                block.stringContent = null;
+            },
+            canContain: () => false,
+        },
+        html_block: {
+            acceptsLines: true,
+            continue: (parser, container) =>
+                parser.blank && (container.htmlBlockType === 6 || container.htmlBlockType === 7) ? 1 : 0,
+            finalize(parser, block) {
+                block.literal = block.stringContent.replace(/(\n *)+$/, '');
+                block.stringContent = null;
+            },
+            canContain: () => false,
+        },
+        paragraph: {
+            acceptsLines: true,
+            continue: (parser) => (parser.blank ? 1 : 0),
+            finalize(parser, block) {
+                let hasReferenceDefs = false;
+                // try parsing the beginning as link reference definitions
+                while (peek(block.stringContent, 0) === '[') {
+                    const pos = parser.inlineParser.parseReference(block.stringContent, parser.refmap);
+                    if (!pos) {
+                        break;
+                    }
+                    block.stringContent = block.stringContent.slice(pos);
+                    hasReferenceDefs = true;
+                }
+                if (hasReferenceDefs && isBlank(block.stringContent)) {
+                    block.unlink();
+                }
+            },
+            canContain: () => false,
+        },
+    };
+
+    // Block starts, tried in order. Each returns 0 for no match, 1 for a
+    // container (keep going) and 2 for a leaf (no more block starts).
+    const blockStarts = [
+        // block quote
+        (parser) => {
+            if (!parser.indented && peek(parser.currentLine, parser.nextNonspace) === '>') {
+                parser.advanceNextNonspace();
+                parser.advanceOffset(1, false);
+                // optional following space
+                if (isSpaceOrTab(peek(parser.currentLine, parser.offset))) {
+                    parser.advanceOffset(1, true);
+                }
+                parser.closeUnmatchedBlocks();
+                parser.addChild('block_quote', parser.nextNonspace);
+                return 1;
+            }
+            return 0;
+        },
+        // ATX heading
+        (parser) => {
+            if (parser.indented) {
+                return 0;
+            }
+            const m = reATXHeadingMarker.exec(parser.currentLine.slice(parser.nextNonspace));
+            if (!m) {
+                return 0;
+            }
+            parser.advanceNextNonspace();
+            parser.advanceOffset(m[0].length, false);
+            parser.closeUnmatchedBlocks();
+            const container = parser.addChild('heading', parser.nextNonspace);
+            // the number of #s
+            container.level = m[0].trim().length;
+            // remove trailing #s
+            container.stringContent = parser.currentLine
+                .slice(parser.offset)
+                .replace(/^[ \t]*#+[ \t]*$/, '')
+                .replace(/[ \t]+#+[ \t]*$/, '');
+            parser.advanceOffset(parser.currentLine.length - parser.offset, false);
+            return 2;
+        },
+        // fenced code block
+        (parser) => {
+            if (parser.indented) {
+                return 0;
+            }
+            const m = reCodeFence.exec(parser.currentLine.slice(parser.nextNonspace));
+            if (!m) {
+                return 0;
+            }
+            const fenceLength = m[0].length;
+            parser.closeUnmatchedBlocks();
+            const container = parser.addChild('code_block', parser.nextNonspace);
+            container.isFenced = true;
+            container.fenceLength = fenceLength;
+            container.fenceChar = m[0][0];
+            container.fenceOffset = parser.indent;
+            parser.advanceNextNonspace();
+            parser.advanceOffset(fenceLength, false);
+            return 2;
+        },
+        // HTML block
+        (parser, container) => {
+            if (parser.indented || peek(parser.currentLine, parser.nextNonspace) !== '<') {
+                return 0;
+            }
+            const s = parser.currentLine.slice(parser.nextNonspace);
+            for (let blockType = 1; blockType <= 7; blockType++) {
+                if (reHtmlBlockOpen[blockType].test(s) && (blockType < 7 || container.type !== 'paragraph')) {
+                    parser.closeUnmatchedBlocks();
+                    // spaces are part of the HTML block, so the offset stays
+                    const b = parser.addChild('html_block', parser.offset);
+                    b.htmlBlockType = blockType;
+                    return 2;
+                }
+            }
+            return 0;
+        },
+        // setext heading
+        (parser, container) => {
+            if (parser.indented || container.type !== 'paragraph') {
+                return 0;
+            }
+            const m = reSetextHeadingLine.exec(parser.currentLine.slice(parser.nextNonspace));
+            if (!m) {
+                return 0;
+            }
+            parser.closeUnmatchedBlocks();
+            // resolve reference link definitions
+            while (peek(container.stringContent, 0) === '[') {
+                const pos = parser.inlineParser.parseReference(container.stringContent, parser.refmap);
+                if (!pos) {
+                    break;
+                }
+                container.stringContent = container.stringContent.slice(pos);
+            }
+            if (!container.stringContent) {
+                return 0;
+            }
+            const heading = new Node('heading', container.sourcepos);
+            heading.level = m[0][0] === '=' ? 1 : 2;
+            heading.stringContent = container.stringContent;
+            container.insertAfter(heading);
+            container.unlink();
+            parser.tip = heading;
+            parser.advanceOffset(parser.currentLine.length - parser.offset, false);
+            return 2;
+        },
+        // thematic break
+        (parser) => {
+            if (parser.indented || !reThematicBreak.test(parser.currentLine.slice(parser.nextNonspace))) {
+                return 0;
+            }
+            parser.closeUnmatchedBlocks();
+            parser.addChild('thematic_break', parser.nextNonspace);
+            parser.advanceOffset(parser.currentLine.length - parser.offset, false);
+            return 2;
+        },
+        // list item
+        (parser, container) => {
+            if (parser.indented && container.type !== 'list') {
+                return 0;
+            }
+            const data = parseListMarker(parser, container);
+            if (!data) {
+                return 0;
+            }
+            parser.closeUnmatchedBlocks();
+            // add the list if needed
+            if (parser.tip.type !== 'list' || !listsMatch(container.listData, data)) {
+                container = parser.addChild('list', parser.nextNonspace);
+                container.listData = data;
+            }
+            // add the list item
+            container = parser.addChild('item', parser.nextNonspace);
+            container.listData = data;
+            return 1;
+        },
+        // indented code block
+        (parser) => {
+            if (parser.indented && parser.tip.type !== 'paragraph' && !parser.blank) {
+                parser.advanceOffset(CODE_INDENT, true);
+                parser.closeUnmatchedBlocks();
+                parser.addChild('code_block', parser.offset);
+                return 2;
+            }
+            return 0;
+        },
+    ];
+
+    class Parser {
+        constructor(options = {}) {
+            this.doc = new Node('document', [[1, 1], [0, 0]]);
+            this.tip = this.doc;
+            this.oldtip = this.doc;
+            this.currentLine = '';
+            this.lineNumber = 0;
+            this.offset = 0;
+            this.column = 0;
+            this.nextNonspace = 0;
+            this.nextNonspaceColumn = 0;
+            this.indent = 0;
+            this.indented = false;
+            this.blank = false;
+            this.partiallyConsumedTab = false;
+            this.allClosed = true;
+            this.lastMatchedContainer = this.doc;
+            this.refmap = {};
+            this.lastLineLength = 0;
+            this.inlineParser = new InlineParser(options);
+            this.options = options;
+        }
+
+        // Add a line to the block at the tip, which must accept lines.
+        addLine() {
+            if (this.partiallyConsumedTab) {
+                // skip over the tab, adding spaces in its place
+                this.offset += 1;
+                const charsToTab = 4 - (this.column % 4);
+                this.tip.stringContent += ' '.repeat(charsToTab);
+            }
+            this.tip.stringContent += this.currentLine.slice(this.offset) + '\n';
+        }
+
+        // Add a block of type tag as a child of the tip. If the tip can't accept
+        // children, close and finalize it and try its parent, and so on until a
+        // block that can is found.
+        addChild(tag, offset) {
+            while (!blocks[this.tip.type].canContain(tag)) {
+                this.finalize(this.tip, this.lineNumber - 1);
+            }
+            const newBlock = new Node(tag, [[this.lineNumber, offset + 1], [0, 0]]);
+            newBlock.stringContent = '';
+            this.tip.appendChild(newBlock);
+            this.tip = newBlock;
+            return newBlock;
+        }
+
+        // Finalize and close any unmatched blocks.
+        closeUnmatchedBlocks() {
+            if (!this.allClosed) {
+                while (this.oldtip !== this.lastMatchedContainer) {
+                    const parent = this.oldtip.parent;
+                    this.finalize(this.oldtip, this.lineNumber - 1);
+                    this.oldtip = parent;
+                }
+                this.allClosed = true;
+            }
+        }
+
+        findNextNonspace() {
+            const currentLine = this.currentLine;
+            let i = this.offset;
+            let cols = this.column;
+            let c = i < currentLine.length ? currentLine[i] : '';
+            while (c !== '') {
+                if (c === ' ') {
+                    i += 1;
+                    cols += 1;
+                } else if (c === '\t') {
+                    i += 1;
+                    cols += 4 - (cols % 4);
+                } else {
+                    break;
+                }
+                c = i < currentLine.length ? currentLine[i] : '';
+            }
+            this.blank = c === '\n' || c === '\r' || c === '';
+            this.nextNonspace = i;
+            this.nextNonspaceColumn = cols;
+            this.indent = this.nextNonspaceColumn - this.column;
+            this.indented = this.indent >= CODE_INDENT;
+        }
+
+        advanceNextNonspace() {
+            this.offset = this.nextNonspace;
+            this.column = this.nextNonspaceColumn;
+            this.partiallyConsumedTab = false;
+        }
+
+        advanceOffset(count, columns) {
+            const currentLine = this.currentLine;
+            let c = peek(currentLine, this.offset);
+            while (count > 0 && c !== null) {
+                if (c === '\t') {
+                    const charsToTab = 4 - (this.column % 4);
+                    if (columns) {
+                        this.partiallyConsumedTab = charsToTab > count;
+                        const charsToAdvance = Math.min(count, charsToTab);
+                        this.column += charsToAdvance;
+                        this.offset += this.partiallyConsumedTab ? 0 : 1;
+                        count -= charsToAdvance;
+                    } else {
+                        this.partiallyConsumedTab = false;
+                        this.column += charsToTab;
+                        this.offset += 1;
+                        count -= 1;
+                    }
+                } else {
+                    this.partiallyConsumedTab = false;
+                    this.offset += 1;
+                    // block starts are ascii
+                    this.column += 1;
+                    count -= 1;
+                }
+                c = peek(currentLine, this.offset);
+            }
+        }
+
+        // Analyze a line of text and update the document.
+        incorporateLine(ln) {
+            let allMatched = true;
+            let container = this.doc;
+            this.oldtip = this.tip;
+            this.offset = 0;
+            this.column = 0;
+            this.blank = false;
+            this.partiallyConsumedTab = false;
+            this.lineNumber += 1;
+
+            // replace NUL characters for security
+            if (ln.indexOf('\u0000') !== -1) {
+                ln = ln.replace(/\0/g, '\uFFFD');
+            }
+            this.currentLine = ln;
+
+            // For each containing block, try to parse the associated line start.
+            // On failure container is the last matching block.
+            while (true) {
+                const lastChild = container.lastChild;
+                if (!(lastChild && lastChild.open)) {
+                    break;
+                }
+                container = lastChild;
+                this.findNextNonspace();
+                const rv = blocks[container.type].continue(this, container);
+                if (rv === 1) {
+                    // failed to match a block
+                    allMatched = false;
+                } else if (rv === 2) {
+                    // the end of the line for a closing code fence
+                    this.lastLineLength = ln.length;
+                    return;
+                }
+                if (!allMatched) {
+                    // back up to the last matching block
+                    container = container.parent;
+                    break;
+                }
+            }
+
+            this.allClosed = container === this.oldtip;
+            this.lastMatchedContainer = container;
+
+            let matchedLeaf = container.type !== 'paragraph' && blocks[container.type].acceptsLines;
+            // Unless the last matched container is a code block, try new container
+            // starts, adding children to the last matched container.
+            while (!matchedLeaf) {
+                this.findNextNonspace();
+
+                // a quick check for lines that can't start a block
+                if (!this.indented && !reMaybeSpecial.test(ln.slice(this.nextNonspace))) {
+                    this.advanceNextNonspace();
+                    break;
+                }
+
+                let i = 0;
+                while (i < blockStarts.length) {
+                    const res = blockStarts[i](this, container);
+                    if (res === 1) {
+                        container = this.tip;
+                        break;
+                    } else if (res === 2) {
+                        container = this.tip;
+                        matchedLeaf = true;
+                        break;
+                    }
+                    i++;
+                }
+                if (i === blockStarts.length) {
+                    // nothing matched
+                    this.advanceNextNonspace();
+                    break;
+                }
+            }
+
+            // What remains at the offset is a text line. Add it to the
+            // appropriate container.
+            if (!this.allClosed && !this.blank && this.tip.type === 'paragraph') {
+                // lazy paragraph continuation
+                this.addLine();
+            } else {
+                // not a lazy continuation, so finalize any blocks not matched
+                this.closeUnmatchedBlocks();
+                if (this.blank && container.lastChild) {
+                    container.lastChild.lastLineBlank = true;
+                }
+
+                const t = container.type;
+
+                // Block quote lines are never blank as they start with >, and
+                // blanks in fenced code don't count for tight or loose lists or
+                // breaking out of lists. lastLineBlank isn't set on an empty list
+                // item, or just after closing a fenced block.
+                const lastLineBlank = this.blank &&
+                    !(t === 'block_quote' ||
+                        (t === 'code_block' && container.isFenced) ||
+                        (t === 'item' && !container.firstChild && container.sourcepos[0][0] === this.lineNumber));
+
+                // propagate lastLineBlank up through parents
+                let cont = container;
+                while (cont) {
+                    cont.lastLineBlank = lastLineBlank;
+                    cont = cont.parent;
+                }
+
+                if (blocks[t].acceptsLines) {
+                    this.addLine();
+                    // check an HTML block for its end condition
+                    if (t === 'html_block' &&
+                        container.htmlBlockType >= 1 &&
+                        container.htmlBlockType <= 5 &&
+                        reHtmlBlockClose[container.htmlBlockType].test(this.currentLine.slice(this.offset))) {
+                        this.finalize(container, this.lineNumber);
+                    }
+                } else if (this.offset < ln.length && !this.blank) {
+                    // create a paragraph container for one line
+                    container = this.addChild('paragraph', this.offset);
+                    this.advanceNextNonspace();
+                    this.addLine();
+                }
+            }
+            this.lastLineLength = ln.length;
+        }
+
+        // Close a block and do any postprocessing, then make its parent the tip.
+        finalize(block, lineNumber) {
+            const above = block.parent;
+            block.open = false;
+            block.sourcepos[1] = [lineNumber, this.lastLineLength];
+            blocks[block.type].finalize(this, block);
+            this.tip = above;
+        }
+
+        // Parse the string content of paragraphs and headings into inlines.
+        processInlines(block) {
+            const walker = block.walker();
+            this.inlineParser.refmap = this.refmap;
+            this.inlineParser.options = this.options;
+            let event;
+            while ((event = walker.next())) {
+                const t = event.node.type;
+                if (!event.entering && (t === 'paragraph' || t === 'heading')) {
+                    this.inlineParser.parse(event.node);
+                }
+            }
+        }
+
+        // Parse a document, returning its AST.
+        parse(input) {
+            this.doc = new Node('document', [[1, 1], [0, 0]]);
+            this.tip = this.doc;
+            this.refmap = {};
+            this.lineNumber = 0;
+            this.lastLineLength = 0;
+            this.offset = 0;
+            this.column = 0;
+            this.lastMatchedContainer = this.doc;
+            this.currentLine = '';
+            const lines = input.split(reLineEnding);
+            let length = lines.length;
+            if (input.length > 0 && input[input.length - 1] === '\n') {
+                // ignore the last blank line created by the final newline
+                length -= 1;
+            }
+            for (let i = 0; i < length; i++) {
+                this.incorporateLine(lines[i]);
+            }
+            while (this.tip) {
+                this.finalize(this.tip, length);
+            }
+            this.processInlines(this.doc);
+            return this.doc;
+        }
+    }
+
+    // HTML rendering
+
+    const reUnsafeProtocol = /^javascript:|vbscript:|file:|data:/i;
+    const reSafeDataProtocol = /^data:image\/(?:png|gif|jpeg|webp)/i;
+
+    const potentiallyUnsafe = (url) => reUnsafeProtocol.test(url) && !reSafeDataProtocol.test(url);
+
+    class HtmlRenderer {
+        constructor(options = {}) {
+            // By default soft breaks are rendered as newlines. "<br />" makes them
+            // hard breaks and " " ignores line wrapping in the source.
+            this.options = { ...options, softbreak: options.softbreak || '\n' };
+            this.disableTags = 0;
+            this.lastOut = '\n';
+            this.buf = '';
+        }
+
+        // Walk the AST, calling the method for each node's type.
+        render(ast) {
+            const walker = ast.walker();
+            this.buf = '';
+            this.lastOut = '\n';
+            let event;
+            while ((event = walker.next())) {
+                const method = NODE_METHODS[event.node.type];
+                if (method) {
+                    this[method](event.node, event.entering);
+                }
+            }
+            return this.buf;
+        }
+
+        lit(s) {
+            this.buf += s;
+            this.lastOut = s;
+        }
+
+        cr() {
+            if (this.lastOut !== '\n') {
+                this.lit('\n');
+            }
+        }
+
+        out(s) {
+            this.lit(escapeXml(s));
+        }
+
+        tag(name, attrs, selfclosing) {
+            if (this.disableTags > 0) {
+                return;
+            }
+            this.buf += '<' + name;
+            for (const [key, value] of attrs || []) {
+                this.buf += ' ' + key + '="' + value + '"';
+            }
+            if (selfclosing) {
+                this.buf += ' /';
+            }
+            this.buf += '>';
+            this.lastOut = '>';
+        }
+
+        attrs(node) {
+            const att = [];
+            if (this.options.sourcepos && node.sourcepos) {
+                const pos = node.sourcepos;
+                att.push(['data-sourcepos', `${pos[0][0]}:${pos[0][1]}-${pos[1][0]}:${pos[1][1]}`]);
+            }
+            return att;
+        }
+
+        text(node) {
+            this.out(node.literal);
+        }
+
+        softbreak() {
+            this.lit(this.options.softbreak);
+        }
+
+        linebreak() {
+            this.tag('br', [], true);
+            this.cr();
+        }
+
+        link(node, entering) {
+            const attrs = this.attrs(node);
+            if (entering) {
+                if (!(this.options.safe && potentiallyUnsafe(node.destination))) {
+                    attrs.push(['href', escapeXml(node.destination)]);
+                }
+                if (node.title) {
+                    attrs.push(['title', escapeXml(node.title)]);
+                }
+                this.tag('a', attrs);
+            } else {
+                this.tag('/a');
+            }
+        }
+
+        image(node, entering) {
+            if (entering) {
+                if (this.disableTags === 0) {
+                    if (this.options.safe && potentiallyUnsafe(node.destination)) {
+                        this.lit('<img src="" alt="');
+                    } else {
+                        this.lit('<img src="' + escapeXml(node.destination) + '" alt="');
+                    }
+                }
+                this.disableTags += 1;
+            } else {
+                this.disableTags -= 1;
+                if (this.disableTags === 0) {
+                    if (node.title) {
+                        this.lit('" title="' + escapeXml(node.title));
+                    }
+                    this.lit('" />');
+                }
+            }
+        }
+
+        emph(node, entering) {
+            this.tag(entering ? 'em' : '/em');
+        }
+
+        strong(node, entering) {
+            this.tag(entering ? 'strong' : '/strong');
+        }
+
+        paragraph(node, entering) {
+            const grandparent = node.parent.parent;
+            const attrs = this.attrs(node);
+            if (grandparent !== null && grandparent.type === 'list' && grandparent.listData.tight) {
+                return;
+            }
+            if (entering) {
+                this.cr();
+                this.tag('p', attrs);
+            } else {
+                this.tag('/p');
+                this.cr();
+            }
+        }
+
+        heading(node, entering) {
+            const tagname = 'h' + node.level;
+            const attrs = this.attrs(node);
+            if (entering) {
+                this.cr();
+                this.tag(tagname, attrs);
+            } else {
+                this.tag('/' + tagname);
+                this.cr();
+            }
+        }
+
+        code(node) {
+            this.tag('code');
+            this.out(node.literal);
+            this.tag('/code');
+        }
+
+        codeBlock(node) {
+            const infoWords = node.info ? node.info.split(/\s+/).filter((w) => w) : [];
+            const attrs = this.attrs(node);
+            if (infoWords.length > 0) {
+                attrs.push(['class', 'language-' + escapeXml(infoWords[0])]);
+            }
+            this.cr();
+            this.tag('pre');
+            this.tag('code', attrs);
+            this.out(node.literal);
+            this.tag('/code');
+            this.tag('/pre');
+            this.cr();
+        }
+
+        thematicBreak(node) {
+            const attrs = this.attrs(node);
+            this.cr();
+            this.tag('hr', attrs, true);
+            this.cr();
+        }
+
+        blockQuote(node, entering) {
+            const attrs = this.attrs(node);
+            if (entering) {
+                this.cr();
+                this.tag('blockquote', attrs);
+                this.cr();
+            } else {
+                this.cr();
+                this.tag('/blockquote');
+                this.cr();
+            }
+        }
+
+        list(node, entering) {
+            const tagname = node.listData.type === 'bullet' ? 'ul' : 'ol';
+            const attrs = this.attrs(node);
+            if (entering) {
+                const start = node.listData.start;
+                if (start !== null && start !== 1) {
+                    attrs.push(['start', String(start)]);
+                }
+                this.cr();
+                this.tag(tagname, attrs);
+                this.cr();
+            } else {
+                this.cr();
+                this.tag('/' + tagname);
+                this.cr();
+            }
+        }
+
+        item(node, entering) {
+            const attrs = this.attrs(node);
+            if (entering) {
+                this.tag('li', attrs);
+            } else {
+                this.tag('/li');
+                this.cr();
+            }
+        }
+
+        htmlInline(node) {
+            this.lit(this.options.safe ? '<!-- raw HTML omitted -->' : node.literal);
+        }
+
+        htmlBlock(node) {
+            this.cr();
+            this.lit(this.options.safe ? '<!-- raw HTML omitted -->' : node.literal);
+            this.cr();
+        }
+
+        customInline(node, entering) {
+            if (entering && node.onEnter) {
+                this.lit(node.onEnter);
+            } else if (!entering && node.onExit) {
+                this.lit(node.onExit);
+            }
+        }
+
+        customBlock(node, entering) {
+            this.cr();
+            if (entering && node.onEnter) {
+                this.lit(node.onEnter);
+            } else if (!entering && node.onExit) {
+                this.lit(node.onExit);
+            }
+            this.cr();
+        }
+    }
+
+    const NODE_METHODS = {
+        text: 'text',
+        softbreak: 'softbreak',
+        linebreak: 'linebreak',
+        link: 'link',
+        image: 'image',
+        emph: 'emph',
+        strong: 'strong',
+        paragraph: 'paragraph',
+        heading: 'heading',
+        code: 'code',
+        code_block: 'codeBlock',
+        thematic_break: 'thematicBreak',
+        block_quote: 'blockQuote',
+        list: 'list',
+        item: 'item',
+        html_inline: 'htmlInline',
+        html_block: 'htmlBlock',
+        custom_inline: 'customInline',
+        custom_block: 'customBlock',
+    };
+
+    exports.Node = Node;
+    exports.Parser = Parser;
+    exports.HtmlRenderer = HtmlRenderer;
+});
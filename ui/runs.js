@@ -0,0 +1,88 @@
+// The list of runs in a catalog. Filtering and sorting happen on the server,
+// which answers from its index without reading the recordings.
+
+const FILTERS = ['task', 'status', 'model'];
+
+let sort = 'path';
+let descending = false;
+
+function cell(text, className = '') {
+    const td = document.createElement('td');
+    td.className = className;
+    td.textContent = text;
+    return td;
+}
+
+function runRow(run) {
+    const tr = document.createElement('tr');
+    const link = document.createElement('a');
+    link.href = `index.html?run=${run.id}`;
+    link.textContent = run.path;
+    const path = cell('', 'path');
+    path.append(link);
+    tr.append(
+        path,
+        cell(run.task),
+        cell(run.status, run.status),
+        cell(run.model),
+        cell(run.duration.toFixed(0), 'number'),
+        cell(run.tokens ?? '', 'number'),
+        cell(run.steps, 'number'),
+        cell(run.files_written, 'number'),
+    );
+    return tr;
+}
+
+function query() {
+    const params = new URLSearchParams({ sort, descending: descending ? '1' : '0' });
+    for (const name of [...FILTERS, 'search']) {
+        const value = document.querySelector(`#filters [name=${name}]`).value;
+        if (value) {
+            params.set(name, value);
+        }
+    }
+    return params;
+}
+
+async function loadRuns() {
+    const response = await fetch(`/runs?${query()}`);
+    const runs = await response.json();
+    document.getElementById('runs').replaceChildren(...runs.map(runRow));
+    document.getElementById('count').textContent = `${runs.length} runs`;
+    for (const th of document.querySelectorAll('th[data-sort]')) {
+        th.classList.toggle('sorted', th.dataset.sort === sort);
+        th.classList.toggle('descending', descending);
+    }
+}
+
+async function loadChoices() {
+    const response = await fetch('/runs/choices');
+    const choices = await response.json();
+    for (const name of FILTERS) {
+        const select = document.querySelector(`#filters [name=${name}]`);
+        const selected = select.value;
+        select.replaceChildren(new Option('any', ''),
+            ...choices[name].map(value => new Option(value, value)));
+        select.value = selected;
+    }
+}
+
+document.addEventListener('DOMContentLoaded', async () => {
+    for (const th of document.querySelectorAll('th[data-sort]')) {
+        th.addEventListener('click', () => {
+            descending = th.dataset.sort === sort ? !descending : false;
+            sort = th.dataset.sort;
+            loadRuns();
+        });
+    }
+    for (const input of document.querySelectorAll('#filters select, #filters input')) {
+        input.addEventListener('input', loadRuns);
+    }
+    await loadChoices();
+    await loadRuns();
+    // pick up runs that have been added or changed since
+    setInterval(async () => {
+        await loadChoices();
+        await loadRuns();
+    }, 10000);
+});
@@ -1,18 +1,22 @@
-console.log('hello world')
-
-import { render, html, unsafeHTML } from 'https://cdn.jsdelivr.net/gh/lit/dist@3/all/lit-all.min.js';
-import * as commonmark from 'https://esm.run/commonmark';
-
-
-
-console.log(commonmark);
+// commonmark is defined by commonmark.js, loaded before this module.
 const markdownReader = new commonmark.Parser();
 const markdownWriter = new commonmark.HtmlRenderer({ safe: true });
-const markdown = (text) => unsafeHTML(markdownWriter.render(markdownReader.parse(text)));
 
-let testing = markdown("# Hello World\n\n");
-console.log(testing);
-console.log(typeof unsafeHTML(testing));
+// Build a DOM element. Children can be nodes, strings or (nested) arrays.
+function el(tag, attrs = {}, ...children) {
+    const node = document.createElement(tag);
+    for (const [name, value] of Object.entries(attrs)) {
+        node.setAttribute(name, value);
+    }
+    node.append(...children.flat(Infinity).filter(c => c !== null && c !== undefined));
+    return node;
+}
+
+const markdown = (text) => {
+    const node = el('div', { class: 'markdown' });
+    node.innerHTML = markdownWriter.render(markdownReader.parse(text));
+    return node;
+};
 
 function getKey(o) {
     let keys = [];
@@ -29,77 +33,76 @@ function getKey(o) {
     }
 }
 
-const fileContents = (contents) => html`
-    <details class="function-arg-value">
-        <summary>File Contents (${contents.split('\n').length} lines)</summary>
-        <pre>${contents}</pre>
-    </details>
-`
-
-const textPart = (text) => html`
-    <div class="part text">
-        <b>Text</b>${markdown(text)}
-    </div>`
-
-
-const functionCallArgs = (name, args) => {
-    switch (name) {
-        case 'write_file':
-            const fewer_args = {};
-            fewer_args.path = args.path;
-            return html`<pre>${JSON.stringify(fewer_args)}</pre>`
-        default:
-            return html`<pre>${JSON.stringify(args)}</pre>`
+// Long contents are only put in the DOM when they are opened.
+const lazyDetails = (summary, contents) => {
+    const details = el('details', { class: 'function-arg-value' }, el('summary', {}, summary));
+    details.addEventListener('toggle', () => {
+        if (details.open && details.children.length === 1) {
+            details.append(contents());
+        }
+    });
+    return details;
+};
 
-    }
+const fileContents = (contents) => lazyDetails(
+    `File Contents (${contents.split('\n').length} lines)`,
+    () => el('pre', {}, contents));
 
-}
+const textPart = (text) => el('div', { class: 'part text' }, el('b', {}, 'Text'), markdown(text));
 
 const functionArgValue = (function_name, name, value) => {
     switch (`${function_name}.${name}`) {
+        case 'edit_file.old_string':
+        case 'edit_file.new_string':
+        case 'apply_patch.patch':
+            return el('pre', {}, value);
         case 'write_file.contents':
         case 'read_file.result':
             return fileContents(value);
         case 'read_files.result':
-            return html`<dl>${Object.entries(value).map(
-                ([path, contents]) => html`<dt class="filename">${path}</dt>
-                        <dd>${fileContents(contents)}</dd>`)}
-                </dl>`;
+            return el('dl', {}, Object.entries(value).map(([path, contents]) => [
+                el('dt', { class: 'filename' }, path),
+                el('dd', {}, fileContents(contents)),
+            ]));
+        case 'search_lines.result':
+            return [
+                el('dl', {}, Object.entries(value.files).map(([path, lines]) => [
+                    el('dt', { class: 'filename' }, path),
+                    el('dd', {}, el('pre', {}, lines)),
+                ])),
+                value.truncated ? el('p', {}, '(truncated)') : null,
+            ];
+        case 'list_tree.result':
+            return el('pre', {}, value);
         case 'list_directory.result':
-            return html`<ul>${value.map(item => html`<li class="filename">${item}</li>`)}</ul>`
+            return el('ul', {}, value.map(item => el('li', { class: 'filename' }, item)));
+        case 'fx_build.result':
+            if (typeof value !== 'object') {
+                return el('pre', {}, String(value));
+            }
+            return [
+                el('p', {}, value.success ? 'Succeeded' : 'Failed'),
+                value.errors && value.errors.length ? el('pre', {}, value.errors.join('\n')) : null,
+                value.note ? el('p', {}, value.note) : null,
+                value.output ? lazyDetails(`Output (${value.output.split('\n').length} lines)`,
+                    () => el('pre', {}, value.output)) : null,
+            ];
         default:
-            return html`<p>${value}</p>`;
+            return el('p', {}, typeof value === 'string' ? value : JSON.stringify(value));
     }
 }
 
-const functionArg = (function_name, name, value) => html`
-    <div class="function-arg" data-arg-name="${name}">
-        <div class="function-arg-name">${name}</div>
-        <div class="function-arg-value">${functionArgValue(function_name, name, value)}</div>
-    </div>`;
-
-const functionCallPart = (function_call) => {
-    console.assert(function_call.id === null);
-    return html`
-        <div class="part function_call" data-function-name="${function_call.name}">
-            <b>Function Call</b>
-            <div class="function-name">${function_call.name}</div>
-            <div class="function-args">${Object.entries(function_call.args).map(
-        ([name, value]) => functionArg(function_call.name, name, value))}</div>
-        </div>`
-};
-
-const functionResponsePart = (function_call) => {
-    console.assert(function_call.id === null);
-    return html`
-        <div class="part function_response" data-function-name="${function_call.name}">
-            <b>Function Response</b>
-            <div class="function-name">${function_call.name}</div>
-            <div class="function-args">${Object.entries(function_call.response).map(
-        ([name, value]) => functionArg(function_call.name, name, value))}</div>
-        </div>`
-};
+const functionArg = (function_name, name, value) => el(
+    'div', { class: 'function-arg', 'data-arg-name': name },
+    el('div', { class: 'function-arg-name' }, name),
+    el('div', { class: 'function-arg-value' }, functionArgValue(function_name, name, value)));
 
+const functionPart = (kind, title, name, args) => el(
+    'div', { class: `part ${kind}`, 'data-function-name': name },
+    el('b', {}, title),
+    el('div', { class: 'function-name' }, name),
+    el('div', { class: 'function-args' },
+        Object.entries(args || {}).map(([arg, value]) => functionArg(name, arg, value))));
 
 const historyPart = (part) => {
     const key = getKey(part);
@@ -107,48 +110,160 @@ const historyPart = (part) => {
         case 'text':
             return textPart(part.text);
         case 'function_call':
-            return functionCallPart(part.function_call);
+            return functionPart('function_call', 'Function Call',
+                part.function_call.name, part.function_call.args);
         case 'function_response':
-            return functionResponsePart(part.function_response);
+            return functionPart('function_response', 'Function Response',
+                part.function_response.name, part.function_response.response);
         default:
-            return html`<div class="part"><b>${key}</b>${JSON.stringify(part)}</div>`;
-
+            return el('div', { class: 'part' }, el('b', {}, key), JSON.stringify(part));
     }
 };
+
 const role = (role) => {
     if (role === 'user') {
-        return html`<div class="role">User 🠮 Model</div>`;
+        return el('div', { class: 'role' }, 'User 🠮 Model');
     } else {
         console.assert(role === 'model');
-        return html`<div class="role">Model 🠮 User</div>`;
-
+        return el('div', { class: 'role' }, 'Model 🠮 User');
     }
 }
-const historyItem = (item) => html`
-<div class="entry">
-    ${role(item.role)}
-    <div class="parts">${item.parts.map(historyPart)}</div>
-</div>`;
-const historyList = (items) => html`<div class="history">${items.map(historyItem)}</div>`;
 
+const historyItem = (item) => el('div', { class: 'entry' },
+    role(item.role),
+    el('div', { class: 'parts' }, (item.parts || []).map(historyPart)));
+
+// A list that only keeps the items near the viewport in the DOM. Items are
+// rendered the first time they come into view; until they have been measured
+// their height is estimated.
+class VirtualList {
+    static ESTIMATED_HEIGHT = 150;
+    // extra items rendered above and below the viewport
+    static OVERSCAN = 5;
 
+    constructor(container, renderItem) {
+        this.container = container;
+        this.renderItem = renderItem;
+        this.items = [];
+        this.heights = [];
+        this.nodes = new Map();
+        this.before = el('div');
+        this.visible = el('div');
+        this.after = el('div');
+        container.append(this.before, this.visible, this.after);
+        this.scheduled = false;
+        window.addEventListener('scroll', () => this.schedule(), { passive: true });
+        window.addEventListener('resize', () => this.schedule());
+    }
 
+    // Items are only ever appended.
+    setItems(items) {
+        while (this.heights.length < items.length) {
+            this.heights.push(VirtualList.ESTIMATED_HEIGHT);
+        }
+        this.items = items;
+        this.schedule();
+    }
+
+    schedule() {
+        if (!this.scheduled) {
+            this.scheduled = true;
+            requestAnimationFrame(() => {
+                this.scheduled = false;
+                this.update();
+            });
+        }
+    }
+
+    node(index) {
+        let node = this.nodes.get(index);
+        if (!node) {
+            node = el('div', { class: 'item' }, this.renderItem(this.items[index]));
+            this.nodes.set(index, node);
+        }
+        return node;
+    }
+
+    update() {
+        const count = this.items.length;
+        const top = -this.container.getBoundingClientRect().top;
+        const bottom = top + window.innerHeight;
+
+        let first = 0;
+        let offset = 0;
+        while (first < count && offset + this.heights[first] <= top) {
+            offset += this.heights[first++];
+        }
+        let last = first;
+        while (last < count && offset < bottom) {
+            offset += this.heights[last++];
+        }
+        first = Math.max(0, first - VirtualList.OVERSCAN);
+        last = Math.min(count, last + VirtualList.OVERSCAN);
+
+        const nodes = [];
+        for (let i = first; i < last; i++) {
+            nodes.push(this.node(i));
+        }
+        this.visible.replaceChildren(...nodes);
+
+        let changed = false;
+        for (let i = first; i < last; i++) {
+            const height = this.nodes.get(i).offsetHeight;
+            if (height !== this.heights[i]) {
+                this.heights[i] = height;
+                changed = true;
+            }
+        }
+        const sum = (from, to) => this.heights.slice(from, to).reduce((a, b) => a + b, 0);
+        this.before.style.height = `${sum(0, first)}px`;
+        this.after.style.height = `${sum(last, count)}px`;
+        if (changed) {
+            // newly measured items may have moved others into view
+            this.schedule();
+        }
+    }
+}
+
+let historyList = null;
+
+// Runs opened from the run list are loaded from the catalog.
+const run = new URLSearchParams(location.search).get('run');
+const stateUrl = run ? `/runs/${run}/state` : '/state';
 
 async function loadHistory() {
-    const response = await fetch('/state');
-    const state = await response.json();
-    console.log(state);
-    const history = state.history;
-    const historyDiv = document.getElementById('history');
-    render(historyList(history), historyDiv)
-    // historyDiv.innerHTML = ''; // Clear previous history
-
-    // history.forEach(entry => {
-    //     const p = document.createElement('p');
-    //     p.className = 'entry'
-    //     p.textContent = JSON.stringify(entry);
-    //     historyDiv.appendChild(p);
-    // });
+    let state;
+    try {
+        const response = await fetch(stateUrl);
+        if (!response.ok) {
+            throw new Error(`${response.status} ${response.statusText}`);
+        }
+        state = await response.json();
+    } catch (e) {
+        // The recording may be part way through being written, so try again.
+        console.error(e);
+        setTimeout(loadHistory, 2000);
+        return;
+    }
+    if (historyList === null) {
+        historyList = new VirtualList(document.getElementById('history'), historyItem);
+    }
+    historyList.setItems(state.history);
+    if (state.context) {
+        document.getElementById('context').hidden = false;
+        document.getElementById('context-meter').value = state.context.tokens / state.context.limit;
+        document.getElementById('context-tokens').textContent =
+            `~${state.context.tokens.toLocaleString()} of ${state.context.limit.toLocaleString()} tokens`;
+    }
+    const streaming = document.getElementById('streaming');
+    streaming.replaceChildren(...(state.streaming ? [
+        el('div', { class: 'entry streaming' }, role('model'),
+            el('div', { class: 'parts' }, textPart(state.streaming))),
+    ] : []));
+    // Keep following runs that are still in progress.
+    if (!state.completed) {
+        setTimeout(loadHistory, 2000);
+    }
 }
 
 // Initial load of history when the page loads
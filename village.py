@@ -4,18 +4,24 @@ import json
 from pathlib import Path
 import asyncio
 import argparse
+import signal
+import sys
 
 import tasks
 import ui
 import summarize
-from task_runner import TaskRunner, MODELS
+import replay
+import batch
+import work_queue
+import catalog
+from task_runner import TaskRunner, add_run_arguments
 
 
 async def run_task(args: argparse.Namespace):
     task_runner = TaskRunner(args)
     webui = None
     if args.ui:
-        webui = ui.UI(lambda: task_runner.get_state())
+        webui = ui.UI(task_runner.get_state_json)
         await webui.start()
     await task_runner.run()
     if webui is not None:
@@ -30,45 +36,50 @@ if __name__ == "__main__":
 
     # Run command
     run_parser = subcommands.add_parser("run", help="Run a task.")
-    run_parser.add_argument(
-        "--model",
-        type=str,
-        default=MODELS[0],
-        choices=MODELS,
-        help="The LLM model to use.",
-    )
-    run_parser.add_argument(
-        "--temperature",
-        type=float,
-        default=1,
-        help="The LLM temperature. Defaults to 1. Range is 0 to 2. "
-        + "Lower values are less random, Higher values are more random.",
-    )
-    run_parser.add_argument(
-        "--output", type=Path, help="Where to put the JSON recording of the sessions."
-    )
-    run_parser.add_argument(
-        "--ui", action="store_true", help="Run the web UI while the task runs"
-    )
+    add_run_arguments(run_parser)
     tasks.add_task_parsers(run_parser)
 
     # View command
     view_parser = subcommands.add_parser("view", help="View a task recording.")
     view_parser.add_argument("recording", type=Path, help="The recording to view.")
 
+    # Serve command
+    catalog.add_subcommand(subcommands)
+
     # Summarize command
     summarize.add_subcommand(subcommands)
 
+    # Replay command
+    replay.add_subcommand(subcommands)
+
+    # Batch command
+    batch.add_subcommand(subcommands)
+
+    # Coordinator and worker commands
+    work_queue.add_subcommand(subcommands)
+
     # Parse and dispatch to subcommands
     args = parser.parse_args()
 
     if args.subcommand == "run":
+        # exit normally when terminated, so that commands are stopped too
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(1))
         asyncio.run(run_task(args))
     elif args.subcommand == "view":
-        webui = ui.UI(lambda: json.load(open(args.output)))
+        webui = ui.UI(lambda: open(args.recording, "rb").read())
         webui.run_forever()
+    elif args.subcommand == "serve":
+        catalog.serve_command(args)
     elif args.subcommand == "summarize":
         summarize.summarize_command(args)
+    elif args.subcommand == "replay":
+        replay.replay_command(args)
+    elif args.subcommand == "batch":
+        batch.batch_command(args)
+    elif args.subcommand == "coordinator":
+        work_queue.coordinator_command(args)
+    elif args.subcommand == "worker":
+        work_queue.worker_command(args)
     else:
         parser.print_help()
         exit(1)
@@ -0,0 +1,449 @@
+"""
+Spreading runs across machines.
+
+A coordinator holds a queue of jobs in a SQLite database and serves it over
+HTTP. Workers, on any host that has a checkout, lease jobs, run them with
+`village run` and upload the recordings back to the coordinator. Workers
+heartbeat while a job runs; if a worker stops heartbeating its job is put back
+on the queue for another worker to pick up.
+
+Migrations run in parallel on one worker share its checkout and would lose
+each other's edits to the visibility list, so the worker removes successful
+components from it itself, as batch does.
+
+Jobs are json objects like:
+  {"task": "hlcpp-migration", "args": ["--component-dir", "src/foo"],
+   "model": "gemini-2.5-pro", "temperature": 1}
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import time
+from pathlib import Path
+
+import aiohttp
+from aiohttp import web
+
+import summarize
+from batch import remove_from_visibility, village_command
+from tasks.hlcpp_migration import HlcppMigration
+
+# How often workers heartbeat and how long a lease lasts without one.
+HEARTBEAT_SECONDS = 30
+LEASE_SECONDS = 120
+# How long a run that has lost its lease has to stop before it's killed.
+KILL_SECONDS = 30
+# Jobs whose workers keep disappearing are given up on.
+MAX_ATTEMPTS = 3
+# How long idle workers wait before asking for another job.
+POLL_SECONDS = 10
+# The fields of a job and their types.
+JOB_FIELDS = {"task": str, "args": list, "model": str, "temperature": (int, float)}
+
+
+def check_job(job) -> None:
+    """Raise ValueError if a job isn't one a worker can run."""
+    if not isinstance(job, dict):
+        raise ValueError(f"A job must be an object, not {job!r}")
+    for field, kind in JOB_FIELDS.items():
+        if not isinstance(job.get(field), kind):
+            raise ValueError(f"Job {job!r} has a missing or invalid {field}")
+    if not all(isinstance(arg, str) for arg in job["args"]):
+        raise ValueError(f"Job {job!r} has args that aren't strings")
+    if job["task"] == HlcppMigration.NAME:
+        migration_target(job["args"])
+
+
+def migration_target(task_args: list[str]) -> str:
+    """The component a migration job migrates, found the way the task will."""
+    parser = argparse.ArgumentParser(add_help=False)
+    HlcppMigration.register_arguments(parser)
+    try:
+        args, _ = parser.parse_known_args(task_args)
+    except SystemExit:
+        raise ValueError(f"Bad arguments for {HlcppMigration.NAME}: {task_args}")
+    return args.component_target or f"//{args.component_dir}"
+
+
+class Queue:
+    def __init__(self, path: Path):
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            + "id INTEGER PRIMARY KEY, job TEXT, state TEXT, worker TEXT, "
+            + "attempts INTEGER, expires REAL, result TEXT)"
+        )
+        self.db.commit()
+
+    def add(self, job: dict) -> int:
+        cursor = self.db.execute(
+            "INSERT INTO jobs (job, state, attempts) VALUES (?, 'queued', 0)",
+            (json.dumps(job),),
+        )
+        self.db.commit()
+        return cursor.lastrowid
+
+    def lease(self, worker: str) -> dict | None:
+        """Lease the oldest queued job."""
+        row = self.db.execute(
+            "SELECT id, job FROM jobs WHERE state = 'queued' ORDER BY id LIMIT 1"
+        ).fetchone()
+        if row is None:
+            return None
+        self.db.execute(
+            "UPDATE jobs SET state = 'leased', worker = ?, attempts = attempts + 1, "
+            + "expires = ? WHERE id = ?",
+            (worker, time.time() + LEASE_SECONDS, row["id"]),
+        )
+        self.db.commit()
+        return {**json.loads(row["job"]), "id": row["id"]}
+
+    def heartbeat(self, id: int, worker: str) -> bool:
+        """Extend a lease. Returns False if the worker no longer holds it."""
+        cursor = self.db.execute(
+            "UPDATE jobs SET expires = ? "
+            + "WHERE id = ? AND worker = ? AND state = 'leased'",
+            (time.time() + LEASE_SECONDS, id, worker),
+        )
+        self.db.commit()
+        return cursor.rowcount == 1
+
+    def finish(self, id: int, worker: str, result: dict) -> bool:
+        cursor = self.db.execute(
+            "UPDATE jobs SET state = 'done', result = ? "
+            + "WHERE id = ? AND worker = ? AND state = 'leased'",
+            (json.dumps(result), id, worker),
+        )
+        self.db.commit()
+        return cursor.rowcount == 1
+
+    def requeue_expired(self) -> int:
+        """Put jobs whose workers have stopped heartbeating back on the queue."""
+        now = time.time()
+        self.db.execute(
+            "UPDATE jobs SET state = 'failed', result = ? "
+            + "WHERE state = 'leased' AND expires < ? AND attempts >= ?",
+            (json.dumps({"status": "LOST"}), now, MAX_ATTEMPTS),
+        )
+        cursor = self.db.execute(
+            "UPDATE jobs SET state = 'queued', worker = NULL "
+            + "WHERE state = 'leased' AND expires < ?",
+            (now,),
+        )
+        self.db.commit()
+        return cursor.rowcount
+
+    def jobs(self) -> list[dict]:
+        return [
+            {
+                "id": row["id"],
+                "job": json.loads(row["job"]),
+                "state": row["state"],
+                "worker": row["worker"],
+                "attempts": row["attempts"],
+                "result": json.loads(row["result"]) if row["result"] else None,
+            }
+            for row in self.db.execute("SELECT * FROM jobs ORDER BY id")
+        ]
+
+
+class Coordinator:
+    def __init__(self, queue: Queue, output_dir: Path):
+        self.queue = queue
+        self.output_dir = output_dir
+        self.app = web.Application(client_max_size=1 << 30)
+        self.app.add_routes(
+            [
+                web.get("/jobs", self.jobs_handler),
+                web.post("/jobs", self.add_handler),
+                web.post("/lease", self.lease_handler),
+                web.post("/jobs/{id}/heartbeat", self.heartbeat_handler),
+                web.put("/jobs/{id}/recording", self.recording_handler),
+            ]
+        )
+        self.app.on_startup.append(self.start_reaper)
+
+    async def start_reaper(self, app):
+        async def reap():
+            while True:
+                await asyncio.sleep(HEARTBEAT_SECONDS)
+                requeued = self.queue.requeue_expired()
+                if requeued:
+                    print(f"COORDINATOR: requeued {requeued} jobs from lost workers")
+
+        app["reaper"] = asyncio.create_task(reap())
+
+    async def jobs_handler(self, request):
+        return web.json_response(self.queue.jobs())
+
+    async def add_handler(self, request):
+        try:
+            jobs = await request.json()
+            if isinstance(jobs, dict):
+                jobs = [jobs]
+            if not isinstance(jobs, list):
+                raise ValueError("Expected a job or a list of jobs")
+            for job in jobs:
+                check_job(job)
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=str(e))
+        return web.json_response([self.queue.add(job) for job in jobs])
+
+    async def lease_handler(self, request):
+        worker = (await request.json())["worker"]
+        job = self.queue.lease(worker)
+        if job is None:
+            return web.Response(status=204)
+        print(f"COORDINATOR: job {job['id']} leased to {worker}")
+        return web.json_response(job)
+
+    async def heartbeat_handler(self, request):
+        worker = (await request.json())["worker"]
+        if not self.queue.heartbeat(int(request.match_info["id"]), worker):
+            # the lease expired and the job has gone to someone else
+            raise web.HTTPConflict()
+        return web.json_response({})
+
+    async def recording_handler(self, request):
+        id = int(request.match_info["id"])
+        worker = request.query["worker"]
+        recording = self.output_dir / f"{id}.json"
+        partial = recording.with_suffix(".partial")
+        with open(partial, "wb") as f:
+            async for chunk in request.content.iter_chunked(1 << 20):
+                f.write(chunk)
+        result: dict = {
+            "returncode": int(request.query["returncode"]),
+            "recording": str(recording),
+        }
+        if "visibility_removed" in request.query:
+            result["visibility_removed"] = request.query["visibility_removed"] == "1"
+        if "error" in request.query:
+            # the worker couldn't run the job
+            result.update(status="ERROR", error=request.query["error"])
+        else:
+            try:
+                s = summarize.summarize(partial)
+                result.update(status=s.status, duration=s.duration, tokens=s.tokens)
+            except Exception as e:
+                result.update(status="ERROR", error=repr(e))
+        if not self.queue.finish(id, worker, result):
+            partial.unlink()
+            raise web.HTTPConflict()
+        partial.rename(recording)
+        print(f"COORDINATOR: job {id} {result['status']} on {worker}")
+        return web.json_response(result)
+
+    def run_forever(self, port: int):
+        web.run_app(self.app, port=port)
+
+
+class Worker:
+    def __init__(self, args: argparse.Namespace, name: str):
+        self.url = args.coordinator.rstrip("/")
+        self.name = name
+        self.work_dir: Path = args.work_dir
+        self.run_args: list[str] = []
+        if args.build_lock:
+            self.run_args.extend(["--build-lock", args.build_lock])
+        if args.tool_cache:
+            self.run_args.extend(["--tool-cache", str(args.tool_cache)])
+
+    async def lease(self, session: aiohttp.ClientSession) -> dict | None:
+        async with session.post(
+            f"{self.url}/lease", json={"worker": self.name}
+        ) as response:
+            response.raise_for_status()
+            if response.status == 204:
+                return None
+            return await response.json()
+
+    async def heartbeat(
+        self,
+        session: aiohttp.ClientSession,
+        id: int,
+        process: asyncio.subprocess.Process,
+    ):
+        """Heartbeat until cancelled, killing the run if the lease is lost."""
+        while True:
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+            try:
+                async with session.post(
+                    f"{self.url}/jobs/{id}/heartbeat", json={"worker": self.name}
+                ) as response:
+                    if response.status == 409:
+                        print(f"WORKER {self.name}: lost the lease on job {id}")
+                        # give the run a chance to stop its build
+                        process.terminate()
+                        try:
+                            await asyncio.wait_for(process.wait(), KILL_SECONDS)
+                        except asyncio.TimeoutError:
+                            process.kill()
+                        return
+            except aiohttp.ClientError as e:
+                # keep going; the coordinator may be back before the lease expires
+                print(f"WORKER {self.name}: heartbeat failed: {e!r}")
+
+    async def run_job(self, session: aiohttp.ClientSession, job: dict):
+        id = job["id"]
+        recording = self.work_dir / f"{id}.json"
+        run_args = [
+            "--model",
+            job["model"],
+            "--temperature",
+            str(job["temperature"]),
+            *self.run_args,
+        ]
+        task_args = job["args"]
+        target = None
+        if job["task"] == HlcppMigration.NAME:
+            target = migration_target(task_args)
+            task_args = [*task_args, "--leave-visibility"]
+        command = village_command(job["task"], task_args, recording, run_args)
+        print(f"WORKER {self.name}: running job {id}: {job['task']} {job['args']}")
+        with open(self.work_dir / f"{id}.log", "wb") as log:
+            process = await asyncio.create_subprocess_exec(
+                *command, stdout=log, stderr=asyncio.subprocess.STDOUT
+            )
+            heartbeat = asyncio.create_task(self.heartbeat(session, id, process))
+            returncode = await process.wait()
+            heartbeat.cancel()
+
+        params = {"returncode": str(returncode)}
+        if target is not None and self.succeeded(recording):
+            # nothing else in this worker touches the file while this runs
+            removed = remove_from_visibility(target)
+            params["visibility_removed"] = "1" if removed else "0"
+        body = recording.read_bytes() if recording.exists() else b"{}"
+        await self.upload(session, id, params, body)
+
+    @staticmethod
+    def succeeded(recording: Path) -> bool:
+        try:
+            return summarize.summarize(recording).status == "SUCCESS"
+        except Exception:
+            return False
+
+    async def upload(
+        self, session: aiohttp.ClientSession, id: int, params: dict, body: bytes
+    ):
+        async with session.put(
+            f"{self.url}/jobs/{id}/recording",
+            params={"worker": self.name, **params},
+            data=body,
+        ) as response:
+            if response.status == 409:
+                print(f"WORKER {self.name}: job {id} was given to another worker")
+            else:
+                response.raise_for_status()
+
+    async def run(self, parallel: int):
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        async with aiohttp.ClientSession() as session:
+
+            async def slot():
+                while True:
+                    try:
+                        job = await self.lease(session)
+                    except aiohttp.ClientError as e:
+                        print(f"WORKER {self.name}: couldn't lease a job: {e!r}")
+                        job = None
+                    if job is None:
+                        await asyncio.sleep(POLL_SECONDS)
+                        continue
+                    try:
+                        await self.run_job(session, job)
+                    except aiohttp.ClientError as e:
+                        # the lease will expire and the job will be requeued
+                        print(f"WORKER {self.name}: job {job['id']} failed: {e!r}")
+                    except Exception as e:
+                        # a job that can't be run would fail on any worker
+                        print(
+                            f"WORKER {self.name}: couldn't run job {job['id']}: {e!r}"
+                        )
+                        params = {"returncode": "-1", "error": repr(e)}
+                        try:
+                            await self.upload(session, job["id"], params, b"{}")
+                        except aiohttp.ClientError as e:
+                            print(f"WORKER {self.name}: couldn't report it: {e!r}")
+
+            await asyncio.gather(*[slot() for _ in range(parallel)])
+
+
+def read_jobs(path: Path) -> list[dict]:
+    """Read jobs from a file, one json object per line."""
+    jobs = [json.loads(line) for line in open(path) if line.strip()]
+    for job in jobs:
+        check_job(job)
+    return jobs
+
+
+def coordinator_command(args: argparse.Namespace):
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    queue = Queue(args.output_dir / "queue.sqlite")
+    if args.jobs:
+        for job in read_jobs(args.jobs):
+            queue.add(job)
+    Coordinator(queue, args.output_dir).run_forever(args.port)
+
+
+def worker_command(args: argparse.Namespace):
+    name = args.name or f"{socket.gethostname()}-{os.getpid()}"
+    asyncio.run(Worker(args, name).run(args.parallel))
+
+
+def add_subcommand(subcommands: argparse._SubParsersAction):
+    parser = subcommands.add_parser(
+        "coordinator", help="Serve a queue of runs to workers."
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=Path,
+        required=True,
+        help="Where to keep the queue and the recordings workers upload.",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=Path,
+        help="Jobs to add to the queue, one json object per line with task, "
+        + "args, model and temperature.",
+    )
+    parser.add_argument("--port", type=int, default=8090, help="The port to serve on.")
+
+    parser = subcommands.add_parser(
+        "worker", help="Run jobs from a coordinator's queue."
+    )
+    parser.add_argument(
+        "--coordinator",
+        type=str,
+        default="http://localhost:8090",
+        help="The coordinator's URL.",
+    )
+    parser.add_argument(
+        "--name", type=str, help="The worker's name. Defaults to host-pid."
+    )
+    parser.add_argument(
+        "--work-dir",
+        type=Path,
+        required=True,
+        help="Where to put recordings and logs while jobs run.",
+    )
+    parser.add_argument(
+        "--parallel",
+        type=int,
+        default=1,
+        help="How many jobs to run at once, in the same checkout.",
+    )
+    parser.add_argument(
+        "--build-lock",
+        type=str,
+        help="A file to lock while building, shared by the jobs on this host.",
+    )
+    parser.add_argument(
+        "--tool-cache", type=Path, help="A tool result cache shared by the jobs."
+    )